@@ -0,0 +1,256 @@
+import asyncio
+import http.client
+import io
+import json
+import time
+from typing import Dict, List, Tuple
+
+import chord_client
+import metrics
+from chord_client import ACCEPT_COMPRESSED, CON_TIMEOUT, READ_TIMEOUT, Response
+from maintenance import count_message
+from peers import split_address
+from storage import value_to_json
+from tracing import TRACE_ID_HEADER, current_trace
+
+Connection = Tuple[asyncio.StreamReader, asyncio.StreamWriter]
+
+
+async def read_head(
+    reader: asyncio.StreamReader,
+) -> Tuple[str, http.client.HTTPMessage]:
+    """
+    Reads the first line and the headers of an HTTP message.
+    """
+    head = await reader.readuntil(b"\r\n\r\n")
+    first_line, _, header_lines = head.partition(b"\r\n")
+    headers = http.client.parse_headers(io.BytesIO(header_lines))
+    return first_line.decode("latin-1"), headers
+
+
+async def read_body(reader: asyncio.StreamReader, headers) -> bytes:
+    """
+    Reads an HTTP message body framed by Content-Length or chunked encoding.
+    """
+    if headers.get("Transfer-Encoding", "").lower() == "chunked":
+        chunks = []
+        while True:
+            size = int((await reader.readuntil(b"\r\n")).split(b";")[0], 16)
+            if size == 0:
+                await reader.readuntil(b"\r\n")
+                return b"".join(chunks)
+            chunks.append(await reader.readexactly(size))
+            await reader.readexactly(2)
+
+    content_length = int(headers.get("Content-Length", 0))
+    return await reader.readexactly(content_length)
+
+
+class AsyncConnectionPool:
+    """
+    Keeps idle keep-alive connections to each peer, like
+    chord_client.ConnectionPool but for asyncio streams.
+    """
+
+    def __init__(
+        self,
+        max_size: int = chord_client.POOL_SIZE,
+        idle_timeout: float = chord_client.POOL_IDLE_TIMEOUT,
+    ):
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.idle: Dict[str, List[Tuple[Connection, float]]] = {}
+        self.stats = {
+            "created": 0,
+            "reused": 0,
+            "evicted": 0,
+            "discarded": 0,
+            "failed": 0,
+        }
+
+    async def acquire(self, node: str) -> Tuple[Connection, bool]:
+        """
+        Get a connection to the node, and whether it is a reused one.
+        """
+        now = time.monotonic()
+        idle = self.idle.get(node)
+        while idle:
+            conn, last_used = idle.pop()
+            if now - last_used <= self.idle_timeout and not conn[0].at_eof():
+                self.stats["reused"] += 1
+                return conn, True
+            self.stats["evicted"] += 1
+            conn[1].close()
+
+        self.stats["created"] += 1
+        host, port = node.rsplit(":", 1)
+        conn = await asyncio.wait_for(
+            asyncio.open_connection(host, int(port)), CON_TIMEOUT
+        )
+        return conn, False
+
+    def release(self, node: str, conn: Connection):
+        idle = self.idle.setdefault(node, [])
+        if len(idle) >= self.max_size:
+            self.stats["discarded"] += 1
+            conn[1].close()
+        else:
+            idle.append((conn, time.monotonic()))
+
+    def get_stats(self) -> dict:
+        stats = dict(self.stats)
+        stats["idle"] = sum(len(idle) for idle in self.idle.values())
+        stats["peers"] = len(self.idle)
+        return stats
+
+
+pool = AsyncConnectionPool()
+
+
+def configure(
+    pool_size: int = chord_client.POOL_SIZE,
+    idle_timeout: float = chord_client.POOL_IDLE_TIMEOUT,
+):
+    global pool
+    pool = AsyncConnectionPool(pool_size, idle_timeout)
+
+
+async def request(
+    method: str,
+    node: str,
+    path: str,
+    body: str | bytes | None = None,
+    headers: dict | None = None,
+) -> Response | None:
+    """
+    Send a request to a node over a pooled connection without blocking the
+    event loop. Returns None if the node can't be reached.
+    """
+    data = body.encode("utf-8") if isinstance(body, str) else body or b""
+    endpoint, prefix = split_address(node)
+    head = f"{method} {prefix}{path} HTTP/1.1\r\nHost: {endpoint}\r\n"
+    if body is not None or method in ("PUT", "POST"):
+        head += f"Content-Length: {len(data)}\r\n"
+    if trace_id := current_trace.get():
+        head += f"{TRACE_ID_HEADER}: {trace_id}\r\n"
+    head += "".join(f"{name}: {value}\r\n" for name, value in (headers or {}).items())
+    message = (head + "\r\n").encode("latin-1") + data
+    count_message()
+    started = time.monotonic()
+
+    # A reused connection may have been closed by the peer while idle,
+    # so retry once on a fresh connection
+    for attempt in range(2):
+        try:
+            conn, reused = await pool.acquire(endpoint)
+        except (OSError, asyncio.TimeoutError):
+            break
+
+        reader, writer = conn
+        try:
+            writer.write(message)
+            await writer.drain()
+            status_line, headers = await asyncio.wait_for(
+                read_head(reader), READ_TIMEOUT
+            )
+            content = await asyncio.wait_for(read_body(reader, headers), READ_TIMEOUT)
+        except asyncio.TimeoutError:
+            writer.close()
+            break
+        except (OSError, asyncio.IncompleteReadError, asyncio.LimitOverrunError):
+            writer.close()
+            if reused and attempt == 0:
+                continue
+            break
+
+        _, status, reason = (status_line.split(" ", 2) + [""])[:3]
+        if headers.get("Connection", "").lower() == "close":
+            writer.close()
+        else:
+            pool.release(endpoint, conn)
+        elapsed = time.monotonic() - started
+        chord_client.liveness.mark_alive(node, elapsed)
+        metrics.CLIENT_REQUESTS.inc(endpoint, metrics.client_result(int(status)))
+        metrics.CLIENT_REQUEST_SECONDS.observe(elapsed, endpoint)
+        return Response(int(status), reason, headers, content, elapsed)
+
+    pool.stats["failed"] += 1
+    chord_client.liveness.mark_suspect(node)
+    metrics.CLIENT_REQUESTS.inc(endpoint, metrics.client_result(None))
+    return None
+
+
+async def is_alive(node: str) -> bool:
+    """
+    Check if a node is alive, only pinging it if it hasn't been heard from
+    recently.
+    """
+    alive = chord_client.liveness.get(node)
+    if alive is not None:
+        return alive
+
+    response = await get_status(node)
+    return response is not None and response.status_code == 200
+
+
+async def get_status(node: str) -> Response | None:
+    return await request("GET", node, "/status")
+
+
+async def get_predecessor(node: str) -> Response | None:
+    return await request("GET", node, "/predecessor")
+
+
+async def get_value(node: str, key: str, check_owner: bool = False) -> Response | None:
+    query = "?check_owner=1" if check_owner else ""
+    return await request("GET", node, f"/value/{key}{query}", headers=ACCEPT_COMPRESSED)
+
+
+async def get_successor_list(node: str) -> Response | None:
+    return await request("GET", node, "/successor_list")
+
+
+async def get_predecessor_list(node: str) -> Response | None:
+    return await request("GET", node, "/predecessor_list")
+
+
+async def find_successor(
+    node: str, id: int, mode: str | None = None
+) -> Response | None:
+    query = f"?mode={mode}" if mode else ""
+    return await request("GET", node, f"/find_successor/{id}{query}")
+
+
+async def get_next_hop(node: str, id: int, exclude=()) -> Response | None:
+    query = f"?exclude={','.join(exclude)}" if exclude else ""
+    return await request("GET", node, f"/next_hop/{id}{query}")
+
+
+async def notify(node: str, predecessor: str) -> Response | None:
+    return await request("PUT", node, "/notify", predecessor)
+
+
+async def stabilize(node: str, predecessor: str) -> Response | None:
+    return await request("PUT", node, "/stabilize", predecessor)
+
+
+async def set_value(
+    node: str,
+    key: str,
+    value: bytes,
+    check_owner: bool = False,
+    content_type: str | None = None,
+    encoding: str | None = None,
+) -> Response | None:
+    query = "?check_owner=1" if check_owner else ""
+    headers = chord_client.value_headers(content_type, encoding)
+    return await request("PUT", node, f"/value/{key}{query}", value, headers)
+
+
+async def get_replica(node: str, key: str) -> Response | None:
+    return await request("GET", node, f"/replica/{key}", headers=ACCEPT_COMPRESSED)
+
+
+async def set_replicas(node: str, pairs: Dict[str, bytes]) -> Response | None:
+    body = {key: value_to_json(value) for key, value in pairs.items()}
+    return await request("PUT", node, "/batch/replica", json.dumps(body))
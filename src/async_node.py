@@ -0,0 +1,426 @@
+import asyncio
+import json
+import logging as log
+import random
+import time
+from typing import Dict, List, Tuple
+
+import async_client
+import metrics
+from chord_client import NOT_OWNER, Response
+from chord_node import (
+    ChordNode,
+    LookupResult,
+    LOOKUP_ITERATIVE,
+    LOOKUP_RECURSIVE,
+    MAX_ITERATIVE_HOPS,
+    read_lookup_path,
+)
+from maintenance import MaintenanceTask
+from tracing import format_hop, read_trace
+from vnodes import VirtualNodes
+
+
+async def run_periodic_coroutine(func, task: MaintenanceTask):
+    """Run a coroutine function periodically with random delays, when its task is due"""
+    while True:
+        await asyncio.sleep(random.uniform(task.min_delay, task.max_delay))
+        if not task.due():
+            continue
+        try:
+            name = func.__name__.removesuffix("_async")
+            with metrics.PERIODIC_SECONDS.time(name), task.running():
+                await func()
+        except Exception:
+            log.exception(f"Periodic function {func.__name__} failed")
+
+
+class AsyncChordNode(ChordNode):
+    """
+    A ChordNode whose periodic functions and lookups run as coroutines on an
+    event loop, using the non-blocking client.
+    """
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, *args, **kwargs):
+        self.loop = loop
+        self.tasks: List[asyncio.Task] = []
+        super().__init__(*args, **kwargs)
+
+    def start_periodic_functions(self):
+        if self.group is not None:
+            self.group.resume(self)
+            return
+
+        # Can be called from handler threads, so schedule it on the loop
+        self.loop.call_soon_threadsafe(self.create_periodic_tasks)
+
+    def stop_periodic_functions(self):
+        if self.group is not None:
+            self.group.pause(self)
+            return
+
+        self.loop.call_soon_threadsafe(self.cancel_periodic_tasks)
+
+    def create_periodic_tasks(self):
+        tasks = self.maintenance.tasks
+        self.tasks = [
+            self.loop.create_task(
+                run_periodic_coroutine(self.stabilize_async, tasks["stabilize"])
+            ),
+            self.loop.create_task(
+                run_periodic_coroutine(self.fix_fingers_async, tasks["fix_fingers"])
+            ),
+            self.loop.create_task(
+                run_periodic_coroutine(
+                    self.check_predecessor_async, tasks["check_predecessor"]
+                )
+            ),
+        ]
+
+    def cancel_periodic_tasks(self):
+        for task in self.tasks:
+            task.cancel()
+        self.tasks = []
+
+    def get_stats(self) -> dict:
+        stats = super().get_stats()
+        stats["async_connections"] = async_client.pool.get_stats()
+        return stats
+
+    async def update_successor_list_async(self):
+        # Get the successor list of the successor
+        response = await async_client.get_successor_list(self.successor)
+        if response is None or response.status_code != 200:
+            log.warning("Failed to get successor's successor list")
+            return
+        self.set_successor_list(list(json.loads(response.text)))
+
+    async def update_predecessor_list_async(self):
+        if not self.num_replicas or self.predecessor is None:
+            self.predecessor_list = []
+            return
+        response = await async_client.get_predecessor_list(self.predecessor)
+        if response is None or response.status_code != 200:
+            log.warning("Failed to get predecessor's predecessor list")
+            return
+        self.set_predecessor_list(list(json.loads(response.text)))
+
+    async def stabilize_async(self):
+        response = await async_client.stabilize(self.successor, self.address)
+        if response is not None and response.status_code == 404:
+            await self.stabilize_separately_async()
+            return
+
+        # If successor has failed, remove it from the successor list
+        # and update our successor
+        if response is None or response.status_code != 200:
+            if not self.successor_failed():
+                return
+
+            await self.update_successor_list_async()
+            await async_client.notify(self.successor, self.address)
+
+        elif not self.apply_stabilize_reply(response.json()):
+            await self.update_successor_list_async()
+            await async_client.notify(self.successor, self.address)
+
+        await self.repair_replicas_async()
+
+    async def stabilize_separately_async(self):
+        # If successor has failed, remove it from the successor list
+        # and update our successor
+        response = await async_client.get_status(self.successor)
+        if response is None or response.status_code != 200:
+            if not self.successor_failed():
+                return
+
+            await self.update_successor_list_async()
+            await async_client.notify(self.successor, self.address)
+            await self.repair_replicas_async()
+            return
+
+        # Get our successor's predecessor
+        response = await async_client.get_predecessor(self.successor)
+        if response is None or response.status_code not in [200, 404]:
+            log.error(
+                f"Stabilize failed. Could not find predecessor of {self.successor}"
+            )
+            return
+        elif response.status_code == 200:
+            self.consider_successor(response.text)
+
+        await self.update_successor_list_async()
+
+        # Notify successor that we might be its predecessor
+        await async_client.notify(self.successor, self.address)
+
+        await self.repair_replicas_async()
+
+    async def repair_replicas_async(self):
+        await self.update_predecessor_list_async()
+        for node, pairs in self.replica_repairs():
+            response = await async_client.set_replicas(node, pairs)
+            self.repaired(node, pairs, response)
+
+    async def replicate_async(self, pairs: Dict[str, bytes]):
+        targets = self.get_replica_targets()
+        if pairs and targets:
+            await asyncio.gather(
+                *(async_client.set_replicas(node, pairs) for node in targets)
+            )
+
+    async def read_value_async(
+        self, key: str, mode: str | None, policy: str | None = None
+    ) -> Tuple[LookupResult | None, Response | None]:
+        """
+        Like ChordNode.read_value, but using the non-blocking client.
+        """
+        id = self.hash(key)
+        replica = self.choose_replica(id, policy or self.read_policy)
+        if replica:
+            if replica == self.address:
+                response = self.local_replica_response(key)
+            else:
+                response = await async_client.get_replica(replica, key)
+            if response is not None and response.status_code == 200:
+                self.count("replica_reads")
+                return LookupResult(replica, [self.address], replica=True), response
+            self.count("replica_misses")
+
+        result, response = await self.call_owner_async(
+            id, mode, lambda owner, check: async_client.get_value(owner, key, check)
+        )
+        if result and response is not None:
+            self.remember_replicas(result.successor, response)
+        return result, response
+
+    async def fix_fingers_async(self):
+        i, id = self.next_finger()
+        finger = await self.find_successor_async(id)
+        if finger:
+            if self.finger_table[i] and finger != self.finger_table[i]:
+                self.ring_changed()
+            elif finger != self.finger_table[i]:
+                self.maintenance.changed()
+            self.finger_table[i] = finger
+            self.check_full_table()
+
+        for node in self.unmeasured_candidates(i):
+            await async_client.get_status(node)
+
+        self.logger.fix_fingers()
+
+    async def check_predecessor_async(self):
+        if self.predecessor is None:
+            return
+
+        # A predecessor that stabilized with us recently is known to be alive
+        if not await async_client.is_alive(self.predecessor):
+            self.predecessor_failed()
+
+    async def closest_preceding_node_async(self, id: int, exclude=()) -> str | None:
+        for i, finger in self.preceding_fingers(id, exclude):
+            # Check that node is available
+            if not await async_client.is_alive(finger):
+                self.forget_peer(i, finger)
+                continue
+
+            return finger
+
+        log.warning(f"Can't find the closest node to {id}.")
+        return None
+
+    async def find_successor_async(
+        self, id: int, mode: str | None = None
+    ) -> str | None:
+        result = await self.lookup_async(id, mode)
+        return result.successor if result else None
+
+    async def lookup_async(
+        self, id: int, mode: str | None = None
+    ) -> LookupResult | None:
+        mode = mode or self.lookup_mode
+        if mode == LOOKUP_ITERATIVE:
+            result = await self.lookup_iterative_async(id)
+        else:
+            result = await self.lookup_recursive_async(id)
+
+        if result:
+            metrics.LOOKUP_HOPS.observe(result.hops, mode)
+            self.remember_owner(result)
+            self.add_candidates(result.path[1:] + [result.successor])
+        return result
+
+    async def call_owner_async(
+        self, id: int, mode: str | None, rpc
+    ) -> Tuple[LookupResult | None, Response | None]:
+        """
+        Like ChordNode.call_owner, but rpc returns an awaitable.
+        """
+        owner = self.owner_cache.get(id)
+        if owner:
+            response = await rpc(owner, True)
+            if response is not None and response.status_code != NOT_OWNER:
+                return LookupResult(owner, [self.address], cached=True), response
+            self.owner_cache.invalidate_owner(owner)
+
+        result = await self.lookup_async(id, mode)
+        if not result:
+            return None, None
+        return result, await rpc(result.successor, False)
+
+    async def lookup_recursive_async(self, id: int) -> LookupResult | None:
+        successor_id = self.peer_id(self.successor)
+        if self.successor_owns(id):
+            if await async_client.is_alive(self.successor):
+                self.logger.found_successor(id, successor_id)
+                return LookupResult(self.successor, [self.address])
+
+        # Forward to the closest known node, trying the next best one if it fails
+        tried = set()
+        while closest_node := await self.closest_preceding_node_async(id, tried):
+            closest_node_id = self.peer_id(closest_node)
+            self.logger.passing_successor_check(id, closest_node_id)
+            response = await async_client.find_successor(
+                closest_node, id, LOOKUP_RECURSIVE
+            )
+            if response is None:
+                log.warning(f"Closest node {closest_node_id} failed. Trying next.")
+                tried.add(closest_node)
+                continue
+
+            if response.status_code != 200:
+                log.warning(
+                    f"Failed to pass successor check to closest node {closest_node_id}."
+                )
+                return None
+            path = read_lookup_path(response, closest_node)
+            return LookupResult(
+                response.text, [self.address] + path, trace=read_trace(response)
+            )
+
+        # Pass the successor check to the successor
+        self.logger.passing_successor_check(id, successor_id)
+        response = await async_client.find_successor(
+            self.successor, id, LOOKUP_RECURSIVE
+        )
+        if response is None or response.status_code != 200:
+            log.warning(f"Failed to pass successor check to successor {successor_id}.")
+            return None
+        path = read_lookup_path(response, self.successor)
+        return LookupResult(
+            response.text, [self.address] + path, trace=read_trace(response)
+        )
+
+    async def next_hop_async(self, id: int, exclude=()) -> Tuple[bool, str] | None:
+        if self.successor_owns(id) and self.successor not in exclude:
+            if await async_client.is_alive(self.successor):
+                self.logger.found_successor(id, self.peer_id(self.successor))
+                return True, self.successor
+
+        closest_node = await self.closest_preceding_node_async(id, exclude)
+        if closest_node:
+            return False, closest_node
+
+        if self.successor in exclude or self.successor == self.address:
+            return None
+        return False, self.successor
+
+    async def lookup_iterative_async(self, id: int) -> LookupResult | None:
+        path: List[str] = []
+        # Round trip times of the next hop requests to other nodes
+        trace: List[str] = []
+        excluded = set()
+        node = self.address
+
+        while len(path) <= MAX_ITERATIVE_HOPS:
+            if node == self.address:
+                hop = await self.next_hop_async(id, excluded)
+                if hop is None:
+                    log.warning(f"Iterative lookup of {id} found no next hop.")
+                    return None
+            else:
+                started = time.perf_counter()
+                response = await async_client.get_next_hop(node, id, excluded)
+
+                # Go back and ask the previous node for another hop
+                if response is None:
+                    log.warning(f"{self.peer_id(node)} failed during lookup of {id}.")
+                    excluded.add(node)
+                    node = path.pop()
+                    if node != self.address:
+                        trace.pop()
+                    continue
+
+                if response.status_code != 200:
+                    log.warning(f"{self.peer_id(node)} found no next hop for {id}.")
+                    return None
+                hop = response.json()
+                hop = hop["done"], hop["node"]
+                trace.append(
+                    format_hop(self.peer_id(node), time.perf_counter() - started)
+                )
+
+            path.append(node)
+            done, node = hop
+            if done:
+                return LookupResult(node, path, trace=trace)
+            self.logger.passing_successor_check(id, self.peer_id(node))
+
+        log.warning(f"Iterative lookup of {id} exceeded {MAX_ITERATIVE_HOPS} hops.")
+        return None
+
+
+class AsyncVirtualNodes(VirtualNodes):
+    """
+    VirtualNodes of AsyncChordNodes, whose periodic functions run as shared
+    coroutines on the event loop.
+    """
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, *args, **kwargs):
+        self.loop = loop
+        self.tasks: List[asyncio.Task] = []
+        super().__init__(*args, **kwargs)
+
+    def create_node(self, **kwargs) -> AsyncChordNode:
+        return AsyncChordNode(self.loop, **kwargs)
+
+    async def run_all_async(self, func):
+        """
+        Run a periodic coroutine of each active vnode concurrently.
+        """
+        nodes = self.active_nodes()
+        results = await asyncio.gather(
+            *(func(node) for node in nodes), return_exceptions=True
+        )
+        for node, result in zip(nodes, results):
+            if isinstance(result, Exception):
+                log.error(f"Periodic function of {node.address} failed: {result!r}")
+
+    async def stabilize_async(self):
+        await self.run_all_async(lambda node: node.stabilize_async())
+
+    async def fix_fingers_async(self):
+        await self.run_all_async(lambda node: node.fix_fingers_async())
+
+    async def check_predecessor_async(self):
+        await self.run_all_async(lambda node: node.check_predecessor_async())
+
+    def start_periodic_functions(self):
+        self.loop.call_soon_threadsafe(self.create_periodic_tasks)
+
+    def create_periodic_tasks(self):
+        tasks = self.maintenance.tasks
+        self.tasks = [
+            self.loop.create_task(
+                run_periodic_coroutine(self.stabilize_async, tasks["stabilize"])
+            ),
+            self.loop.create_task(
+                run_periodic_coroutine(self.fix_fingers_async, tasks["fix_fingers"])
+            ),
+            self.loop.create_task(
+                run_periodic_coroutine(
+                    self.check_predecessor_async, tasks["check_predecessor"]
+                )
+            ),
+        ]
@@ -0,0 +1,496 @@
+import asyncio
+import json
+import logging as log
+import random
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+from typing import List, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+import async_client
+import metrics
+from async_client import read_body, read_head
+from async_node import AsyncChordNode, AsyncVirtualNodes
+from chord_client import NOT_OWNER
+from chord_node import LOOKUP_MODES, READ_POLICIES
+from compression import ENCODING_GZIP, ENCODINGS, accepts_encoding
+from storage import DEFAULT_CONTENT_TYPE, decode_value, encode_value
+from http_handler import (
+    KEEP_ALIVE_TIMEOUT,
+    handle_in_process,
+    lookup_headers,
+    route_label,
+)
+from tracing import (
+    TRACE_HEADER,
+    TRACE_ID_HEADER,
+    current_trace,
+    format_hop,
+    new_trace_id,
+    read_trace,
+)
+
+EXECUTOR_WORKERS = 16
+
+
+class Request:
+    """
+    A parsed HTTP request.
+    """
+
+    def __init__(
+        self, node: AsyncChordNode, method: str, path: str, headers, body: bytes
+    ):
+        self.node = node
+        self.method = method
+        self.path = path
+        self.headers = headers
+        self.body = body
+
+        url = urlsplit(path)
+        self.route = url.path
+        self.query = parse_qs(url.query)
+
+        # The part of the route after its prefix, such as the key of /value/<key>
+        self.param = ""
+
+        # Take part in the trace the request belongs to, or start one, like
+        # HTTPHandler
+        self.trace_id = headers.get(TRACE_ID_HEADER)
+        self.trace_origin = self.trace_id is None and self.starts_trace()
+        if self.trace_origin:
+            self.trace_id = new_trace_id()
+        self.trace_hops: List[str] = []
+
+    def starts_trace(self) -> bool:
+        if "trace" in self.query:
+            return True
+        return (
+            self.route.startswith("/storage/")
+            and random.random() < self.node.trace_sample
+        )
+
+    def get_content_encoding(self) -> str | None:
+        encoding = self.headers.get("Content-Encoding", "").strip().lower()
+        return None if encoding in ("", "identity") else encoding
+
+    def get_lookup_mode(self) -> str | None:
+        mode = self.query.get("mode", [None])[0]
+        if mode not in LOOKUP_MODES:
+            return None
+        return mode
+
+    def get_read_policy(self) -> str | None:
+        policy = self.query.get("read", [None])[0]
+        if policy not in READ_POLICIES:
+            return None
+        return policy
+
+
+def build_response(
+    body: bytes = b"",
+    content_type: str = "text/plain",
+    headers=None,
+    status: int = 200,
+    reason: str | None = None,
+) -> bytes:
+    """
+    Builds a raw HTTP/1.1 response framed with Content-Length.
+    """
+    if reason is None:
+        reason = HTTPStatus(status).phrase
+    lines = [
+        f"HTTP/1.1 {status} {reason}",
+        f"Content-Type: {content_type}",
+        f"Content-Length: {len(body)}",
+    ]
+    lines += [f"{name}: {value}" for name, value in (headers or {}).items()]
+    head = "\r\n".join(lines) + "\r\n\r\n"
+    return head.encode("latin-1", errors="replace") + body
+
+
+def error_response(status: int, message: str) -> bytes:
+    return build_response(message.encode("utf-8"), status=status, reason=message)
+
+
+class AsyncHTTPServer:
+    """
+    Serves the same routes as HTTPHandler on an asyncio event loop.
+    Node to node and storage routes are handled by coroutines, the rest are run
+    through HTTPHandler on a thread pool.
+    """
+
+    def __init__(self, vnodes: AsyncVirtualNodes, executor: ThreadPoolExecutor):
+        self.vnodes = vnodes
+        self.executor = executor
+        self.routes = {
+            ("GET", "/status"): self.get_status,
+            ("GET", "/successor"): self.get_successor,
+            ("GET", "/predecessor"): self.get_predecessor,
+            ("GET", "/successor_list"): self.get_successor_list,
+            ("GET", "/predecessor_list"): self.get_predecessor_list,
+            ("PUT", "/notify"): self.put_notify,
+            ("PUT", "/stabilize"): self.put_stabilize,
+        }
+        self.prefix_routes = [
+            ("GET", "/find_successor/", self.get_find_successor),
+            ("GET", "/next_hop/", self.get_next_hop),
+            ("GET", "/value/", self.get_value),
+            ("GET", "/replica/", self.get_replica),
+            ("GET", "/storage/", self.get_storage),
+            ("PUT", "/value/", self.put_value),
+            ("PUT", "/storage/", self.put_storage),
+        ]
+
+    async def serve(self, host: str, port: int):
+        server = await asyncio.start_server(self.handle_connection, host, port)
+        async with server:
+            await server.serve_forever()
+
+    async def handle_connection(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ):
+        client_address = writer.get_extra_info("peername")
+        try:
+            # Serve requests until the client closes the connection or goes idle
+            while True:
+                request_line, headers = await asyncio.wait_for(
+                    read_head(reader), KEEP_ALIVE_TIMEOUT
+                )
+                body = await read_body(reader, headers)
+                method, path, _ = request_line.split(" ", 2)
+
+                node, route_path = self.vnodes.resolve(path)
+                if node is None:
+                    writer.write(error_response(404, "Unknown vnode"))
+                    await writer.drain()
+                    continue
+
+                request = Request(node, method, route_path, headers, body)
+                response, close = await self.dispatch(request, path, client_address)
+                if response is None:
+                    break
+                writer.write(response)
+                await writer.drain()
+
+                if close or headers.get("Connection", "").lower() == "close":
+                    break
+        except (
+            asyncio.TimeoutError,
+            asyncio.IncompleteReadError,
+            asyncio.LimitOverrunError,
+            OSError,
+            ValueError,
+        ):
+            pass
+        finally:
+            writer.close()
+
+    async def dispatch(
+        self, request: Request, path: str, client_address
+    ) -> Tuple[bytes | None, bool]:
+        """
+        Runs the route of the request, given the path it was sent to with its
+        vnode prefix. Returns the response, or None if the connection should
+        be dropped, and whether to close the connection.
+        """
+        # Only sim-recover should be available when simulating a crash
+        if request.node.sim_crash and request.route != "/sim-recover":
+            return None, True
+
+        handler = self.routes.get((request.method, request.route))
+        if handler is None:
+            for method, prefix, prefix_handler in self.prefix_routes:
+                if request.method == method and request.route.startswith(prefix):
+                    request.param = request.route[len(prefix) :]
+                    handler = prefix_handler
+                    break
+
+        if handler is not None:
+            started = time.perf_counter()
+            token = current_trace.set(request.trace_id)
+            try:
+                response = await handler(request)
+            except (ValueError, IndexError):
+                response = error_response(400, "Invalid key format")
+            finally:
+                current_trace.reset(token)
+            if request.trace_id and response.startswith(b"HTTP/1.1 200"):
+                response = self.add_trace_headers(request, response, started)
+
+            # The status code follows "HTTP/1.1 "
+            labels = (request.method, route_label(request.route))
+            metrics.HTTP_REQUESTS.inc(*labels, response[9:12].decode())
+            metrics.HTTP_REQUEST_SECONDS.observe(time.perf_counter() - started, *labels)
+            return response, False
+
+        # Run the remaining routes through the threaded handler
+        headers = {
+            name: value
+            for name, value in request.headers.items()
+            if name.lower() not in ("content-length", "transfer-encoding")
+        }
+        headers["Content-Length"] = str(len(request.body))
+        return await asyncio.get_running_loop().run_in_executor(
+            self.executor,
+            handle_in_process,
+            self.vnodes,
+            request.method,
+            path,
+            headers,
+            request.body,
+            client_address,
+        )
+
+    def add_trace_headers(
+        self, request: Request, response: bytes, started: float
+    ) -> bytes:
+        """
+        Adds the trace headers of HTTPHandler.trace_headers to a response.
+        """
+        hops = [format_hop(request.node.id, time.perf_counter() - started)]
+        headers = {TRACE_HEADER: ",".join(hops + request.trace_hops)}
+        if request.trace_origin:
+            headers[TRACE_ID_HEADER] = request.trace_id
+            request.node.logger.trace(
+                request.trace_id, route_label(request.route), hops + request.trace_hops
+            )
+
+        head_end = response.index(b"\r\n\r\n")
+        lines = "".join(f"\r\n{name}: {value}" for name, value in headers.items())
+        return response[:head_end] + lines.encode("latin-1") + response[head_end:]
+
+    async def get_status(self, request: Request) -> bytes:
+        return build_response()
+
+    async def get_successor(self, request: Request) -> bytes:
+        response = await async_client.get_status(request.node.successor)
+        if response is None or response.status_code != 200:
+            return error_response(404, "Can't reach successor")
+        return build_response(request.node.successor.encode())
+
+    async def get_predecessor(self, request: Request) -> bytes:
+        predecessor = request.node.predecessor
+        if predecessor is None:
+            return error_response(404, f"{request.node.id} does not have a predecessor")
+        return build_response(predecessor.encode("utf-8"))
+
+    async def get_successor_list(self, request: Request) -> bytes:
+        body = json.dumps(request.node.successor_list).encode()
+        return build_response(body, "application/json")
+
+    async def get_predecessor_list(self, request: Request) -> bytes:
+        body = json.dumps(request.node.predecessor_list).encode()
+        return build_response(body, "application/json")
+
+    async def get_find_successor(self, request: Request) -> bytes:
+        key = int(request.param)
+        result = await request.node.lookup_async(key, request.get_lookup_mode())
+        if not result:
+            return error_response(404, f"Couldn't find owner of key '{key}'")
+        request.trace_hops = result.trace
+        return build_response(
+            result.successor.encode("utf-8"), headers=lookup_headers(result)
+        )
+
+    async def get_next_hop(self, request: Request) -> bytes:
+        key = int(request.param)
+        exclude = request.query.get("exclude", [""])[0].split(",")
+        hop = await request.node.next_hop_async(key, {node for node in exclude if node})
+        if hop is None:
+            return error_response(404, f"No next hop towards key '{key}'")
+
+        done, node = hop
+        body = json.dumps({"done": done, "node": node}).encode()
+        return build_response(body, "application/json")
+
+    def unsupported_encoding(self, request: Request) -> bytes | None:
+        """
+        Gets an error if the request body has a content encoding the node
+        can't decode.
+        """
+        encoding = request.get_content_encoding()
+        if encoding is None or encoding in ENCODINGS:
+            return None
+        return error_response(415, f"Unsupported content encoding '{encoding}'")
+
+    def misdirected(self, request: Request) -> bytes | None:
+        """
+        Gets a 'not owner' error if the request asks the node to check that it
+        owns the key, and it doesn't.
+        """
+        key = request.param
+        if "check_owner" not in request.query or request.node.owns(
+            request.node.hash(key)
+        ):
+            return None
+        return error_response(
+            NOT_OWNER, f"{request.node.id} is not the owner of '{key}'"
+        )
+
+    async def get_value(self, request: Request) -> bytes:
+        key = request.param
+        if error := self.misdirected(request):
+            return error
+
+        value = request.node.get_value(key)
+        if value is None:
+            return error_response(404, f"{request.node.id} is not the owner of '{key}'")
+        return self.value_response(request, value, request.node.replica_headers())
+
+    async def get_replica(self, request: Request) -> bytes:
+        key = request.param
+        value = request.node.get_replica_value(key)
+        if value is None:
+            return error_response(404, f"{request.node.id} has no replica of '{key}'")
+        return self.value_response(request, value)
+
+    def value_response(self, request: Request, value: bytes, headers=None) -> bytes:
+        """
+        Builds the response of a stored value, like HTTPHandler.respond_value.
+        """
+        data, content_type, encoding = decode_value(value)
+        return self.decoded_response(request, data, content_type, encoding, headers)
+
+    def decoded_response(
+        self,
+        request: Request,
+        data: bytes,
+        content_type: str,
+        encoding: str | None,
+        headers=None,
+    ) -> bytes:
+        """
+        Builds the response of a value with its encoding, decompressing it if
+        the client doesn't accept the encoding.
+        """
+        accepted = request.headers.get("Accept-Encoding")
+        if encoding and accepts_encoding(accepted, encoding):
+            headers = {**(headers or {}), "Content-Encoding": encoding}
+        elif encoding:
+            try:
+                data = request.node.compressor.decompress(data)
+            except zlib.error:
+                return error_response(500, "Stored value can't be decompressed")
+        return build_response(data, content_type, headers)
+
+    async def get_storage(self, request: Request) -> bytes:
+        raw_key = request.param
+        key = request.node.hash(raw_key)
+        request.node.logger.log_client_request("get_storage", key)
+
+        result, response = await request.node.read_value_async(
+            raw_key, request.get_lookup_mode(), request.get_read_policy()
+        )
+        if not result:
+            return error_response(404, f"Couldn't find the owner of key '{key}'")
+        if response is None:
+            return error_response(500, f"Couldn't connect to owner of key '{key}'")
+        if response.status_code != 200:
+            return error_response(response.status_code, response.reason)
+
+        request.trace_hops = result.trace + read_trace(response)
+        content_type = response.headers.get("Content-Type", DEFAULT_CONTENT_TYPE)
+        return self.decoded_response(
+            request,
+            response.content,
+            content_type,
+            response.headers.get("Content-Encoding"),
+            lookup_headers(result),
+        )
+
+    async def put_notify(self, request: Request) -> bytes:
+        if not request.body:
+            return error_response(400, "Empty request body")
+        try:
+            predecessor = request.body.decode("utf-8").strip()
+        except UnicodeDecodeError:
+            return error_response(400, "Invalid UTF-8 encoding")
+
+        request.node.notify(predecessor)
+        return build_response()
+
+    async def put_stabilize(self, request: Request) -> bytes:
+        if not request.body:
+            return error_response(400, "Empty request body")
+        try:
+            predecessor = request.body.decode("utf-8").strip()
+        except UnicodeDecodeError:
+            return error_response(400, "Invalid UTF-8 encoding")
+
+        reply = request.node.stabilize_reply(predecessor)
+        return build_response(json.dumps(reply).encode(), "application/json")
+
+    async def put_value(self, request: Request) -> bytes:
+        if not request.body:
+            return error_response(400, "Empty request body")
+        if error := self.misdirected(request):
+            return error
+        if error := self.unsupported_encoding(request):
+            return error
+
+        value = encode_value(
+            request.body,
+            request.headers.get("Content-Type"),
+            request.get_content_encoding(),
+        )
+        request.node.insert_value(request.param, value)
+        await request.node.replicate_async({request.param: value})
+        return build_response()
+
+    async def put_storage(self, request: Request) -> bytes:
+        raw_key = request.param
+        key = request.node.hash(raw_key)
+        request.node.logger.log_client_request("put_storage", key=key)
+
+        if not request.body:
+            return error_response(400, "Empty request body")
+        if error := self.unsupported_encoding(request):
+            return error
+        value = request.body
+        content_type = request.headers.get("Content-Type")
+        encoding = request.get_content_encoding()
+
+        # Like HTTPHandler.put_storage, but the body is already in memory
+        body, body_encoding = value, encoding
+        if encoding is None:
+            compressed = request.node.compressor.compress(
+                value, content_type or DEFAULT_CONTENT_TYPE
+            )
+            if compressed is not None:
+                body, body_encoding = compressed, ENCODING_GZIP
+
+        result, response = await request.node.call_owner_async(
+            key,
+            request.get_lookup_mode(),
+            lambda owner, check: async_client.set_value(
+                owner, raw_key, body, check, content_type, body_encoding
+            ),
+        )
+        if not result:
+            return error_response(400, f"Couldn't find owner of key '{key}'")
+        if response is None:
+            return error_response(500, "Error occured while setting value")
+        if response.status_code != 200:
+            return error_response(response.status_code, response.reason)
+
+        headers = lookup_headers(result)
+        if encoding:
+            headers["Content-Encoding"] = encoding
+        request.trace_hops = result.trace + read_trace(response)
+        return build_response(value, content_type or DEFAULT_CONTENT_TYPE, headers)
+
+
+async def serve(ip: str, port: int, m: int, vnodes: int = 1, **node_options):
+    """
+    Runs the vnodes of a process on the asyncio engine until cancelled.
+    """
+    loop = asyncio.get_running_loop()
+    group = AsyncVirtualNodes(loop, ip, port, m, vnodes, **node_options)
+
+    executor = ThreadPoolExecutor(max_workers=EXECUTOR_WORKERS)
+    server = AsyncHTTPServer(group, executor)
+    log.info(f"Asyncio HTTP server started: {ip}:{port}")
+    await server.serve("0.0.0.0", port)
@@ -1,94 +1,592 @@
-import requests
-from requests.models import Response
+import http.client
+import json
+import time
+from collections import deque
+from threading import Lock
+from typing import Deque, Dict, Iterable, Iterator, List, Tuple
+
+import metrics
+from compression import ENCODING_GZIP
+from liveness import LIVENESS_TTL, LivenessCache
+from maintenance import count_message
+from peers import split_address
+from storage import value_to_json
+from tracing import TRACE_ID_HEADER, current_trace
 
 CON_TIMEOUT = 3
 READ_TIMEOUT = 10
+POOL_SIZE = 8
+POOL_IDLE_TIMEOUT = 15
 
+# Values are read from peers as they are stored, compressed or not
+ACCEPT_COMPRESSED = {"Accept-Encoding": ENCODING_GZIP}
 
-def get_status(node: str) -> Response | None:
-    try:
-        return requests.get(
-            f"http://{node}/status", timeout=(CON_TIMEOUT, READ_TIMEOUT)
-        )
-    except requests.exceptions.RequestException:
+# Bytes read at a time from streamed bodies
+STREAM_CHUNK_SIZE = 64 * 1024
+
+# Status a node answers with when asked to check that it owns a key it doesn't
+NOT_OWNER = 421
+
+
+class Response:
+    """
+    The parts of a peer's HTTP response the node uses.
+    """
+
+    def __init__(
+        self,
+        status_code: int,
+        reason: str,
+        headers,
+        content: bytes,
+        elapsed: float = 0.0,
+    ):
+        self.status_code = status_code
+        self.reason = reason
+        self.headers = headers
+        self.content = content
+        self.length: int | None = len(content)
+        # Seconds from sending the request to reading the response
+        self.elapsed = elapsed
+
+    @property
+    def text(self) -> str:
+        return self.content.decode("utf-8", errors="replace")
+
+    def json(self):
+        return json.loads(self.content)
+
+    def iter_content(self, size: int = STREAM_CHUNK_SIZE) -> Iterator[bytes]:
+        view = memoryview(self.content)
+        for start in range(0, len(view), size):
+            yield view[start : start + size]
+
+    def close(self):
+        pass
+
+
+class StreamedResponse(Response):
+    """
+    A response whose body is read from the connection as it is iterated,
+    instead of being in content. The caller closes it.
+    """
+
+    def __init__(self, conn, response: http.client.HTTPResponse):
+        super().__init__(response.status, response.reason, response.headers, b"")
+        self.conn = conn
+        self.raw = response
+        # None if the body is sent with chunked encoding
+        self.length = response.length
+
+    def iter_content(self, size: int = STREAM_CHUNK_SIZE) -> Iterator[bytes]:
+        return iter(lambda: self.raw.read(size), b"")
+
+    def close(self):
+        self.conn.close()
+
+
+class ConnectionPool:
+    """
+    Keeps idle keep-alive connections to each peer so RPCs can reuse them
+    instead of opening a new TCP connection per request. Connections are kept
+    per ip:port, so they are shared by all vnodes of a peer.
+    """
+
+    def __init__(
+        self, max_size: int = POOL_SIZE, idle_timeout: float = POOL_IDLE_TIMEOUT
+    ):
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.idle: Dict[str, Deque[Tuple[http.client.HTTPConnection, float]]] = {}
+        self.lock = Lock()
+        self.last_sweep = time.monotonic()
+        self.stats = {
+            "created": 0,
+            "reused": 0,
+            "evicted": 0,
+            "discarded": 0,
+            "failed": 0,
+        }
+
+    def acquire(self, node: str) -> Tuple[http.client.HTTPConnection, bool]:
+        """
+        Get a connection to the node, and whether it is a reused one.
+        """
+        now = time.monotonic()
+        with self.lock:
+            idle = self.idle.get(node)
+            while idle:
+                # Take the most recently used connection first
+                conn, last_used = idle.pop()
+                if now - last_used <= self.idle_timeout:
+                    self.stats["reused"] += 1
+                    return conn, True
+                self.stats["evicted"] += 1
+                conn.close()
+        return self.create(node), False
+
+    def create(self, node: str) -> http.client.HTTPConnection:
+        with self.lock:
+            self.stats["created"] += 1
+        host, port = node.rsplit(":", 1)
+        return http.client.HTTPConnection(host, int(port), timeout=CON_TIMEOUT)
+
+    def release(self, node: str, conn: http.client.HTTPConnection):
+        """
+        Return a healthy connection to the pool.
+        """
+        now = time.monotonic()
+        with self.lock:
+            idle = self.idle.setdefault(node, deque())
+            if len(idle) >= self.max_size:
+                self.stats["discarded"] += 1
+                conn.close()
+            else:
+                idle.append((conn, now))
+
+            if now - self.last_sweep > self.idle_timeout:
+                self.last_sweep = now
+                self.evict_idle(now)
+
+    def evict_idle(self, now: float):
+        """
+        Close connections that have been idle for too long. Expects the lock
+        to be held.
+        """
+        for node in list(self.idle):
+            idle = self.idle[node]
+            # The oldest connections are at the left of the queue
+            while idle and now - idle[0][1] > self.idle_timeout:
+                conn, _ = idle.popleft()
+                conn.close()
+                self.stats["evicted"] += 1
+            if not idle:
+                del self.idle[node]
+
+    def record_failure(self):
+        with self.lock:
+            self.stats["failed"] += 1
+
+    def get_stats(self) -> dict:
+        with self.lock:
+            stats = dict(self.stats)
+            stats["idle"] = sum(len(idle) for idle in self.idle.values())
+            stats["peers"] = len(self.idle)
+        return stats
+
+    def close(self):
+        with self.lock:
+            for idle in self.idle.values():
+                for conn, _ in idle:
+                    conn.close()
+            self.idle.clear()
+
+
+class PooledConnection:
+    """
+    The connection of a streamed response, which goes back to the pool when
+    closed if the response was read to the end.
+    """
+
+    def __init__(
+        self,
+        pool: ConnectionPool,
+        node: str,
+        conn: http.client.HTTPConnection,
+        response: http.client.HTTPResponse,
+    ):
+        self.pool = pool
+        self.node = node
+        self.conn = conn
+        self.response = response
+        self.closed = False
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        # A connection the peer will close has already been closed by
+        # http.client
+        if self.response.isclosed() and self.conn.sock is not None:
+            self.pool.release(self.node, self.conn)
+        else:
+            self.conn.close()
+
+
+class HTTPTransport:
+    """
+    Sends requests to other nodes over HTTP, reusing pooled keep-alive
+    connections.
+    """
+
+    def __init__(
+        self, pool_size: int = POOL_SIZE, idle_timeout: float = POOL_IDLE_TIMEOUT
+    ):
+        self.pool = ConnectionPool(pool_size, idle_timeout)
+
+    def request(
+        self, method: str, node: str, path: str, body: bytes | None, headers: dict
+    ) -> Response | None:
+        """
+        Send a request over a pooled connection.
+        Returns None if the node can't be reached.
+        """
+        endpoint, prefix = split_address(node)
+        started = time.monotonic()
+
+        # A reused connection may have been closed by the peer while idle,
+        # so retry once on a fresh connection
+        for attempt in range(2):
+            conn, reused = self.pool.acquire(endpoint)
+            try:
+                if conn.sock is None:
+                    conn.connect()
+                    conn.sock.settimeout(READ_TIMEOUT)
+                conn.request(method, prefix + path, body=body, headers=headers)
+                response = conn.getresponse()
+                content = response.read()
+            except TimeoutError:
+                conn.close()
+                break
+            except (http.client.HTTPException, OSError):
+                conn.close()
+                if reused and attempt == 0:
+                    continue
+                break
+
+            if response.will_close:
+                conn.close()
+            else:
+                self.pool.release(endpoint, conn)
+            return Response(
+                response.status,
+                response.reason,
+                response.headers,
+                content,
+                time.monotonic() - started,
+            )
+
+        self.pool.record_failure()
         return None
 
+    def open_stream(
+        self,
+        method: str,
+        node: str,
+        path: str,
+        chunks: Iterable[bytes] | None,
+        headers: dict,
+    ) -> Tuple[PooledConnection, http.client.HTTPResponse] | None:
+        """
+        Send a request with the body sent in chunks if given, and return the
+        response without reading its body. The body is sent with chunked
+        encoding unless the headers give its length.
+        Returns None if the node can't be reached.
+        """
+        endpoint, prefix = split_address(node)
 
-def get_predecessor(node: str) -> Response | None:
-    try:
-        return requests.get(
-            f"http://{node}/predecessor", timeout=(CON_TIMEOUT, READ_TIMEOUT)
-        )
-    except requests.exceptions.RequestException:
+        for attempt in range(2):
+            # A body read from chunks can't be sent again, so it isn't sent
+            # on a reused connection the peer may have closed
+            if chunks is None:
+                conn, reused = self.pool.acquire(endpoint)
+            else:
+                conn, reused = self.pool.create(endpoint), False
+            try:
+                if conn.sock is None:
+                    conn.connect()
+                    conn.sock.settimeout(READ_TIMEOUT)
+                conn.request(
+                    method,
+                    prefix + path,
+                    body=chunks,
+                    headers=headers,
+                    encode_chunked=chunks is not None
+                    and "Content-Length" not in headers,
+                )
+                response = conn.getresponse()
+            except TimeoutError:
+                conn.close()
+                break
+            except (http.client.HTTPException, OSError):
+                conn.close()
+                if reused and attempt == 0:
+                    continue
+                break
+            return PooledConnection(self.pool, endpoint, conn, response), response
+
+        self.pool.record_failure()
         return None
 
+    def get_stats(self) -> dict:
+        return self.pool.get_stats()
 
-def get_value(node: str, key: str) -> Response | None:
-    try:
-        return requests.get(
-            f"http://{node}/value/{key}", timeout=(CON_TIMEOUT, READ_TIMEOUT)
-        )
-    except requests.exceptions.RequestException:
+    def close(self):
+        self.pool.close()
+
+
+# How requests reach other nodes, which the simulator replaces with calls
+# into nodes in the same process
+transport: HTTPTransport = HTTPTransport()
+liveness = LivenessCache()
+
+
+def configure(
+    pool_size: int = POOL_SIZE,
+    idle_timeout: float = POOL_IDLE_TIMEOUT,
+    liveness_ttl: float = LIVENESS_TTL,
+):
+    """
+    Replace the HTTP transport and liveness cache with ones using the given
+    settings.
+    """
+    set_transport(HTTPTransport(pool_size, idle_timeout), LivenessCache(liveness_ttl))
+
+
+def set_transport(new_transport, new_liveness: LivenessCache | None = None):
+    """
+    Send requests through another transport, which has the request,
+    open_stream, get_stats and close methods of HTTPTransport.
+    """
+    global transport, liveness
+    transport.close()
+    transport = new_transport
+    liveness = new_liveness or LivenessCache(liveness.ttl)
+
+
+def trace_headers() -> dict:
+    trace_id = current_trace.get()
+    return {TRACE_ID_HEADER: trace_id} if trace_id else {}
+
+
+def request(
+    method: str,
+    node: str,
+    path: str,
+    body: str | bytes | None = None,
+    headers: dict | None = None,
+) -> Response | None:
+    """
+    Send a request to a node through the transport.
+    Returns None if the node can't be reached.
+    """
+    data = body.encode("utf-8") if isinstance(body, str) else body
+    endpoint = split_address(node)[0]
+    count_message()
+    headers = {**trace_headers(), **(headers or {})}
+    response = transport.request(method, node, path, data, headers)
+    if response is None:
+        liveness.mark_suspect(node)
+        metrics.CLIENT_REQUESTS.inc(endpoint, metrics.client_result(None))
         return None
 
+    liveness.mark_alive(node, response.elapsed)
+    metrics.CLIENT_REQUESTS.inc(endpoint, metrics.client_result(response.status_code))
+    metrics.CLIENT_REQUEST_SECONDS.observe(response.elapsed, endpoint)
+    return response
 
-def get_successor_list(node: str) -> Response | None:
-    try:
-        return requests.get(
-            f"http://{node}/successor_list", timeout=(CON_TIMEOUT, READ_TIMEOUT)
-        )
-    except requests.exceptions.RequestException:
+
+def open_stream(
+    method: str,
+    node: str,
+    path: str,
+    chunks: Iterable[bytes] | None = None,
+    headers: dict | None = None,
+) -> Tuple[PooledConnection, http.client.HTTPResponse] | None:
+    """
+    Send a request whose body is sent in chunks if given, and return the
+    response without reading its body so it can be streamed. The caller
+    closes the connection.
+    Returns None if the node can't be reached.
+    """
+    endpoint = split_address(node)[0]
+    count_message()
+    headers = {**trace_headers(), **(headers or {})}
+    stream = transport.open_stream(method, node, path, chunks, headers)
+    if stream is None:
+        liveness.mark_suspect(node)
+        metrics.CLIENT_REQUESTS.inc(endpoint, metrics.client_result(None))
         return None
 
+    liveness.mark_alive(node)
+    metrics.CLIENT_REQUESTS.inc(endpoint, metrics.client_result(stream[1].status))
+    return stream
 
-def find_successor(node: str, id: int) -> Response | None:
+
+def read_stream(
+    stream: Tuple[PooledConnection, http.client.HTTPResponse] | None,
+) -> Response | None:
+    """
+    Reads the whole response of a streamed request and closes its connection.
+    Returns None if the request or reading the response failed.
+    """
+    if stream is None:
+        return None
+
+    conn, response = stream
     try:
-        return requests.get(
-            f"http://{node}/find_successor/{id}", timeout=(CON_TIMEOUT, READ_TIMEOUT)
-        )
-    except requests.exceptions.RequestException:
+        content = response.read()
+    except (http.client.HTTPException, OSError):
         return None
+    finally:
+        conn.close()
+    return Response(response.status, response.reason, response.headers, content)
+
+
+def open_response(
+    method: str, node: str, path: str, headers: dict | None = None
+) -> StreamedResponse | None:
+    stream = open_stream(method, node, path, headers=headers)
+    return StreamedResponse(*stream) if stream is not None else None
+
+
+def is_alive(node: str) -> bool:
+    """
+    Check if a node is alive, only pinging it if it hasn't been heard from
+    recently.
+    """
+    alive = liveness.get(node)
+    if alive is not None:
+        return alive
+
+    response = get_status(node)
+    return response is not None and response.status_code == 200
+
+
+def get_status(node: str) -> Response | None:
+    return request("GET", node, "/status")
+
+
+def get_predecessor(node: str) -> Response | None:
+    return request("GET", node, "/predecessor")
+
+
+def get_value(
+    node: str, key: str, check_owner: bool = False
+) -> StreamedResponse | None:
+    """
+    Get a value without reading it, so it can be streamed, compressed if it
+    is stored compressed. The caller closes the response.
+    """
+    query = "?check_owner=1" if check_owner else ""
+    return open_response("GET", node, f"/value/{key}{query}", ACCEPT_COMPRESSED)
+
+
+def get_fingers(node: str) -> Response | None:
+    return request("GET", node, "/fingers")
+
+
+def get_successor_list(node: str) -> Response | None:
+    return request("GET", node, "/successor_list")
+
+
+def get_predecessor_list(node: str) -> Response | None:
+    return request("GET", node, "/predecessor_list")
+
+
+def find_successor(node: str, id: int, mode: str | None = None) -> Response | None:
+    query = f"?mode={mode}" if mode else ""
+    return request("GET", node, f"/find_successor/{id}{query}")
+
+
+def get_next_hop(node: str, id: int, exclude=()) -> Response | None:
+    query = f"?exclude={','.join(exclude)}" if exclude else ""
+    return request("GET", node, f"/next_hop/{id}{query}")
 
 
 def notify(node: str, predecessor: str) -> Response | None:
-    try:
-        return requests.put(
-            f"http://{node}/notify",
-            data=predecessor,
-            timeout=(CON_TIMEOUT, READ_TIMEOUT),
-        )
-    except requests.exceptions.RequestException:
-        return None
+    return request("PUT", node, "/notify", predecessor)
 
 
-def set_value(node: str, key: str, value: str) -> Response | None:
-    try:
-        return requests.put(
-            f"http://{node}/value/{key}",
-            data=value,
-            timeout=(CON_TIMEOUT, READ_TIMEOUT),
-        )
-    except requests.exceptions.RequestException:
-        return None
+def stabilize(node: str, predecessor: str) -> Response | None:
+    return request("PUT", node, "/stabilize", predecessor)
+
+
+def value_headers(content_type: str | None, encoding: str | None) -> dict:
+    headers = {}
+    if content_type:
+        headers["Content-Type"] = content_type
+    if encoding:
+        headers["Content-Encoding"] = encoding
+    return headers
+
+
+def set_value(
+    node: str,
+    key: str,
+    value: bytes,
+    check_owner: bool = False,
+    content_type: str | None = None,
+    encoding: str | None = None,
+) -> Response | None:
+    query = "?check_owner=1" if check_owner else ""
+    headers = value_headers(content_type, encoding)
+    return request("PUT", node, f"/value/{key}{query}", value, headers)
+
+
+def stream_value(
+    node: str,
+    key: str,
+    chunks: Iterable[bytes],
+    length: int | None,
+    content_type: str | None = None,
+    encoding: str | None = None,
+) -> Response | None:
+    """
+    Sends a value as its chunks are read, with chunked encoding if its
+    length isn't known.
+    """
+    headers = value_headers(content_type, encoding)
+    if length is not None:
+        headers["Content-Length"] = str(length)
+    return read_stream(open_stream("PUT", node, f"/value/{key}", chunks, headers))
+
+
+def get_values(
+    node: str, keys: List[str], check_owner: bool = False
+) -> Response | None:
+    query = "?check_owner=1" if check_owner else ""
+    return request("POST", node, f"/batch/value{query}", json.dumps(keys))
+
+
+def set_values(
+    node: str, pairs: Dict[str, bytes], check_owner: bool = False
+) -> Response | None:
+    query = "?check_owner=1" if check_owner else ""
+    body = {key: value_to_json(value) for key, value in pairs.items()}
+    return request("PUT", node, f"/batch/value{query}", json.dumps(body))
+
+
+def get_replica(node: str, key: str) -> StreamedResponse | None:
+    """
+    Get a replicated value without reading it, compressed if it is stored
+    compressed. The caller closes the response.
+    """
+    return open_response("GET", node, f"/replica/{key}", ACCEPT_COMPRESSED)
+
+
+def set_replicas(node: str, pairs: Dict[str, bytes]) -> Response | None:
+    body = {key: value_to_json(value) for key, value in pairs.items()}
+    return request("PUT", node, "/batch/replica", json.dumps(body))
+
+
+def get_range(
+    node: str, start: int, end: int
+) -> Tuple[PooledConnection, http.client.HTTPResponse] | None:
+    return open_stream("GET", node, f"/range?start={start}&end={end}")
+
+
+def release_range(node: str, start: int, end: int) -> Response | None:
+    return request("POST", node, f"/range/release?start={start}&end={end}")
+
+
+def put_range(node: str, chunks: Iterable[bytes]) -> Response | None:
+    return read_stream(open_stream("PUT", node, "/range", chunks))
 
 
 def set_successor(node: str, successor: str) -> Response | None:
-    try:
-        return requests.put(
-            f"http://{node}/successor",
-            data=successor,
-            timeout=(CON_TIMEOUT, READ_TIMEOUT),
-        )
-    except requests.exceptions.RequestException:
-        return None
+    return request("PUT", node, "/successor", successor)
 
 
 def set_predecessor(node: str, predecessor: str) -> Response | None:
-    try:
-        return requests.put(
-            f"http://{node}/predecessor",
-            data=predecessor,
-            timeout=(CON_TIMEOUT, READ_TIMEOUT),
-        )
-    except requests.exceptions.RequestException:
-        return None
+    return request("PUT", node, "/predecessor", predecessor)
@@ -1,30 +1,147 @@
 from __future__ import annotations
+import atexit
 import json
 import time
 import os
+import random
 import logging as log
-from typing import TYPE_CHECKING, List
+from queue import Empty, Full, Queue
+from threading import Lock, Thread
+from typing import TYPE_CHECKING, Dict, List
+
+from tracing import parse_hops
 
 if TYPE_CHECKING:
     from chord_node import ChordNode
 
+LOG_QUEUE_SIZE = 10000
+LOG_BATCH_SIZE = 256
+LOG_FLUSH_INTERVAL = 0.5
+
+# What to do with an event when the queue is full
+LOG_DROP = "drop"
+LOG_BLOCK = "block"
+LOG_POLICIES = [LOG_DROP, LOG_BLOCK]
+
+# Tells the writer thread to stop
+STOP = None
+
 
 class ChordLogger:
-    def __init__(self, node: ChordNode, log_dir: str):
+    """
+    Writes the node's events as JSON lines. Events are queued and written by
+    a background thread, which keeps the file open and writes them in
+    batches, so logging doesn't slow down requests.
+
+    Events of a type can be sampled by giving the share of them to keep, and
+    a disabled logger drops all events without starting a thread.
+    """
+
+    def __init__(
+        self,
+        node: ChordNode,
+        log_dir: str,
+        queue_size: int = LOG_QUEUE_SIZE,
+        policy: str = LOG_DROP,
+        sample_rates: Dict[str, float] | None = None,
+        batch_size: int = LOG_BATCH_SIZE,
+        flush_interval: float = LOG_FLUSH_INTERVAL,
+        enabled: bool = True,
+    ):
         self.node = node
+        self.enabled = enabled
         log_dir = os.path.expanduser(log_dir)
         os.makedirs(log_dir, exist_ok=True)
-        self.log_file = f"{log_dir}/{self.node.address}-{self.node.id}.log"
+        name = self.node.address.replace("/", "-")
+        self.log_file = f"{log_dir}/{name}-{self.node.id}.log"
+
+        self.policy = policy
+        self.sample_rates = sample_rates or {}
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.queue: Queue = Queue(maxsize=queue_size)
+        self.lock = Lock()
+        self.stats = {"written": 0, "dropped": 0, "sampled_out": 0, "batches": 0}
+
+        self.writer = Thread(target=self.run_writer, daemon=True)
+        if not enabled:
+            return
+        self.writer.start()
+        atexit.register(self.close)
 
     def log_event(self, event_type, **kwargs):
+        if not self.enabled:
+            return
+        rate = self.sample_rates.get(event_type, 1)
+        if rate < 1 and random.random() >= rate:
+            with self.lock:
+                self.stats["sampled_out"] += 1
+            return
+
         event = {
             "timestamp": time.time(),
             "node_id": self.node.id,
             "event": event_type,
             **kwargs,
         }
+        if self.policy == LOG_BLOCK:
+            self.queue.put(event)
+            return
+        try:
+            self.queue.put_nowait(event)
+        except Full:
+            with self.lock:
+                self.stats["dropped"] += 1
+
+    def run_writer(self):
+        """
+        Writes queued events until stopped. A batch is written once it is
+        full, or when its first event has waited for the flush interval.
+        """
+        batch: List[dict] = []
+        deadline = 0.0
         with open(self.log_file, "a") as f:
-            f.write(json.dumps(event) + "\n")
+            while True:
+                timeout = max(0, deadline - time.monotonic()) if batch else None
+                try:
+                    event = self.queue.get(timeout=timeout)
+                except Empty:
+                    event = {}
+
+                if event is STOP:
+                    self.write_batch(f, batch)
+                    return
+                if event:
+                    if not batch:
+                        deadline = time.monotonic() + self.flush_interval
+                    batch.append(event)
+
+                if len(batch) >= self.batch_size or time.monotonic() >= deadline:
+                    self.write_batch(f, batch)
+                    batch = []
+
+    def write_batch(self, f, batch: List[dict]):
+        if not batch:
+            return
+        f.write("".join(json.dumps(event) + "\n" for event in batch))
+        f.flush()
+        with self.lock:
+            self.stats["written"] += len(batch)
+            self.stats["batches"] += 1
+
+    def close(self):
+        """
+        Writes the queued events and stops the writer thread.
+        """
+        if self.writer.is_alive():
+            self.queue.put(STOP)
+            self.writer.join()
+
+    def get_stats(self) -> dict:
+        with self.lock:
+            stats = dict(self.stats)
+        stats["queued"] = self.queue.qsize()
+        return stats
 
     def log_node_status(self):
         if not self.node.successor:
@@ -32,15 +149,15 @@ class ChordLogger:
                 "status",
                 successor="None",
                 num_keys=len(self.node.storage),
-                storage=self.node.storage,
+                storage=list(self.node.storage),
             )
             return
 
         self.log_event(
             "status",
-            successor=self.node.hash(self.node.successor),
+            successor=self.node.peer_id(self.node.successor),
             num_keys=len(self.node.storage),
-            storage=self.node.storage,
+            storage=list(self.node.storage),
             m=self.node.m,
         )
 
@@ -85,11 +202,14 @@ class ChordLogger:
         )
         self.log_event("passing_successor_check", key=key, successor_id=successor_id)
 
-    def insert_value(self, key: str, value):
-        self.log_event("insert_key", key=key, value=value)
+    def trace(self, trace_id: str, route: str, hops: List[str]):
+        self.log_event("trace", trace_id=trace_id, route=route, hops=parse_hops(hops))
+
+    def insert_value(self, key: str, value: bytes):
+        self.log_event("insert_key", key=key, size=len(value))
 
-    def get_value(self, key: str, value):
-        self.log_event("get_key", key=key, value=value)
+    def get_value(self, key: str, value: bytes | None):
+        self.log_event("get_key", key=key, size=None if value is None else len(value))
 
     def fix_fingers(self):
         log.info("Fixing fingers")
@@ -98,7 +218,7 @@ class ChordLogger:
             if not finger:
                 finger_table.append("None")
                 continue
-            finger_id = self.node.hash(finger)
+            finger_id = self.node.peer_id(finger)
             finger_table.append(str(finger_id))
 
         self.log_event("fix_fingers", finger_table=finger_table)
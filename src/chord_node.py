@@ -1,77 +1,291 @@
+import http.client
 import json
 import random
-from typing import List
-from threading import Event, Thread
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING, Dict, Iterable, Iterator, List, Tuple
+from threading import Lock, Thread
 
 import logging as log
-import hashlib
 import chord_client
+import metrics
+import periodic
+from chord_client import NOT_OWNER, Response
 from chord_logger import ChordLogger
+from compression import COMPRESS_MIN_SIZE, Compressor
+from maintenance import MAX_MAINTENANCE_INTERVAL, Maintenance
+from owner_cache import OWNER_CACHE_SIZE, OwnerCache
+from peers import PeerTable, ring_id, vnode_address
+from ring import in_interval
+from storage import DATA_DIR, STORAGE_MEMORY, decode_value, open_storage
+from tracing import format_hop, read_trace
+from transfer import TRANSFER_READ_SIZE, TransferStats, decode_pairs, encode_pairs
 
+if TYPE_CHECKING:
+    from vnodes import VirtualNodes
 
-def run_periodic_function(func, stop_event, min_delay=10, max_delay=15):
-    """Run a function periodically with random delays"""
-    while not stop_event.is_set():
-        delay = random.uniform(min_delay, max_delay)
-        if stop_event.wait(delay):
-            break
-        func()
+LOOKUP_RECURSIVE = "recursive"
+LOOKUP_ITERATIVE = "iterative"
+LOOKUP_MODES = [LOOKUP_RECURSIVE, LOOKUP_ITERATIVE]
+MAX_ITERATIVE_HOPS = 64
+RPC_WORKERS = 16
+
+# Nodes remembered per finger interval for proximity routing
+FINGER_CANDIDATES = 4
+
+# Min seconds between bulk finger refreshes
+FINGER_REFRESH_INTERVAL = 1
+
+# Which node a read of a replicated key goes to
+READ_OWNER = "owner"
+READ_NEAREST = "nearest"
+READ_RANDOM = "random"
+READ_POLICIES = [READ_OWNER, READ_NEAREST, READ_RANDOM]
+
+# Ranges sent to a joining node whose keys are kept until it confirms it
+# stored them
+MAX_SENT_RANGES = 16
+
+# Seconds the replicas an owner listed are read from before asking it again
+REPLICA_SET_TTL = 10
+
+
+class LookupResult:
+    """
+    The owner of an id, and the nodes the lookup passed through. When traced,
+    the trace has the node id and milliseconds of each hop after this node.
+    """
+
+    def __init__(
+        self,
+        successor: str,
+        path: List[str],
+        cached: bool = False,
+        replica: bool = False,
+        trace: List[str] | None = None,
+    ):
+        self.successor = successor
+        self.path = path
+        self.cached = cached
+        self.replica = replica
+        self.trace = trace or []
+
+    @property
+    def hops(self) -> int:
+        return len(self.path) - 1
+
+
+def read_lookup_path(response, node: str) -> List[str]:
+    """
+    Get the lookup path a node returned, or just the node if it didn't.
+    """
+    path = response.headers.get("X-Chord-Path")
+    return path.split(",") if path else [node]
 
 
 class ChordNode:
-    def __init__(self, ip: str, port: int, id: int, m: int):
+    def __init__(
+        self,
+        ip: str,
+        port: int,
+        id: int,
+        m: int,
+        lookup_mode: str = LOOKUP_RECURSIVE,
+        owner_cache_size: int = OWNER_CACHE_SIZE,
+        replicas: int = 0,
+        read_policy: str = READ_OWNER,
+        storage: str = STORAGE_MEMORY,
+        data_dir: str = DATA_DIR,
+        log_options: dict | None = None,
+        seed_fingers: bool = True,
+        proximity: bool = True,
+        trace_sample: float = 0,
+        max_maintenance_interval: float = MAX_MAINTENANCE_INTERVAL,
+        compress_min_size: int = COMPRESS_MIN_SIZE,
+        vnode: int = 0,
+        group: "VirtualNodes | None" = None,
+    ):
         self.ip: str = ip
         self.port: int = port
-        self.address = f"{ip}:{port}"
+        self.address = vnode_address(ip, port, vnode)
+        self.vnode = vnode
+        # The other vnodes of the process, which run our periodic functions
+        self.group = group
+        self.maintenance = (
+            group.maintenance
+            if group is not None
+            else Maintenance(max_maintenance_interval)
+        )
         self.m: int = m
         self.r: int = m
 
         self.id: int = id
-        self.successor: str = self.address
+        self._successor: str = self.address
         self.successor_list: List[str] = []
-        self.predecessor: str | None = None
+        self._predecessor: str | None = None
         self.finger_table: List[str | None] = [None] * (self.m + 1)
         self.next = m
-        self.storage = {}
+        self.peers = PeerTable(m)
+
+        # Other nodes in each finger's interval, so routing can pick the one
+        # with the lowest round trip time
+        self.proximity = proximity
+        self.finger_candidates: List[List[str]] = [[] for _ in range(m + 1)]
+
+        # Finger i is the successor of id + 2^(i-1)
+        ring_size = 2**m
+        self.finger_starts = [id] + [
+            (id + 2 ** (i - 1)) % ring_size for i in range(1, m + 1)
+        ]
+        storage_name = f"{ip}-{port}" + (f"-vnode-{vnode}" if vnode else "")
+        self.storage = open_storage(storage, data_dir, storage_name, self.hash)
+        self.compressor = Compressor(compress_min_size)
         self.sim_crash = False
+        self.lookup_mode = lookup_mode
+        # Share of client storage requests traced and written to the event log
+        self.trace_sample = trace_sample
+        self.owner_cache = OwnerCache(owner_cache_size)
+        self.executor = ThreadPoolExecutor(max_workers=RPC_WORKERS)
 
-        self.logger = ChordLogger(self, "~/imo059-chord-logs/")
+        # Copies of our keys are kept on the first successors, and we keep
+        # copies of our predecessors' keys
+        self.num_replicas = replicas
+        self.read_policy = read_policy
+        self.replicas = open_storage(
+            storage, data_dir, f"{storage_name}-replicas", self.hash
+        )
+        self.replica_targets: List[str] = []
+        # Our first predecessors, the furthest of which precedes the keys we
+        # keep copies of
+        self.predecessor_list: List[str] = []
+        # Owner -> (when it listed its replicas, the replicas)
+        self.replica_sets: Dict[str, Tuple[float, List[str]]] = {}
+        self.replication_lock = Lock()
+        self.replication_stats = {
+            "replica_reads": 0,
+            "replica_misses": 0,
+            "repaired": 0,
+            "promoted": 0,
+            "pruned": 0,
+        }
+
+        self.transfers = TransferStats()
+        # (start, end] -> keys sent, until the receiver releases them
+        self.sent_ranges: OrderedDict[Tuple[int, int], List[str]] = OrderedDict()
+        self.sent_ranges_lock = Lock()
+
+        # Bulk refreshes of the finger table, run at join and after churn
+        self.seed_fingers = seed_fingers
+        self.finger_lock = Lock()
+        self.refreshing_fingers = False
+        self.finger_refresh_pending = False
+        self.last_finger_refresh = 0.0
+        self.joined_at: float | None = None
+        self.finger_stats = {
+            "refreshes": 0,
+            "lookups": 0,
+            "skipped": 0,
+            "seeded": 0,
+            "last_refresh_seconds": None,
+            "time_to_full_table": None,
+        }
+
+        self.logger = ChordLogger(self, "~/imo059-chord-logs/", **(log_options or {}))
         self.start_periodic_functions()
 
+    @property
+    def successor(self) -> str:
+        return self._successor
+
+    @successor.setter
+    def successor(self, successor: str):
+        # Ownership of the ids up to the old and new successor may have changed
+        old_successor, self._successor = self._successor, successor
+        if old_successor != successor:
+            for node in (old_successor, successor):
+                self.owner_cache.invalidate_range(self.id, self.peer_id(node))
+
+    @property
+    def predecessor(self) -> str | None:
+        return self._predecessor
+
+    @predecessor.setter
+    def predecessor(self, predecessor: str | None):
+        # Ownership of the ids after the old and new predecessor may have changed
+        old_predecessor, self._predecessor = self._predecessor, predecessor
+        if old_predecessor != predecessor:
+            for node in (old_predecessor, predecessor):
+                if node:
+                    self.owner_cache.invalidate_range(self.peer_id(node), self.id)
+
     def start_periodic_functions(self):
-        # Create stop event
-        self.stop_event = Event()
-
-        # Create threads for periodic functions
-        self.stabilize_thread = Thread(
-            target=run_periodic_function,
-            args=(self.stabilize, self.stop_event, 1, 2),
-            daemon=True,
-        )
-        self.fix_fingers_thread = Thread(
-            target=run_periodic_function,
-            args=(self.fix_fingers, self.stop_event, 3, 5),
-            daemon=True,
-        )
-        self.check_predecessor_thread = Thread(
-            target=run_periodic_function,
-            args=(self.check_predecessor, self.stop_event, 1, 2),
-            daemon=True,
-        )
+        if self.group is not None:
+            self.group.resume(self)
+            return
 
-        # Start periodic functions threads
-        self.stabilize_thread.start()
-        self.fix_fingers_thread.start()
-        self.check_predecessor_thread.start()
+        # The process' scheduler runs the periodic functions on its workers
+        self.jobs = [
+            periodic.scheduler.add(func, self.maintenance.tasks[func.__name__])
+            for func in [self.stabilize, self.fix_fingers, self.check_predecessor]
+        ]
 
     def stop_periodic_functions(self):
-        # Stop periodic functions threads
-        self.stop_event.set()
+        if self.group is not None:
+            self.group.pause(self)
+            return
+
+        # Wait for the running functions to end
+        for job in self.jobs:
+            periodic.scheduler.remove(job)
+        self.jobs = []
 
-        # Join the threads
-        self.stabilize_thread.join()
-        self.fix_fingers_thread.join()
-        self.check_predecessor_thread.join()
+    def get_stats(self) -> dict:
+        return {
+            "connections": chord_client.transport.get_stats(),
+            "liveness": chord_client.liveness.get_stats(),
+            "owner_cache": self.owner_cache.get_stats(),
+            "replication": self.get_replication_stats(),
+            "storage": self.storage.get_stats(),
+            "compression": self.compressor.get_stats(),
+            "transfers": self.transfers.get_stats(),
+            "fingers": self.get_finger_stats(),
+            "proximity": self.get_proximity_stats(),
+            "event_log": self.logger.get_stats(),
+            "maintenance": self.maintenance.get_stats(),
+            "scheduler": periodic.scheduler.get_stats(),
+        }
+
+    def get_replication_stats(self) -> dict:
+        with self.replication_lock:
+            stats = dict(self.replication_stats)
+        stats["replicas"] = self.num_replicas
+        stats["targets"] = self.replica_targets
+        stats["replica_keys"] = len(self.replicas)
+        return stats
+
+    def get_finger_stats(self) -> dict:
+        with self.finger_lock:
+            stats = dict(self.finger_stats)
+        stats["filled"] = sum(1 for finger in self.finger_table[1:] if finger)
+        return stats
+
+    def get_proximity_stats(self) -> dict:
+        candidates = [node for nodes in self.finger_candidates for node in nodes]
+        rtts = [chord_client.liveness.get_rtt(node) for node in candidates]
+        measured = [rtt for rtt in rtts if rtt != float("inf")]
+        return {
+            "enabled": self.proximity,
+            "candidates": len(candidates),
+            "measured": len(measured),
+            "mean_rtt_ms": (
+                round(1000 * sum(measured) / len(measured), 3) if measured else None
+            ),
+        }
+
+    def count(self, stat: str, amount: int = 1):
+        with self.replication_lock:
+            self.replication_stats[stat] += amount
 
     def create(self):
         self.predecessor = None
@@ -81,6 +295,7 @@ class ChordNode:
         self.logger.updated_predecessor(-1)
 
     def join(self, other: str):
+        self.joined_at = time.monotonic()
         self.predecessor = None
         self.logger.updated_predecessor(-1)
 
@@ -93,53 +308,155 @@ class ChordNode:
             successor = other
 
         self.successor = successor
-        successor_id = self.hash(successor)
+        successor_id = self.peer_id(successor)
         self.logger.updated_successor(successor_id)
 
+        # Take over the keys in our range from the successor, which starts
+        # after its current predecessor
+        if successor != self.address:
+            start = successor_id
+            response = chord_client.get_predecessor(successor)
+            if response is not None and response.status_code == 200:
+                predecessor_id = self.peer_id(response.text)
+                if in_interval(self.id, predecessor_id, successor_id):
+                    start = predecessor_id
+            self.pull_range(successor, start, self.id)
+
+        self.ring_changed()
+
     def update_successor_list(self):
         # Get the successor list of the successor
         response = chord_client.get_successor_list(self.successor)
         if response is None or response.status_code != 200:
             log.warning("Failed to get successor's successor list")
             return
-        successor_list = list(json.loads(response.text))
+        self.set_successor_list(list(json.loads(response.text)))
+
+    def update_predecessor_list(self):
+        """
+        Extends our predecessor with its predecessor list, when keeping
+        copies of our predecessors' keys.
+        """
+        if not self.num_replicas or self.predecessor is None:
+            self.predecessor_list = []
+            return
+        response = chord_client.get_predecessor_list(self.predecessor)
+        if response is None or response.status_code != 200:
+            log.warning("Failed to get predecessor's predecessor list")
+            return
+        self.set_predecessor_list(list(json.loads(response.text)))
 
+    def set_predecessor_list(self, predecessor_list: List[str]):
+        predecessor = self.predecessor
+        if predecessor is None:
+            return
+        self.predecessor_list = [predecessor] + predecessor_list[: self.num_replicas]
+
+    def set_successor_list(self, successor_list: List[str]):
         # Add successor to beginning of list
         successor_list.insert(0, self.successor)
 
         # Limit the size of the successor list
-        self.successor_list = successor_list[0 : self.r]
+        successor_list = successor_list[0 : self.r]
+
+        # Nodes joined or left, so the fingers may have changed too
+        if successor_list != self.successor_list:
+            self.ring_changed()
+            self.add_candidates(successor_list)
+        self.successor_list = successor_list
 
         self.logger.updated_successor_list(self.successor_list)
 
+    def successor_failed(self) -> bool:
+        """
+        Removes the failed successor from the successor list and moves on to
+        the next one. Returns False if no successors are left.
+        """
+        log.info(f"Successor {self.peer_id(self.successor)} has failed.")
+        self.successor_list = self.successor_list[1:]
+
+        # Check if successor list is empty
+        if not self.successor_list:
+            log.error("No more successors in successor list. Setting self to successor")
+            self.successor = self.address
+            self.successor_list.append(self.address)
+            return False
+
+        self.successor = self.successor_list[0]
+        self.logger.updated_successor(self.peer_id(self.successor))
+        self.ring_changed()
+        return True
+
+    def consider_successor(self, predecessor: str):
+        """
+        Makes our successor's predecessor our successor if it is between us.
+        """
+        if predecessor == self.address:
+            return
+
+        # Check if the predecessor is within us and our successor
+        successor_id = self.peer_id(self.successor)
+        predecessor_id = self.peer_id(predecessor)
+        within = False
+        if self.id < successor_id:
+            within = predecessor_id > self.id and predecessor_id < successor_id
+        else:
+            within = predecessor_id > self.id or predecessor_id < successor_id
+
+        # If this is the case update our successor
+        if within:
+            self.successor = predecessor
+            self.logger.updated_successor(predecessor_id)
+            self.ring_changed()
+
     def stabilize(self):
+        # Notify the successor that we might be its predecessor, and get its
+        # predecessor and successor list back in the same round trip
+        response = chord_client.stabilize(self.successor, self.address)
+        if response is not None and response.status_code == 404:
+            # The successor doesn't know the combined exchange
+            self.stabilize_separately()
+            return
+
         # If successor has failed, remove it from the successor list
         # and update our successor
-        response = chord_client.get_status(self.successor)
         if response is None or response.status_code != 200:
-            log.info(f"Successor {self.hash(self.successor)} has failed.")
-            self.successor_list = self.successor_list[1:]
-
-            # Check if successor list is empty
-            if not self.successor_list:
-                log.error(
-                    "No more successors in successor list. Setting self to successor"
-                )
-                self.successor = self.address
-                self.successor_list.append(self.address)
+            if not self.successor_failed():
                 return
 
-            else:
-                self.successor = self.successor_list[0]
-                self.logger.updated_successor(self.hash(self.successor))
+            # Update successor list
+            self.update_successor_list()
+
+            # Notify successor that we might be its predecessor
+            chord_client.notify(self.successor, self.address)
+
+        elif not self.apply_stabilize_reply(response.json()):
+            # Our new successor hasn't heard of us yet
+            self.update_successor_list()
+            chord_client.notify(self.successor, self.address)
 
-                # Update successor list
-                self.update_successor_list()
+        # Membership may have changed, so make sure our keys are replicated
+        self.repair_replicas()
 
-                # Notify successor that we might be its predecessor
-                chord_client.notify(self.successor, self.address)
+    def stabilize_separately(self):
+        """
+        Stabilizes with a call per step, for successors without PUT /stabilize.
+        """
+        # If successor has failed, remove it from the successor list
+        # and update our successor
+        response = chord_client.get_status(self.successor)
+        if response is None or response.status_code != 200:
+            if not self.successor_failed():
                 return
 
+            # Update successor list
+            self.update_successor_list()
+
+            # Notify successor that we might be its predecessor
+            chord_client.notify(self.successor, self.address)
+            self.repair_replicas()
+            return
+
         # Get our successor's predecessor
         response = chord_client.get_predecessor(self.successor)
         if response is None or response.status_code not in [200, 404]:
@@ -150,22 +467,7 @@ class ChordNode:
 
         # If successor has a predecessor...
         elif response.status_code == 200:
-            predecessor = response.text
-            successor_id = self.hash(self.successor)
-            predecessor_id = self.hash(predecessor)
-
-            if predecessor != self.address:
-                # Check if the predecessor is within us and our successor
-                within = False
-                if self.id < successor_id:
-                    within = predecessor_id > self.id and predecessor_id < successor_id
-                else:
-                    within = predecessor_id > self.id or predecessor_id < successor_id
-
-                # If this is the case update our successor
-                if within:
-                    self.successor = predecessor
-                    self.logger.updated_successor(predecessor_id)
+            self.consider_successor(response.text)
 
         # Update successor list
         self.update_successor_list()
@@ -173,12 +475,41 @@ class ChordNode:
         # Notify successor that we might be its predecessor
         chord_client.notify(self.successor, self.address)
 
+        # Membership may have changed, so make sure our keys are replicated
+        self.repair_replicas()
+
+    def stabilize_reply(self, node: str) -> dict:
+        """
+        Answers a predecessor's stabilize exchange: takes the node as our
+        predecessor if it is closer, then reports our predecessor and
+        successor list. A predecessor that stabilized with us is alive, so
+        check_predecessor doesn't need to ping it.
+        """
+        self.notify(node)
+        if self.predecessor == node:
+            chord_client.liveness.mark_alive(node)
+        return {"predecessor": self.predecessor, "successor_list": self.successor_list}
+
+    def apply_stabilize_reply(self, reply: dict) -> bool:
+        """
+        Updates our successor and successor list from the successor's reply
+        to the stabilize exchange. Returns False if the successor changed to
+        its predecessor, whose successor list and notify are still needed.
+        """
+        successor = self.successor
+        if reply["predecessor"]:
+            self.consider_successor(reply["predecessor"])
+        if self.successor != successor:
+            return False
+        self.set_successor_list(list(reply["successor_list"]))
+        return True
+
     def notify(self, new_predecessor: str):
         within = False
-        new_predecessor_id = self.hash(new_predecessor)
+        new_predecessor_id = self.peer_id(new_predecessor)
 
         if self.predecessor:
-            predecessor_id = self.hash(self.predecessor)
+            predecessor_id = self.peer_id(self.predecessor)
 
             # Check if the new predecessor is within current predecessor and us
             if predecessor_id < self.id:
@@ -194,65 +525,712 @@ class ChordNode:
         if self.predecessor is None or within:
             self.predecessor = new_predecessor
             self.logger.updated_predecessor(new_predecessor_id)
+            self.ring_changed()
 
-    def fix_fingers(self):
+        # A node other than our predecessor thinks it precedes us, so the
+        # ring around us is settling
+        elif new_predecessor != self.predecessor:
+            self.maintenance.changed()
+
+    def next_finger(self) -> Tuple[int, int]:
+        """
+        Moves on to the next finger to fix, and returns its index and start id.
+        """
         self.next = self.next + 1
 
         if self.next > self.m:
             self.next = 1
 
-        id = (self.id + 2 ** (self.next - 1)) % (2**self.m)
+        return self.next, self.finger_starts[self.next]
+
+    def fix_fingers(self):
+        i, id = self.next_finger()
         finger = self.find_successor(id)
         if finger:
-            self.finger_table[self.next] = finger
+            # A changed finger means the table is out of date
+            if self.finger_table[i] and finger != self.finger_table[i]:
+                self.ring_changed()
+            elif finger != self.finger_table[i]:
+                self.maintenance.changed()
+            self.finger_table[i] = finger
+            self.check_full_table()
+
+        # Measure the candidates of the interval that haven't been contacted
+        for node in self.unmeasured_candidates(i):
+            chord_client.get_status(node)
+
+        self.logger.fix_fingers()
+
+    def finger_index(self, node: str) -> int:
+        """
+        Get the index of the finger interval the node falls in,
+        or 0 if it is us.
+        """
+        return ((self.peer_id(node) - self.id) % 2**self.m).bit_length()
+
+    def add_candidates(self, nodes: Iterable[str]):
+        """
+        Remembers the nodes as candidates of the finger interval they fall in.
+        A full interval drops the candidate with the highest round trip time.
+        """
+        if not self.proximity:
+            return
+
+        for node in nodes:
+            i = self.finger_index(node)
+            if i == 0 or node in self.finger_candidates[i]:
+                continue
 
+            candidates = self.finger_candidates[i] + [node]
+            if len(candidates) > FINGER_CANDIDATES:
+                candidates.remove(max(candidates, key=chord_client.liveness.get_rtt))
+            self.finger_candidates[i] = candidates
+
+    def unmeasured_candidates(self, i: int) -> List[str]:
+        return [
+            node
+            for node in self.finger_candidates[i]
+            if chord_client.liveness.get_rtt(node) == float("inf")
+        ]
+
+    def forget_peer(self, i: int, node: str):
+        """
+        Removes a node that didn't respond from finger i and its candidates.
+        """
+        log.warning(f"Can't get a response from {self.peer_id(node)}.")
+        if node in self.finger_candidates[i]:
+            self.finger_candidates[i] = [
+                candidate
+                for candidate in self.finger_candidates[i]
+                if candidate != node
+            ]
+        if self.finger_table[i] == node:
+            self.finger_table[i] = None
+            self.ring_changed()
+
+    def ring_changed(self):
+        """
+        Our successor, predecessor or fingers changed, or one of them failed:
+        refresh the finger table and run maintenance at its fast intervals.
+        """
+        self.maintenance.changed()
+        self.schedule_finger_refresh()
+
+    def schedule_finger_refresh(self):
+        """
+        Asks for a bulk refresh of the finger table in the background.
+        Requests made while a refresh is running or waiting are combined
+        into one more refresh after it.
+        """
+        with self.finger_lock:
+            self.finger_refresh_pending = True
+            if self.refreshing_fingers:
+                return
+            self.refreshing_fingers = True
+
+        Thread(target=self.run_finger_refreshes, daemon=True).start()
+
+    def run_finger_refreshes(self):
+        while True:
+            # Wait so churn doesn't cause a refresh after every change
+            wait = FINGER_REFRESH_INTERVAL - (
+                time.monotonic() - self.last_finger_refresh
+            )
+            if wait > 0:
+                time.sleep(wait)
+
+            with self.finger_lock:
+                if not self.finger_refresh_pending:
+                    self.refreshing_fingers = False
+                    return
+                self.finger_refresh_pending = False
+                self.last_finger_refresh = time.monotonic()
+
+            try:
+                self.refresh_fingers()
+            except Exception:
+                log.exception("Finger refresh failed")
+
+    def finger_covers(self, node: str, i: int) -> bool:
+        """
+        Check if the node found for an earlier finger is also the successor
+        of finger i's start, which is the case if the start isn't past it.
+        """
+        ring_size = 2**self.m
+        node_distance = (self.peer_id(node) - self.id) % ring_size or ring_size
+        return (self.finger_starts[i] - self.id) % ring_size <= node_distance
+
+    def seeded_fingers(self) -> List[str | None] | None:
+        """
+        Guesses each finger from the successor's finger table, as the first
+        of its fingers at or after the finger's start.
+        """
+        response = chord_client.get_fingers(self.successor)
+        if response is None or response.status_code != 200:
+            return None
+
+        ring_size = 2**self.m
+        candidates = {node for node in response.json() if node}
+        self.add_candidates(candidates)
+        candidates |= {self.successor, self.address}
+        return [None] + [
+            min(candidates, key=lambda node: (self.peer_id(node) - start) % ring_size)
+            for start in self.finger_starts[1:]
+        ]
+
+    def refresh_fingers(self):
+        """
+        Finds every finger at once. Only the starts where the finger is
+        expected to change are looked up, in parallel, and the starts after
+        them that are covered by the found node reuse it. Starts that turn out
+        not to be covered are looked up in the next round.
+        """
+        started = time.monotonic()
+        predicted = self.seeded_fingers() if self.seed_fingers else None
+        seeded = predicted is not None
+        if predicted is None:
+            predicted = list(self.finger_table)
+
+        resolved: List[str | None] = [None] * (self.m + 1)
+        failed = set()
+        lookups = skipped = 0
+        while True:
+            # Reuse the previous finger for the starts it covers
+            for i in range(2, self.m + 1):
+                if resolved[i] is None and i not in failed:
+                    previous = resolved[i - 1]
+                    if previous and self.finger_covers(previous, i):
+                        resolved[i] = previous
+                        skipped += 1
+
+            todo = [
+                i
+                for i in range(1, self.m + 1)
+                if resolved[i] is None
+                and i not in failed
+                and (
+                    i == 1
+                    or resolved[i - 1] is not None
+                    or i - 1 in failed
+                    or predicted[i] != predicted[i - 1]
+                )
+            ]
+            if not todo:
+                break
+
+            futures = {
+                i: self.executor.submit(self.find_successor, self.finger_starts[i])
+                for i in todo
+            }
+            for i, future in futures.items():
+                resolved[i] = future.result()
+                if resolved[i] is None:
+                    failed.add(i)
+            lookups += len(todo)
+
+        for i in range(1, self.m + 1):
+            if resolved[i]:
+                self.finger_table[i] = resolved[i]
+        self.check_full_table()
+
+        seconds = time.monotonic() - started
+        with self.finger_lock:
+            self.finger_stats["refreshes"] += 1
+            self.finger_stats["lookups"] += lookups
+            self.finger_stats["skipped"] += skipped
+            self.finger_stats["seeded"] += seeded
+            self.finger_stats["last_refresh_seconds"] = round(seconds, 3)
+        log.info(
+            f"Refreshed fingers in {seconds:.3f}s with {lookups} lookups, "
+            f"{skipped} starts skipped"
+        )
         self.logger.fix_fingers()
 
+    def check_full_table(self):
+        """
+        Records how long after joining the finger table was first full.
+        """
+        joined_at = self.joined_at
+        if joined_at is not None and all(self.finger_table[1:]):
+            self.joined_at = None
+            with self.finger_lock:
+                self.finger_stats["time_to_full_table"] = round(
+                    time.monotonic() - joined_at, 3
+                )
+
     def check_predecessor(self):
         if self.predecessor is None:
             return
 
-        response = chord_client.get_status(self.predecessor)
-        if response is None or response.status_code != 200:
-            log.info(f"Predecessor {self.predecessor} has failed.")
-            self.predecessor = None
-            self.logger.updated_predecessor(-1)
+        # A predecessor that stabilized with us recently is known to be alive
+        if not chord_client.is_alive(self.predecessor):
+            self.predecessor_failed()
+
+    def predecessor_failed(self):
+        log.info(f"Predecessor {self.predecessor} has failed.")
+        self.predecessor = None
+        self.logger.updated_predecessor(-1)
+        self.ring_changed()
 
-    def insert_value(self, key: str, value: str):
+    def insert_value(self, key: str, value: bytes):
         self.logger.insert_value(key, value)
         self.storage[key] = value
 
-    def get_value(self, key: str) -> str | None:
+    def get_value(self, key: str) -> bytes | None:
         value = self.storage.get(key, None)
         self.logger.get_value(key, value)
         return value
 
+    def range_keys(self, start: int, end: int) -> List[str]:
+        """
+        Get the stored keys that hash into (start, end].
+        """
+        return self.storage.range_keys(start, end)
+
+    def range_items(self, keys: Iterable[str]) -> Iterator[Tuple[str, bytes]]:
+        """
+        Yields the stored pairs of the keys, reading each value as it's needed.
+        """
+        for key in keys:
+            value = self.storage.get(key)
+            if value is not None:
+                yield key, value
+
+    def release_keys(self, keys: Iterable[str]):
+        """
+        Removes keys another node has taken over. They aren't kept as
+        replicas, since until the new owner is our predecessor they would be
+        promoted back. The new owner copies them to its replicas instead.
+        """
+        self.storage.pop_many(keys)
+
+    def range_sent(self, start: int, end: int, keys: List[str]):
+        """
+        Remembers the keys sent of a range, to release once the receiver
+        confirms it stored them.
+        """
+        with self.sent_ranges_lock:
+            self.sent_ranges[(start, end)] = keys
+            self.sent_ranges.move_to_end((start, end))
+            while len(self.sent_ranges) > MAX_SENT_RANGES:
+                self.sent_ranges.popitem(last=False)
+
+    def release_range(self, start: int, end: int) -> bool:
+        """
+        Releases the keys sent of a range. Returns False if none were sent.
+        """
+        with self.sent_ranges_lock:
+            keys = self.sent_ranges.pop((start, end), None)
+        if keys is None:
+            return False
+        self.release_keys(keys)
+        return True
+
+    def receive_range(self, chunks: Iterable[bytes], peer: str) -> bool:
+        """
+        Stores the pairs of a range transfer as they arrive.
+        Returns False if the transfer broke off.
+        """
+        progress = self.transfers.start("received", peer)
+        try:
+            for pairs, size in decode_pairs(chunks):
+                self.storage.update(pairs)
+                self.replicate(pairs)
+                progress.add(len(pairs), size)
+        except (http.client.HTTPException, OSError, ValueError):
+            log.exception(f"Range transfer from {peer} failed")
+            self.transfers.finish(progress, ok=False)
+            return False
+
+        self.transfers.finish(progress)
+        return True
+
+    def pull_range(self, node: str, start: int, end: int) -> bool:
+        """
+        Moves the pairs in (start, end] from the node to us. The node keeps
+        them until we confirm we stored all of them.
+        """
+        stream = chord_client.get_range(node, start, end)
+        if stream is None:
+            log.warning(f"Couldn't reach {self.peer_id(node)} to pull keys")
+            return False
+
+        conn, response = stream
+        try:
+            if response.status != 200:
+                log.warning(
+                    f"{self.peer_id(node)} refused to send keys: {response.reason}"
+                )
+                return False
+            chunks = iter(lambda: response.read(TRANSFER_READ_SIZE), b"")
+            if not self.receive_range(chunks, node):
+                return False
+        finally:
+            conn.close()
+
+        response = chord_client.release_range(node, start, end)
+        if response is None or response.status_code != 200:
+            log.warning(f"{self.peer_id(node)} didn't release the keys we pulled")
+        return True
+
+    def push_range(self, node: str, pairs: Iterable[Tuple[str, bytes]]) -> bool:
+        """
+        Sends the pairs to the node as one streamed request.
+        """
+        progress = self.transfers.start("sent", node)
+        response = chord_client.put_range(node, encode_pairs(pairs, progress))
+        ok = response is not None and response.status_code == 200
+        self.transfers.finish(progress, ok)
+        return ok
+
+    def get_replica_targets(self) -> List[str]:
+        """
+        Get the successors that should hold copies of our keys.
+        """
+        targets: List[str] = []
+        for node in self.successor_list:
+            if node != self.address and node not in targets:
+                targets.append(node)
+        return targets[: self.num_replicas]
+
+    def replica_headers(self) -> dict:
+        """
+        Headers telling readers which nodes hold copies of our keys.
+        """
+        if not self.num_replicas:
+            return {}
+        return {"X-Chord-Replicas": ",".join(self.replica_targets)}
+
+    def replicate(self, pairs: Dict[str, bytes]):
+        """
+        Copies newly written pairs to the replicas in parallel.
+        """
+        targets = self.get_replica_targets()
+        if not pairs or not targets:
+            return
+
+        futures = [
+            self.executor.submit(chord_client.set_replicas, node, pairs)
+            for node in targets
+        ]
+        for future in futures:
+            future.result()
+
+    def insert_replicas(self, pairs: Dict[str, bytes]):
+        """
+        Stores copies of pairs the owner wrote. Copies of the same keys we
+        still store as owner are older, so they are dropped, which leaves
+        only owned copies written after the replica for promotion to keep.
+        """
+        stale = [key for key in pairs if key in self.storage]
+        if stale:
+            self.storage.pop_many(stale)
+        self.replicas.update(pairs)
+
+    def get_replica_value(self, key: str) -> bytes | None:
+        value = self.replicas.get(key)
+        if value is None:
+            value = self.storage.get(key)
+        return value
+
+    def replica_repairs(self) -> List[Tuple[str, Dict[str, bytes]]]:
+        """
+        Takes over replicated keys that are now within our range, and finds
+        the pairs each replica is missing. A successor that just became a
+        replica needs all our keys, and the others need the promoted ones.
+        """
+        if not self.num_replicas:
+            return []
+
+        # Our range grew, so keys we were a replica of are now ours
+        promoted = {}
+        predecessor = self.predecessor
+        if predecessor is not None:
+            taken = self.replicas.pop_range(self.peer_id(predecessor), self.id)
+            # Owned copies of a key are only kept when written after its
+            # replica, so they are newer
+            self.storage.update(
+                {key: value for key, value in taken.items() if key not in self.storage}
+            )
+            promoted = {
+                key: self.storage.get(key, value) for key, value in taken.items()
+            }
+            if promoted:
+                self.count("promoted", len(promoted))
+                log.info(f"Took over {len(promoted)} replicated keys")
+        self.prune_replicas()
+
+        repairs = []
+        targets = self.get_replica_targets()
+        for node in targets:
+            if node not in self.replica_targets:
+                repairs.append((node, dict(self.storage)))
+            elif promoted:
+                repairs.append((node, promoted))
+        self.replica_targets = targets
+        return [(node, pairs) for node, pairs in repairs if pairs]
+
+    def prune_replicas(self):
+        """
+        Drops the copies of keys outside (predecessor of the r-th predecessor,
+        predecessor], which nodes between them and us now keep instead.
+        """
+        predecessors = self.predecessor_list
+        # In a ring of r + 1 nodes or fewer we keep copies of all keys
+        if len(predecessors) <= self.num_replicas or self.address in predecessors:
+            return
+        # Wait for the list of a new predecessor, whose keys we may keep
+        if predecessors[0] != self.predecessor:
+            return
+        start = self.peer_id(predecessors[0])
+        end = self.peer_id(predecessors[self.num_replicas])
+        pruned = self.replicas.pop_range(start, end)
+        if pruned:
+            self.count("pruned", len(pruned))
+            log.info(f"Dropped {len(pruned)} replicated keys we no longer keep")
+
+    def repair_replicas(self):
+        self.update_predecessor_list()
+        for node, pairs in self.replica_repairs():
+            response = chord_client.set_replicas(node, pairs)
+            self.repaired(node, pairs, response)
+
+    def repaired(self, node: str, pairs: Dict[str, bytes], response: Response | None):
+        """
+        Records a repair, or forgets the replica so the next stabilize
+        tries again if it failed.
+        """
+        if response is None or response.status_code != 200:
+            log.warning(f"Failed to repair replica {self.peer_id(node)}")
+            if node in self.replica_targets:
+                self.replica_targets.remove(node)
+            return
+        self.count("repaired", len(pairs))
+
+    def choose_replica(self, id: int, policy: str) -> str | None:
+        """
+        Picks a replica of the cached owner of the id to read from, or None
+        if the read should go to the owner.
+        """
+        if policy == READ_OWNER:
+            return None
+        owner = self.owner_cache.get(id)
+        if owner is None:
+            return None
+
+        # Replicas listed too long ago may no longer keep the owner's keys
+        listed_at, replicas = self.replica_sets.get(owner, (0, []))
+        if self.maintenance.clock() - listed_at > REPLICA_SET_TTL:
+            replicas = []
+        candidates = [owner] + replicas
+        if policy == READ_RANDOM:
+            node = random.choice(candidates)
+        elif self.address in candidates:
+            node = self.address
+        else:
+            node = min(candidates, key=chord_client.liveness.get_rtt)
+        return None if node == owner else node
+
+    def remember_replicas(self, owner: str, response: Response):
+        """
+        Remembers the replicas an owner listed in its response.
+        """
+        replicas = response.headers.get("X-Chord-Replicas")
+        if replicas is not None:
+            nodes = [node for node in replicas.split(",") if node]
+            self.replica_sets[owner] = (self.maintenance.clock(), nodes)
+
+    def local_replica_response(self, key: str) -> Response | None:
+        value = self.get_replica_value(key)
+        if value is None:
+            return None
+        data, content_type, encoding = decode_value(value)
+        headers = {"Content-Type": content_type}
+        if encoding:
+            headers["Content-Encoding"] = encoding
+        return Response(200, "OK", headers, data)
+
+    def read_value(
+        self, key: str, mode: str | None, policy: str | None = None
+    ) -> Tuple[LookupResult | None, Response | None]:
+        """
+        Gets the value of a key from its owner, or from one of its replicas
+        if the read policy allows it. Falls back to the owner if the replica
+        fails or doesn't have the key. The response's body isn't read yet,
+        and the caller closes it.
+        """
+        id = self.hash(key)
+        replica = self.choose_replica(id, policy or self.read_policy)
+        if replica:
+            if replica == self.address:
+                response = self.local_replica_response(key)
+            else:
+                response = chord_client.get_replica(replica, key)
+            if response is not None and response.status_code == 200:
+                self.count("replica_reads")
+                return LookupResult(replica, [self.address], replica=True), response
+            if response is not None:
+                response.close()
+            self.count("replica_misses")
+
+        result, response = self.call_owner(
+            id, mode, lambda owner, check: chord_client.get_value(owner, key, check)
+        )
+        if result and response is not None:
+            self.remember_replicas(result.successor, response)
+        return result, response
+
+    def get_values(self, keys: List[str], mode: str | None = None) -> Dict[str, dict]:
+        """
+        Gets the values of many keys, with one request per owner.
+        Returns the status and value of each key.
+        """
+
+        def rpc(owner: str, keys: List[str], check: bool):
+            return chord_client.get_values(owner, keys, check)
+
+        return self.call_owners(keys, mode, rpc)
+
+    def set_values(
+        self, pairs: Dict[str, bytes], mode: str | None = None
+    ) -> Dict[str, dict]:
+        """
+        Inserts many key value pairs, with one request per owner.
+        Returns the status of each key.
+        """
+
+        def rpc(owner: str, keys: List[str], check: bool):
+            return chord_client.set_values(
+                owner, {key: pairs[key] for key in keys}, check
+            )
+
+        return self.call_owners(list(pairs), mode, rpc)
+
+    def call_owners(self, keys: List[str], mode: str | None, rpc) -> Dict[str, dict]:
+        """
+        Groups the keys by owner and calls rpc(owner, keys, check_owner) on each
+        owner in parallel. Owners are asked to check that they own the keys,
+        and keys they don't own are looked up again without the owner cache.
+        """
+        results: Dict[str, dict] = {}
+        retry: List[str] = []
+
+        groups = self.group_by_owner(keys, mode, results, use_cache=True)
+        for owner, owner_keys, response in self.call_groups(groups, rpc, True):
+            if response is None:
+                self.owner_cache.invalidate_owner(owner)
+                retry += owner_keys
+                continue
+            if response.status_code != 200:
+                for key in owner_keys:
+                    results[key] = {"status": response.status_code}
+                continue
+
+            for key, result in response.json()["results"].items():
+                if result["status"] == NOT_OWNER:
+                    self.owner_cache.invalidate_owner(owner)
+                    retry.append(key)
+                else:
+                    results[key] = result
+
+        if not retry:
+            return results
+
+        groups = self.group_by_owner(retry, mode, results, use_cache=False)
+        for owner, owner_keys, response in self.call_groups(groups, rpc, False):
+            if response is None or response.status_code != 200:
+                status = response.status_code if response else 500
+                for key in owner_keys:
+                    results[key] = {"status": status}
+                continue
+            results.update(response.json()["results"])
+
+        return results
+
+    def group_by_owner(
+        self, keys: List[str], mode: str | None, results: Dict[str, dict], use_cache
+    ) -> Dict[str, List[str]]:
+        """
+        Finds the owner of each key. Keys without an owner get a 404 result.
+        """
+        groups: Dict[str, List[str]] = {}
+
+        # Look up keys in id order, so each lookup fills the owner cache
+        # for the keys after it in the same range
+        for id, key in sorted((self.hash(key), key) for key in keys):
+            owner = self.owner_cache.get(id) if use_cache else None
+            if owner is None:
+                owner = self.find_successor(id, mode)
+            if owner is None:
+                results[key] = {"status": 404}
+                continue
+            groups.setdefault(owner, []).append(key)
+
+        return groups
+
+    def call_groups(self, groups: Dict[str, List[str]], rpc, check_owner: bool):
+        """
+        Calls rpc(owner, keys, check_owner) for each group in parallel and
+        yields the owner, its keys and the response.
+        """
+        futures = {
+            owner: self.executor.submit(rpc, owner, keys, check_owner)
+            for owner, keys in groups.items()
+        }
+        for owner, future in futures.items():
+            yield owner, groups[owner], future.result()
+
     def hash(self, key: str) -> int:
-        hash = hashlib.sha1(key.encode()).hexdigest()
-        return int(hash, 16) % (2**self.m)
+        return ring_id(key, self.m)
+
+    def peer_id(self, node: str) -> int:
+        """
+        Get the id of a peer address, which is only hashed the first time.
+        """
+        return self.peers.id(node)
+
+    def precedes(self, node: str, id: int) -> bool:
+        """
+        Check if the node is between us and the id.
+        """
+        node_id = self.peer_id(node)
+        if self.id < id:
+            return node_id > self.id and node_id < id
+        return node_id > self.id or node_id < id
+
+    def preceding_fingers(self, id: int, exclude=()):
+        """
+        Yields the index and node of the fingers preceding the id,
+        closest to the id first. With proximity routing, each finger is
+        yielded together with the other candidates of its interval,
+        lowest round trip time first.
+        """
+        seen = set()
 
-    def closest_preceding_node(self, id: int) -> str | None:
         # Loop through finger table from last to first
         for i in range(self.m, 0, -1):
-            finger = self.finger_table[i]
-            if not finger:
-                continue
+            nodes = [self.finger_table[i]]
+            if self.proximity:
+                nodes += self.finger_candidates[i]
 
-            # Check that the id is within finger node
-            within = False
-            successor_id = self.hash(finger)
-            if self.id < id:
-                within = successor_id > self.id and successor_id < id
-            else:
-                within = successor_id > self.id or successor_id < id
-            if not within:
-                continue
+            preceding = [
+                node
+                for node in nodes
+                if node and node not in exclude and node not in seen
+                if self.precedes(node, id)
+            ]
+            if self.proximity:
+                preceding.sort(key=chord_client.liveness.get_rtt)
 
+            for node in preceding:
+                seen.add(node)
+                yield i, node
+
+    def closest_preceding_node(self, id: int, exclude=()) -> str | None:
+        for i, finger in self.preceding_fingers(id, exclude):
             # Check that node is available
-            response = chord_client.get_status(finger)
-            if response is None or response.status_code != 200:
-                self.finger_table[i] = None
-                log.warning(f"Can't get a response from {successor_id}.")
+            if not chord_client.is_alive(finger):
+                self.forget_peer(i, finger)
                 continue
 
             # Return the first available node
@@ -261,46 +1239,184 @@ class ChordNode:
         log.warning(f"Can't find the closest node to {id}.")
         return None
 
-    def find_successor(self, id: int) -> str | None:
-        # Check if the id is within the node's successor
-        # If so, and its available, return the successor
-        within = False
-        successor_id = self.hash(self.successor)
+    def successor_owns(self, id: int) -> bool:
+        # Check if the id is within us and our successor
+        successor_id = self.peer_id(self.successor)
         if self.id < successor_id:
-            within = id > self.id and id <= successor_id
+            return id > self.id and id <= successor_id
         else:
-            within = id > self.id or id <= successor_id
+            return id > self.id or id <= successor_id
 
-        if within:
+    def find_successor(self, id: int, mode: str | None = None) -> str | None:
+        result = self.lookup(id, mode)
+        return result.successor if result else None
+
+    def lookup(self, id: int, mode: str | None = None) -> LookupResult | None:
+        """
+        Find the owner of the id, using the node's default lookup mode
+        unless another is given.
+        """
+        mode = mode or self.lookup_mode
+        if mode == LOOKUP_ITERATIVE:
+            result = self.lookup_iterative(id)
+        else:
+            result = self.lookup_recursive(id)
+
+        if result:
+            metrics.LOOKUP_HOPS.observe(result.hops, mode)
+            self.remember_owner(result)
+            self.add_candidates(result.path[1:] + [result.successor])
+        return result
+
+    def remember_owner(self, result: LookupResult):
+        """
+        Caches the range owned by the lookup's result. The last node of the
+        path is the owner's predecessor, which starts the range.
+        """
+        start = self.peer_id(result.path[-1])
+        self.owner_cache.put(start, self.peer_id(result.successor), result.successor)
+
+    def owns(self, id: int) -> bool:
+        """
+        Check if the id is within our predecessor and us.
+        """
+        if self.predecessor is None:
+            return True
+        return in_interval(id, self.peer_id(self.predecessor), self.id)
+
+    def call_owner(
+        self, id: int, mode: str | None, rpc
+    ) -> Tuple[LookupResult | None, Response | None]:
+        """
+        Finds the owner of the id and calls rpc(owner, check_owner) on it.
+        A cached owner is asked to check that it still owns the id,
+        and a full lookup is done if it doesn't.
+        """
+        owner = self.owner_cache.get(id)
+        if owner:
+            response = rpc(owner, True)
+            if response is not None and response.status_code != NOT_OWNER:
+                return LookupResult(owner, [self.address], cached=True), response
+            if response is not None:
+                response.close()
+            self.owner_cache.invalidate_owner(owner)
+
+        result = self.lookup(id, mode)
+        if not result:
+            return None, None
+        return result, rpc(result.successor, False)
+
+    def lookup_recursive(self, id: int) -> LookupResult | None:
+        # Check if the id is within the node's successor
+        # If so, and its available, return the successor
+        successor_id = self.peer_id(self.successor)
+        if self.successor_owns(id):
             # Check that successor is available
-            response = chord_client.get_status(self.successor)
-            if response and response.status_code == 200:
+            if chord_client.is_alive(self.successor):
                 # Return the successor
                 self.logger.found_successor(id, successor_id)
-                return self.successor
+                return LookupResult(self.successor, [self.address])
 
         # If not within successor or successor isn't available
         # Find and return the closest known node
-        closest_node = self.closest_preceding_node(id)
-        if closest_node:
-            closest_node_id = self.hash(closest_node)
+        tried = set()
+        while closest_node := self.closest_preceding_node(id, tried):
+            closest_node_id = self.peer_id(closest_node)
 
             # Pass the find successor check to the closest node and return its result
             self.logger.passing_successor_check(id, closest_node_id)
-            response = chord_client.find_successor(closest_node, id)
-            if response is None or response.status_code != 200:
+            response = chord_client.find_successor(closest_node, id, LOOKUP_RECURSIVE)
+
+            # The closest node is now suspected to have failed,
+            # retry with the next best finger
+            if response is None:
+                log.warning(f"Closest node {closest_node_id} failed. Trying next.")
+                tried.add(closest_node)
+                continue
+
+            if response.status_code != 200:
                 log.warning(
                     f"Failed to pass successor check to closest node {closest_node_id}."
                 )
                 return None
-            return response.text
+            path = read_lookup_path(response, closest_node)
+            return LookupResult(
+                response.text, [self.address] + path, trace=read_trace(response)
+            )
 
         # No successor found
         # Pass the successor check to the successor and return its result
         self.logger.passing_successor_check(id, successor_id)
-        response = chord_client.find_successor(self.successor, id)
+        response = chord_client.find_successor(self.successor, id, LOOKUP_RECURSIVE)
         if response is None or response.status_code != 200:
             log.warning(f"Failed to pass successor check to successor {successor_id}.")
             return None
-        successor = response.text
-        return successor
+        path = read_lookup_path(response, self.successor)
+        return LookupResult(
+            response.text, [self.address] + path, trace=read_trace(response)
+        )
+
+    def next_hop(self, id: int, exclude=()) -> Tuple[bool, str] | None:
+        """
+        Get the next node of an iterative lookup. Returns whether the node is
+        the owner of the id, and the node.
+        """
+        if self.successor_owns(id) and self.successor not in exclude:
+            if chord_client.is_alive(self.successor):
+                self.logger.found_successor(id, self.peer_id(self.successor))
+                return True, self.successor
+
+        closest_node = self.closest_preceding_node(id, exclude)
+        if closest_node:
+            return False, closest_node
+
+        # Fall back to walking the ring through the successor
+        if self.successor in exclude or self.successor == self.address:
+            return None
+        return False, self.successor
+
+    def lookup_iterative(self, id: int) -> LookupResult | None:
+        path: List[str] = []
+        # Round trip times of the next hop requests to other nodes
+        trace: List[str] = []
+        excluded = set()
+        node = self.address
+
+        while len(path) <= MAX_ITERATIVE_HOPS:
+            # Ask the current node for the next hop
+            if node == self.address:
+                hop = self.next_hop(id, excluded)
+                if hop is None:
+                    log.warning(f"Iterative lookup of {id} found no next hop.")
+                    return None
+            else:
+                started = time.perf_counter()
+                response = chord_client.get_next_hop(node, id, excluded)
+
+                # The node is suspected to have failed, so go back
+                # and ask the previous node for another one
+                if response is None:
+                    log.warning(f"{self.peer_id(node)} failed during lookup of {id}.")
+                    excluded.add(node)
+                    node = path.pop()
+                    if node != self.address:
+                        trace.pop()
+                    continue
+
+                if response.status_code != 200:
+                    log.warning(f"{self.peer_id(node)} found no next hop for {id}.")
+                    return None
+                hop = response.json()
+                hop = hop["done"], hop["node"]
+                trace.append(
+                    format_hop(self.peer_id(node), time.perf_counter() - started)
+                )
+
+            path.append(node)
+            done, node = hop
+            if done:
+                return LookupResult(node, path, trace=trace)
+            self.logger.passing_successor_check(id, self.peer_id(node))
+
+        log.warning(f"Iterative lookup of {id} exceeded {MAX_ITERATIVE_HOPS} hops.")
+        return None
@@ -0,0 +1,176 @@
+import time
+import zlib
+from threading import Lock
+from typing import Iterable, Iterator
+
+import metrics
+
+# Values of compressible types at least this large are stored and sent
+# between nodes compressed, 0 disables compression
+COMPRESS_MIN_SIZE = 0
+COMPRESS_LEVEL = 6
+
+# The content encoding of compressed values, which clients that accept it
+# get as it is stored
+ENCODING_GZIP = "gzip"
+ENCODINGS = [ENCODING_GZIP]
+GZIP_WBITS = 31
+
+# Bytes of output produced at a time when decompressing a stream, so a small
+# compressed chunk can't expand into a large buffer
+DECOMPRESS_CHUNK_SIZE = 64 * 1024
+
+
+def accepts_encoding(header: str | None, encoding: str) -> bool:
+    """
+    Whether an Accept-Encoding header allows the encoding.
+    """
+    for item in (header or "").split(","):
+        name, _, params = item.partition(";")
+        if name.strip().lower() not in (encoding, "*"):
+            continue
+        params = params.strip().lower()
+        if not params.startswith("q="):
+            return True
+        try:
+            return float(params[2:]) > 0
+        except ValueError:
+            return False
+    return False
+
+
+def compressible(content_type: str) -> bool:
+    """
+    Whether values of the content type are text, which compresses well,
+    rather than media or archives that are compressed already.
+    """
+    media_type = content_type.split(";")[0].strip().lower()
+    return media_type.startswith("text/") or media_type.endswith(
+        ("json", "xml", "javascript")
+    )
+
+
+class Compressor:
+    """
+    Compresses values of compressible types above a size threshold, and
+    keeps the totals of the node's compression work.
+    """
+
+    def __init__(self, min_size: int = COMPRESS_MIN_SIZE):
+        self.min_size = min_size
+        self.lock = Lock()
+        self.stats = {
+            "compressed": 0,
+            "incompressible": 0,
+            "decompressed": 0,
+            "original_bytes": 0,
+            "compressed_bytes": 0,
+            "compress_cpu_seconds": 0.0,
+            "decompress_cpu_seconds": 0.0,
+        }
+
+    def should_compress(self, size: int | None, content_type: str) -> bool:
+        """
+        Whether to compress a value, whose size may not be known yet.
+        """
+        if not self.min_size or not compressible(content_type):
+            return False
+        return size is None or size >= self.min_size
+
+    def compress(self, data: bytes, content_type: str) -> bytes | None:
+        """
+        Compresses a value, or returns None if it shouldn't be compressed or
+        compressing it didn't make it smaller.
+        """
+        if not self.should_compress(len(data), content_type):
+            return None
+
+        started = time.thread_time()
+        compressor = zlib.compressobj(COMPRESS_LEVEL, zlib.DEFLATED, GZIP_WBITS)
+        compressed = compressor.compress(data) + compressor.flush()
+        seconds = time.thread_time() - started
+
+        if len(compressed) >= len(data):
+            self.account("compress", seconds, incompressible=1)
+            return None
+        self.account("compress", seconds, len(data), len(compressed), compressed=1)
+        return compressed
+
+    def compress_chunks(self, chunks: Iterable[bytes]) -> Iterator[bytes]:
+        """
+        Compresses a value as its chunks are read.
+        """
+        compressor = zlib.compressobj(COMPRESS_LEVEL, zlib.DEFLATED, GZIP_WBITS)
+        for chunk in chunks:
+            started = time.thread_time()
+            compressed = compressor.compress(chunk)
+            self.account(
+                "compress", time.thread_time() - started, len(chunk), len(compressed)
+            )
+            if compressed:
+                yield compressed
+
+        started = time.thread_time()
+        compressed = compressor.flush()
+        self.account(
+            "compress", time.thread_time() - started, 0, len(compressed), compressed=1
+        )
+        yield compressed
+
+    def decompress(self, data: bytes) -> bytes:
+        started = time.thread_time()
+        value = zlib.decompress(data, GZIP_WBITS)
+        self.account("decompress", time.thread_time() - started, decompressed=1)
+        return value
+
+    def decompress_chunks(self, chunks: Iterable[bytes]) -> Iterator[bytes]:
+        """
+        Decompresses a value as its chunks are read.
+        """
+        decompressor = zlib.decompressobj(GZIP_WBITS)
+        for chunk in chunks:
+            data = chunk
+            while data:
+                started = time.thread_time()
+                value = decompressor.decompress(data, DECOMPRESS_CHUNK_SIZE)
+                data = decompressor.unconsumed_tail
+                self.account("decompress", time.thread_time() - started)
+                if value:
+                    yield value
+
+        started = time.thread_time()
+        value = decompressor.flush()
+        self.account("decompress", time.thread_time() - started, decompressed=1)
+        if value:
+            yield value
+
+    def account(
+        self,
+        operation: str,
+        seconds: float,
+        original: int = 0,
+        compressed_size: int = 0,
+        **counts: int,
+    ):
+        with self.lock:
+            self.stats[f"{operation}_cpu_seconds"] += seconds
+            self.stats["original_bytes"] += original
+            self.stats["compressed_bytes"] += compressed_size
+            for name, count in counts.items():
+                self.stats[name] += count
+        metrics.COMPRESSION_CPU_SECONDS.inc(operation, amount=seconds)
+        if original or compressed_size:
+            metrics.COMPRESSION_BYTES.inc("original", amount=original)
+            metrics.COMPRESSION_BYTES.inc("compressed", amount=compressed_size)
+
+    def get_stats(self) -> dict:
+        with self.lock:
+            stats = dict(self.stats)
+        for name in ("compress_cpu_seconds", "decompress_cpu_seconds"):
+            stats[name] = round(stats[name], 3)
+        original = stats["original_bytes"]
+        stats["ratio"] = (
+            round(stats["compressed_bytes"] / original, 3) if original else None
+        )
+        stats["min_size"] = self.min_size
+        return stats
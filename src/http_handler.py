@@ -1,63 +1,455 @@
+import http.client
+import io
 import json
+import random
+import time
+import zlib
 from http.server import BaseHTTPRequestHandler
+from typing import Iterator, List, Tuple
+from urllib.parse import parse_qs, urlsplit
 
-from chord_node import ChordNode
+from chord_node import LookupResult, LOOKUP_MODES, READ_POLICIES
 import chord_client
+import metrics
+from chord_client import NOT_OWNER, STREAM_CHUNK_SIZE, Response
+from compression import ENCODING_GZIP, ENCODINGS, accepts_encoding
+from rpc import RPC_PORT_HEADER
+from storage import (
+    DEFAULT_CONTENT_TYPE,
+    decode_value,
+    encode_value,
+    value_from_json,
+    value_to_json,
+)
+from tracing import (
+    TRACE_HEADER,
+    TRACE_ID_HEADER,
+    current_trace,
+    format_hop,
+    new_trace_id,
+    read_trace,
+)
+from transfer import RANGE_CONTENT_TYPE, encode_pairs
+from vnodes import ALL_VNODES_PREFIX, VirtualNodes
+
+KEEP_ALIVE_TIMEOUT = 30
+# Longest chunk size line of a chunked request body
+MAX_CHUNK_LINE = 1024
+
+# Routes labelled as themselves in the metrics, and routes ending in a key or
+# id, which are labelled without it
+ROUTES = {
+    "/status",
+    "/node-info",
+    "/successor",
+    "/predecessor",
+    "/range",
+    "/range/release",
+    "/network",
+    "/successor_list",
+    "/predecessor_list",
+    "/fingers",
+    "/stats",
+    "/metrics",
+    "/vnodes",
+    "/batch/value",
+    "/batch/storage",
+    "/batch/replica",
+    "/notify",
+    "/stabilize",
+    "/fix_fingers",
+    "/join",
+    "/leave",
+    "/sim-crash",
+    "/sim-recover",
+}
+PREFIX_ROUTES = ["/storage/", "/value/", "/replica/", "/find_successor/", "/next_hop/"]
+
+
+def route_label(route: str) -> str:
+    """
+    The route of a request as labelled in the metrics. Unknown routes share
+    one label, so clients can't create any number of them.
+    """
+    if route in ROUTES:
+        return route
+    for prefix in PREFIX_ROUTES:
+        if route.startswith(prefix):
+            return prefix + "<key>"
+    return "other"
 
 
 class HTTPHandler(BaseHTTPRequestHandler):
-    def __init__(self, node: ChordNode, *args, **kwargs):
-        self.node = node
+    # Keep connections open between requests, and close idle ones after a while
+    protocol_version = "HTTP/1.1"
+    timeout = KEEP_ALIVE_TIMEOUT
+    # The headers and body of a response are written separately, so with
+    # Nagle's algorithm the body waits for the client's delayed ACK
+    disable_nagle_algorithm = True
+
+    def __init__(self, vnodes: VirtualNodes, *args, **kwargs):
+        self.vnodes = vnodes
         super().__init__(*args, **kwargs)
 
+    def handle_one_request(self):
+        self.started = None
+        self.status = None
+        self.route = ""
+        self.trace_token = None
+        # Why the request body couldn't be read, if it couldn't
+        self.body_error: str | None = None
+        super().handle_one_request()
+        if self.trace_token is not None:
+            current_trace.reset(self.trace_token)
+
+        # Nothing is recorded when the client closed the connection instead
+        # of sending another request
+        if self.started is not None and self.status is not None:
+            labels = (self.command or "", route_label(self.route))
+            metrics.HTTP_REQUESTS.inc(*labels, str(int(self.status)))
+            metrics.HTTP_REQUEST_SECONDS.observe(
+                time.perf_counter() - self.started, *labels
+            )
+
+    def send_response(self, code: int, message: str | None = None):
+        self.status = code
+        super().send_response(code, message)
+        # Tell peers they can send maintenance RPCs over the binary protocol
+        if self.vnodes.rpc_port:
+            self.send_header(RPC_PORT_HEADER, str(self.vnodes.rpc_port))
+
+    def parse_request(self) -> bool:
+        self.started = time.perf_counter()
+        if not super().parse_request():
+            return False
+
+        # Find the vnode the request is for, and strip its prefix
+        node, path = self.vnodes.resolve(self.path)
+        if node is None:
+            self.send_error(404, "Unknown vnode")
+            return False
+        self.node = node
+        # Join, leave and simulated crashes under /vnodes are for all vnodes
+        all_vnodes = self.path.startswith(ALL_VNODES_PREFIX + "/")
+        self.targets = self.vnodes.nodes if all_vnodes else [node]
+        self.path = path
+
+        # Split the query string from the route
+        url = urlsplit(self.path)
+        self.route = url.path
+        self.query = parse_qs(url.query)
+
+        # Take part in the trace the request belongs to, or start one
+        self.trace_id = self.headers.get(TRACE_ID_HEADER)
+        self.trace_origin = self.trace_id is None and self.starts_trace()
+        if self.trace_origin:
+            self.trace_id = new_trace_id()
+        # The hops after this node, which the route adds
+        self.trace_hops: List[str] = []
+        self.trace_token = current_trace.set(self.trace_id)
+        return True
+
+    def starts_trace(self) -> bool:
+        """
+        Whether to trace a client request, which is done when asked to with
+        ?trace=1, and for the sampled share of storage requests.
+        """
+        if "trace" in self.query:
+            return True
+        return (
+            self.route.startswith("/storage/")
+            and random.random() < self.node.trace_sample
+        )
+
+    def trace_headers(self) -> dict:
+        """
+        Headers listing the node id and milliseconds spent of this node and
+        the hops after it. The node that started the trace also returns its
+        id, and writes the trace to the event log.
+        """
+        hops = [format_hop(self.node.id, time.perf_counter() - self.started)]
+        headers = {TRACE_HEADER: ",".join(hops + self.trace_hops)}
+        if self.trace_origin:
+            headers[TRACE_ID_HEADER] = self.trace_id
+            self.node.logger.trace(
+                self.trace_id, route_label(self.route), hops + self.trace_hops
+            )
+        return headers
+
+    def get_lookup_mode(self) -> str | None:
+        """
+        Gets the lookup mode requested in the query string.
+        """
+        mode = self.query.get("mode", [None])[0]
+        if mode not in LOOKUP_MODES:
+            return None
+        return mode
+
+    def get_read_policy(self) -> str | None:
+        """
+        Gets the replica read policy requested in the query string.
+        """
+        policy = self.query.get("read", [None])[0]
+        if policy not in READ_POLICIES:
+            return None
+        return policy
+
+    def read_body(self) -> bytes:
+        """
+        Reads the request body.
+        """
+        content_length = int(self.headers.get("Content-Length", 0))
+        return self.rfile.read(content_length)
+
+    def is_chunked(self) -> bool:
+        return self.headers.get("Transfer-Encoding", "").lower() == "chunked"
+
+    def read_chunks(self) -> Iterator[bytes]:
+        """
+        Reads the request body as it arrives, chunk by chunk if it is sent
+        with chunked encoding. Raises ConnectionError if the client stops
+        sending before the end of the body, or its chunks are malformed.
+        """
+        if not self.is_chunked():
+            remaining = int(self.headers.get("Content-Length", 0))
+            while remaining > 0:
+                chunk = self.rfile.read(min(remaining, STREAM_CHUNK_SIZE))
+                if not chunk:
+                    raise self.body_failed("Request body ended early")
+                remaining -= len(chunk)
+                yield chunk
+            return
+
+        while True:
+            line = self.rfile.readline(MAX_CHUNK_LINE)
+            if not line:
+                raise self.body_failed("Request body ended early")
+            try:
+                size = int(line.split(b";")[0], 16)
+            except ValueError:
+                raise self.body_failed("Malformed chunk size") from None
+            if size < 0:
+                raise self.body_failed("Malformed chunk size")
+            if size == 0:
+                self.rfile.readline(MAX_CHUNK_LINE)
+                return
+            chunk = self.rfile.read(size)
+            if len(chunk) < size:
+                raise self.body_failed("Request body ended early")
+            if self.rfile.readline(MAX_CHUNK_LINE) not in (b"\r\n", b"\n"):
+                raise self.body_failed("Malformed chunk")
+            yield chunk
+
+    def body_failed(self, reason: str) -> ConnectionError:
+        """
+        Get the error to raise when the request body can't be read. The rest
+        of the body can't be told apart from the next request, so the
+        connection is closed.
+        """
+        self.body_error = reason
+        self.close_connection = True
+        return ConnectionError(reason)
+
+    def get_content_encoding(self) -> str | None:
+        encoding = self.headers.get("Content-Encoding", "").strip().lower()
+        return None if encoding in ("", "identity") else encoding
+
+    def is_unsupported_encoding(self) -> bool:
+        """
+        Sends an error if the request body has a content encoding the node
+        can't decode.
+        """
+        encoding = self.get_content_encoding()
+        if encoding is None or encoding in ENCODINGS:
+            return False
+
+        # The body is left unread
+        self.close_connection = True
+        self.send_error(415, f"Unsupported content encoding '{encoding}'")
+        return True
+
+    def is_misdirected(self, key: str) -> bool:
+        """
+        Sends a 'not owner' error if the request asks the node to check that it
+        owns the key, and it doesn't.
+        """
+        if "check_owner" not in self.query or self.node.owns(self.node.hash(key)):
+            return False
+
+        self.send_error(NOT_OWNER, f"{self.node.id} is not the owner of '{key}'")
+        return True
+
+    def respond(
+        self, body: bytes = b"", content_type: str = "text/plain", headers=None
+    ):
+        """
+        Sends a 200 response with the given body.
+        """
+        if self.trace_id:
+            headers = {**(headers or {}), **self.trace_headers()}
+
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def respond_value(self, value: bytes, headers=None):
+        """
+        Sends a stored value with its content type. A compressed value is
+        sent as it is stored if the client accepts its encoding, and
+        decompressed otherwise.
+        """
+        data, content_type, encoding = decode_value(value)
+        if encoding and accepts_encoding(self.headers.get("Accept-Encoding"), encoding):
+            headers = {**(headers or {}), "Content-Encoding": encoding}
+        elif encoding:
+            try:
+                data = self.node.compressor.decompress(data)
+            except zlib.error:
+                self.send_error(500, "Stored value can't be decompressed")
+                return
+        self.respond(data, content_type, headers)
+
+    def respond_stream(self, response: Response, headers=None):
+        """
+        Sends a 200 response with the body and content type of a peer's
+        response, copying the body over as it is read. A compressed body is
+        decompressed on the way if the client doesn't accept its encoding,
+        and then sent with chunked encoding.
+        """
+        headers = dict(headers or {})
+        chunks = response.iter_content()
+        length = response.length
+        encoding = response.headers.get("Content-Encoding")
+        if encoding and accepts_encoding(self.headers.get("Accept-Encoding"), encoding):
+            headers["Content-Encoding"] = encoding
+        elif encoding:
+            chunks = self.node.compressor.decompress_chunks(chunks)
+            length = None
+        if self.trace_id:
+            headers.update(self.trace_headers())
+
+        self.send_response(200)
+        self.send_header(
+            "Content-Type", response.headers.get("Content-Type", DEFAULT_CONTENT_TYPE)
+        )
+        if length is None:
+            self.send_header("Transfer-Encoding", "chunked")
+        else:
+            self.send_header("Content-Length", str(length))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+
+        sent = 0
+        try:
+            for chunk in chunks:
+                if length is None:
+                    self.wfile.write(b"%X\r\n%s\r\n" % (len(chunk), chunk))
+                else:
+                    self.wfile.write(chunk)
+                sent += len(chunk)
+            if length is None:
+                self.wfile.write(b"0\r\n\r\n")
+                return
+        except (http.client.HTTPException, OSError, zlib.error):
+            self.close_connection = True
+            return
+        # The client can't tell where a cut off body ends, so it can't reuse
+        # the connection
+        if sent < length:
+            self.close_connection = True
+
     def do_GET(self):
         """
         Handles get requests.
         """
         if self.node.sim_crash:
+            self.close_connection = True
             return
 
         # Check the path and run the associated function
-        if self.path == ("/status"):
+        if self.route == ("/status"):
             self.get_status()
 
-        elif self.path == ("/node-info"):
+        elif self.route == ("/node-info"):
             self.get_node_info()
 
-        elif self.path == ("/successor"):
+        elif self.route == ("/successor"):
             self.get_successor()
 
-        elif self.path == ("/predecessor"):
+        elif self.route == ("/predecessor"):
             self.get_predecessor()
 
-        elif self.path.startswith("/storage/"):
+        elif self.route.startswith("/storage/"):
             try:
-                key = self.path.split("/storage/")[1]
+                key = self.route.split("/storage/")[1]
             except (ValueError, IndexError):
                 self.send_error(400, "Invalid key format")
                 return
             self.get_storage(key)
 
-        elif self.path.startswith("/value/"):
+        elif self.route.startswith("/value/"):
             try:
-                key = self.path.split("/value/")[1]
+                key = self.route.split("/value/")[1]
                 self.get_value(key)
             except (ValueError, IndexError):
                 self.send_error(400, "Invalid key format")
 
-        elif self.path.startswith("/find_successor/"):
+        elif self.route.startswith("/replica/"):
+            try:
+                key = self.route.split("/replica/")[1]
+                self.get_replica(key)
+            except (ValueError, IndexError):
+                self.send_error(400, "Invalid key format")
+
+        elif self.route.startswith("/find_successor/"):
             try:
-                key = self.path.split("/find_successor/")[1]
+                key = self.route.split("/find_successor/")[1]
                 self.get_find_successor(int(key))
             except (ValueError, IndexError):
                 self.send_error(400, "Invalid key format")
 
-        elif self.path == "/network":
+        elif self.route.startswith("/next_hop/"):
+            try:
+                key = self.route.split("/next_hop/")[1]
+                self.get_next_hop(int(key))
+            except (ValueError, IndexError):
+                self.send_error(400, "Invalid key format")
+
+        elif self.route == "/range":
+            try:
+                start = int(self.query["start"][0])
+                end = int(self.query["end"][0])
+            except (KeyError, ValueError):
+                self.send_error(400, "Invalid range")
+                return
+            self.get_range(start, end)
+
+        elif self.route == "/network":
             self.get_network()
 
-        elif self.path == "/successor_list":
+        elif self.route == "/successor_list":
             self.get_successor_list()
 
+        elif self.route == "/predecessor_list":
+            self.get_predecessor_list()
+
+        elif self.route == "/fingers":
+            self.get_fingers()
+
+        elif self.route == "/stats":
+            self.get_stats()
+
+        elif self.route == "/vnodes":
+            self.get_vnodes()
+
+        elif self.route == "/metrics":
+            self.get_metrics()
+
         # Unknown paths receive a 404
         else:
             self.send_error(404, "Not Found")
@@ -67,33 +459,49 @@ class HTTPHandler(BaseHTTPRequestHandler):
         Handles put requests.
         """
         if self.node.sim_crash:
+            self.close_connection = True
             return
 
         # Check the path and run the associated function
-        if self.path.startswith("/value/"):
+        if self.route.startswith("/value/"):
             try:
-                key = self.path.split("/value/")[1]
+                key = self.route.split("/value/")[1]
                 self.put_value(key)
             except (ValueError, IndexError):
                 self.send_error(400, "Invalid key format")
 
-        elif self.path.startswith("/storage/"):
+        elif self.route.startswith("/storage/"):
             try:
-                key = self.path.split("/storage/")[1]
+                key = self.route.split("/storage/")[1]
                 self.put_storage(key)
             except (ValueError, IndexError):
                 self.send_error(400, "Invalid key format")
 
-        elif self.path == "/notify":
+        elif self.route == "/batch/value":
+            self.put_batch_value()
+
+        elif self.route == "/batch/storage":
+            self.put_batch_storage()
+
+        elif self.route == "/batch/replica":
+            self.put_batch_replica()
+
+        elif self.route == "/range":
+            self.put_range()
+
+        elif self.route == "/notify":
             self.put_notify()
 
-        elif self.path == "/fix_fingers":
+        elif self.route == "/stabilize":
+            self.put_stabilize()
+
+        elif self.route == "/fix_fingers":
             self.put_fix_fingers()
 
-        elif self.path == "/successor":
+        elif self.route == "/successor":
             self.put_successor()
 
-        elif self.path == "/predecessor":
+        elif self.route == "/predecessor":
             self.put_predecessor()
 
         # Unknown paths receive a 404
@@ -108,6 +516,8 @@ class HTTPHandler(BaseHTTPRequestHandler):
         if self.node.sim_crash:
             if self.path == "/sim-recover":
                 self.post_sim_recover()
+            else:
+                self.close_connection = True
             return
 
         if self.path.startswith("/join"):
@@ -120,6 +530,21 @@ class HTTPHandler(BaseHTTPRequestHandler):
         elif self.path == "/leave":
             self.post_leave()
 
+        elif self.route == "/range/release":
+            try:
+                start = int(self.query["start"][0])
+                end = int(self.query["end"][0])
+            except (KeyError, ValueError):
+                self.send_error(400, "Invalid range")
+                return
+            self.post_range_release(start, end)
+
+        elif self.route == "/batch/value":
+            self.post_batch_value()
+
+        elif self.route == "/batch/storage":
+            self.post_batch_storage()
+
         elif self.path == "/sim-crash":
             self.post_sim_crash()
 
@@ -136,9 +561,7 @@ class HTTPHandler(BaseHTTPRequestHandler):
         Response:
             200 When request has been received
         """
-        self.send_response(200)
-        self.send_header("Content-Type", "text/plain")
-        self.end_headers()
+        self.respond()
 
     def get_successor(self):
         """
@@ -152,10 +575,7 @@ class HTTPHandler(BaseHTTPRequestHandler):
             self.send_error(404, "Can't reach successor")
             return
 
-        self.send_response(200)
-        self.send_header("Content-Type", "text/plain")
-        self.end_headers()
-        self.wfile.write(self.node.successor.encode())
+        self.respond(self.node.successor.encode())
 
     def get_node_info(self):
         """
@@ -176,10 +596,7 @@ class HTTPHandler(BaseHTTPRequestHandler):
             "others": list(neighbours),
         }
 
-        self.send_response(200)
-        self.send_header("Content-Type", "application/json")
-        self.end_headers()
-        self.wfile.write(json.dumps(info).encode())
+        self.respond(json.dumps(info).encode(), "application/json")
 
     def get_predecessor(self):
         """
@@ -193,10 +610,7 @@ class HTTPHandler(BaseHTTPRequestHandler):
             self.send_error(404, f"{self.node.id} does not have a predecessor")
             return
 
-        self.send_response(200)
-        self.send_header("Content-Type", "text/plain")
-        self.end_headers()
-        self.wfile.write(predecessor.encode("utf-8"))
+        self.respond(predecessor.encode("utf-8"))
 
     def get_value(self, key: str):
         """
@@ -204,16 +618,31 @@ class HTTPHandler(BaseHTTPRequestHandler):
         Response:
             200 Successful and the value in the body
             404 If the nodes doesn't have the value
+            421 If asked to check ownership with ?check_owner=1 and not the owner
         """
+        if self.is_misdirected(key):
+            return
+
         value = self.node.get_value(key)
         if value is None:
             self.send_error(404, f"{self.node.id} is not the owner of '{key}'")
             return
 
-        self.send_response(200)
-        self.send_header("Content-Type", "text/plain")
-        self.end_headers()
-        self.wfile.write(value.encode("utf-8"))
+        self.respond_value(value, self.node.replica_headers())
+
+    def get_replica(self, key: str):
+        """
+        Get a value the node holds, either as the owner or as a replica.
+        Response:
+            200 Successful and the value in the body
+            404 If the node doesn't hold the value
+        """
+        value = self.node.get_replica_value(key)
+        if value is None:
+            self.send_error(404, f"{self.node.id} has no replica of '{key}'")
+            return
+
+        self.respond_value(value)
 
     def get_find_successor(self, key: int):
         """
@@ -223,20 +652,39 @@ class HTTPHandler(BaseHTTPRequestHandler):
             404 Couldn't find the owner of the key
         """
         # Find successor
-        successor = self.node.find_successor(key)
-        if not successor:
+        result = self.node.lookup(key, self.get_lookup_mode())
+        if not result:
             self.send_error(404, f"Couldn't find owner of key '{key}'")
             return
 
         # Send response containing the successor
-        self.send_response(200)
-        self.send_header("Content-Type", "text/plain")
-        self.end_headers()
-        self.wfile.write(successor.encode("utf-8"))
+        self.trace_hops = result.trace
+        self.respond(result.successor.encode("utf-8"), headers=lookup_headers(result))
+
+    def get_next_hop(self, key: int):
+        """
+        Finds the next node of an iterative lookup of the given key.
+        Nodes in the comma separated 'exclude' query parameter are skipped.
+        Response:
+            200 Successful and whether the node is the owner and the node
+            404 No next node could be found
+        """
+        exclude = self.query.get("exclude", [""])[0].split(",")
+        hop = self.node.next_hop(key, {node for node in exclude if node})
+        if hop is None:
+            self.send_error(404, f"No next hop towards key '{key}'")
+            return
+
+        done, node = hop
+        body = json.dumps({"done": done, "node": node}).encode()
+        self.respond(body, "application/json")
 
     def get_storage(self, raw_key: str):
         """
-        Retrieves the value associated with the given key from the DHT.
+        Retrieves the value associated with the given key from the DHT, with
+        the content type it was stored with. The value is passed on as it
+        arrives from the owner.
+        With ?read=nearest or ?read=random the value may come from a replica.
         Response:
             200 and the value if the value is found
             404 if key can't be found
@@ -246,27 +694,70 @@ class HTTPHandler(BaseHTTPRequestHandler):
         key = self.node.hash(raw_key)
         self.node.logger.log_client_request("get_storage", key)
 
-        # Find responsible node
-        successor = self.node.find_successor(key)
-        if not successor:
+        # Find responsible node and get the value
+        result, response = self.node.read_value(
+            raw_key, self.get_lookup_mode(), self.get_read_policy()
+        )
+        if not result:
             self.send_error(404, f"Couldn't find the owner of key '{key}'")
             return
-
-        # Get the value
-        response = chord_client.get_value(successor, raw_key)
         if response is None:
             self.send_error(500, f"Couldn't connect to owner of key '{key}'")
             return
-        if response.status_code != 200:
-            self.send_error(response.status_code, response.text)
-            return
-        value = response.text
 
-        # Send response containing the value
+        try:
+            if response.status_code != 200:
+                self.send_error(response.status_code, response.reason)
+                return
+
+            # Send response containing the value
+            self.trace_hops = result.trace + read_trace(response)
+            self.respond_stream(response, lookup_headers(result))
+        finally:
+            response.close()
+
+    def get_range(self, start: int, end: int):
+        """
+        Streams the stored pairs whose keys hash into (start, end] as a chunked
+        body of JSON [key, value] lines. The keys sent are kept until the
+        receiver releases them with POST /range/release.
+        Response:
+            200 and the pairs
+            400 Missing or invalid start and end
+        """
         self.send_response(200)
-        self.send_header("Content-Type", "text/plain")
+        self.send_header("Content-Type", RANGE_CONTENT_TYPE)
+        self.send_header("Transfer-Encoding", "chunked")
         self.end_headers()
-        self.wfile.write(value.encode("utf-8"))
+
+        peer = f"{self.client_address[0]}:{self.client_address[1]}"
+        progress = self.node.transfers.start("sent", peer)
+        keys = self.node.range_keys(start, end)
+        try:
+            for chunk in encode_pairs(self.node.range_items(keys), progress):
+                self.wfile.write(b"%X\r\n%s\r\n" % (len(chunk), chunk))
+            self.wfile.write(b"0\r\n\r\n")
+            self.wfile.flush()
+        except OSError:
+            self.node.transfers.finish(progress, ok=False)
+            self.close_connection = True
+            return
+        self.node.transfers.finish(progress)
+        self.node.range_sent(start, end, keys)
+
+    def post_range_release(self, start: int, end: int):
+        """
+        Removes the keys of (start, end] last sent with GET /range, once the
+        receiver stored them.
+        Response:
+            200 Keys released
+            400 Missing or invalid start and end
+            404 No keys of the range were sent
+        """
+        if not self.node.release_range(start, end):
+            self.send_error(404, f"No keys of ({start}, {end}] were sent")
+            return
+        self.respond()
 
     def get_network(self):
         """
@@ -283,10 +774,7 @@ class HTTPHandler(BaseHTTPRequestHandler):
                 neighbours.add(finger)
 
         # Send response containing the neighbors
-        self.send_response(200)
-        self.send_header("Content-Type", "application/json")
-        self.end_headers()
-        self.wfile.write(json.dumps(list(neighbours)).encode())
+        self.respond(json.dumps(list(neighbours)).encode(), "application/json")
 
     def get_successor_list(self):
         """
@@ -295,10 +783,53 @@ class HTTPHandler(BaseHTTPRequestHandler):
             200 Successful and the successor list
         """
         # Send response containing the neighbors
-        self.send_response(200)
-        self.send_header("Content-Type", "application/json")
-        self.end_headers()
-        self.wfile.write(json.dumps(self.node.successor_list).encode())
+        self.respond(json.dumps(self.node.successor_list).encode(), "application/json")
+
+    def get_predecessor_list(self):
+        """
+        Retrieves the first predecessors of the node, which only nodes keeping
+        replicas track.
+        Response:
+            200 Successful and the predecessor list
+        """
+        body = json.dumps(self.node.predecessor_list).encode()
+        self.respond(body, "application/json")
+
+    def get_fingers(self):
+        """
+        Retrieves the finger table of the node.
+        Response:
+            200 Successful and the list of fingers, null for missing ones
+        """
+        self.respond(
+            json.dumps(self.node.finger_table[1:]).encode(), "application/json"
+        )
+
+    def get_stats(self):
+        """
+        Retrieves runtime statistics of the node.
+        Response:
+            200 Successful and the statistics
+        """
+        stats = self.node.get_stats()
+        self.respond(json.dumps(stats).encode(), "application/json")
+
+    def get_metrics(self):
+        """
+        Retrieves the metrics of the process in the Prometheus text format.
+        Response:
+            200 Successful and the metrics
+        """
+        self.respond(metrics.registry.render(), metrics.CONTENT_TYPE)
+
+    def get_vnodes(self):
+        """
+        Retrieves the share of the ring and number of keys of each vnode of
+        the process.
+        Response:
+            200 Successful and the vnodes as JSON in the body
+        """
+        self.respond(json.dumps(self.vnodes.get_balance()).encode(), "application/json")
 
     def put_notify(self):
         """
@@ -313,7 +844,7 @@ class HTTPHandler(BaseHTTPRequestHandler):
             return
 
         # Get the predecessor from the body
-        body = self.rfile.read(content_length)
+        body = self.read_body()
         try:
             predecessor = body.decode("utf-8").strip()
         except UnicodeDecodeError:
@@ -322,15 +853,15 @@ class HTTPHandler(BaseHTTPRequestHandler):
 
         self.node.notify(predecessor)
 
-        self.send_response(200)
-        self.send_header("Content-Type", "text/plain")
-        self.end_headers()
+        self.respond()
 
-    def put_value(self, key: str):
+    def put_stabilize(self):
         """
-        Inserts a value into the nodes key value store.
+        Notifies the node that the node in the body might be its predecessor,
+        and gets the node's predecessor and successor list, so a stabilize
+        run takes one round trip.
         Response:
-            200 On successful insertion
+            200 Successful and the predecessor and successor list as JSON
             400 Empty body or invalid encoding
         """
         content_length = int(self.headers.get("Content-Length", 0))
@@ -338,75 +869,341 @@ class HTTPHandler(BaseHTTPRequestHandler):
             self.send_error(400, "Empty request body")
             return
 
-        # Get the value from the body
-        body = self.rfile.read(content_length)
         try:
-            value = body.decode("utf-8").strip()
+            predecessor = self.read_body().decode("utf-8").strip()
         except UnicodeDecodeError:
             self.send_error(400, "Invalid UTF-8 encoding")
             return
 
+        reply = self.node.stabilize_reply(predecessor)
+        self.respond(json.dumps(reply).encode(), "application/json")
+
+    def put_value(self, key: str):
+        """
+        Inserts a value into the nodes key value store, along with its
+        Content-Type and Content-Encoding. A compressed value is stored as it
+        is. The body may be sent with chunked encoding.
+        Response:
+            200 On successful insertion
+            400 Empty body
+            415 Unsupported Content-Encoding
+            421 If asked to check ownership with ?check_owner=1 and not the owner
+        """
+        content_length = int(self.headers.get("Content-Length", 0))
+        if not content_length and not self.is_chunked():
+            self.send_error(400, "Empty request body")
+            return
+        if self.is_unsupported_encoding():
+            return
+
+        # Get the value from the body, in one read unless it is chunked
+        try:
+            if self.is_chunked():
+                body = b"".join(self.read_chunks())
+            else:
+                body = self.read_body()
+                if len(body) < content_length:
+                    raise ConnectionError("Request body ended early")
+        except ConnectionError:
+            self.close_connection = True
+            return
+        if not body:
+            self.send_error(400, "Empty request body")
+            return
+
+        if self.is_misdirected(key):
+            return
+
+        value = encode_value(
+            body, self.headers.get("Content-Type"), self.get_content_encoding()
+        )
         self.node.insert_value(key, value)
+        self.node.replicate({key: value})
 
-        self.send_response(200)
-        self.send_header("Content-Type", "text/plain")
-        self.end_headers()
+        self.respond()
 
     def put_storage(self, raw_key: str):
         """
-        Inserts a key value pair in the DHT.
+        Inserts a key value pair in the DHT. The value may be any bytes, and
+        its Content-Type is kept. Values larger than STREAM_CHUNK_SIZE, or
+        sent with chunked encoding, are passed on to the owner as they arrive
+        instead of being read into memory first.
+        Text values at least as large as the node's compression threshold
+        are compressed before they are sent to the owner. Values sent
+        compressed with a Content-Encoding are stored as they are.
         Response:
-            200 On successful insertion
-            400 Empty body or invalid encoding
+            200 On successful insertion, with the value in the body unless it
+                was streamed
+            400 Empty body
+            415 Unsupported Content-Encoding
             500 Internal error
         """
         key = self.node.hash(raw_key)
         self.node.logger.log_client_request("put_storage", key=key)
 
         content_length = int(self.headers.get("Content-Length", 0))
-        if not content_length:
+        if not content_length and not self.is_chunked():
             self.send_error(400, "Empty request body")
             return
-
-        # Get the value from the body
-        body = self.rfile.read(content_length)
-        try:
-            value = body.decode("utf-8").strip()
-        except UnicodeDecodeError:
-            self.send_error(400, "Invalid UTF-8 encoding")
+        if self.is_unsupported_encoding():
             return
-
-        # Find responsible node
-        successor = self.node.find_successor(key)
-        if not successor:
+        content_type = self.headers.get("Content-Type")
+        encoding = self.get_content_encoding()
+        compressor = self.node.compressor
+
+        value = b""
+        if self.is_chunked() or content_length > STREAM_CHUNK_SIZE:
+            chunks = self.read_chunks()
+            length = None if self.is_chunked() else content_length
+            if encoding is None and compressor.should_compress(
+                length, content_type or DEFAULT_CONTENT_TYPE
+            ):
+                chunks = compressor.compress_chunks(chunks)
+                length, encoding = None, ENCODING_GZIP
+
+            # The body can't be sent twice, so the owner is looked up first
+            # instead of trying the cached owner
+            result = self.node.lookup(key, self.get_lookup_mode())
+            response = None
+            if result:
+                response = chord_client.stream_value(
+                    result.successor, raw_key, chunks, length, content_type, encoding
+                )
+            # What is left of the body can't be told apart from the next
+            # request
+            if response is None or response.status_code != 200:
+                self.close_connection = True
+        else:
+            value = self.read_body()
+            body, body_encoding = value, encoding
+            if encoding is None:
+                compressed = compressor.compress(
+                    value, content_type or DEFAULT_CONTENT_TYPE
+                )
+                if compressed is not None:
+                    body, body_encoding = compressed, ENCODING_GZIP
+
+            # Find responsible node and insert value
+            result, response = self.node.call_owner(
+                key,
+                self.get_lookup_mode(),
+                lambda owner, check: chord_client.set_value(
+                    owner, raw_key, body, check, content_type, body_encoding
+                ),
+            )
+        if not result:
             self.send_error(400, f"Couldn't find owner of key '{key}'")
             return
-
-        # Insert value
-        response = chord_client.set_value(successor, raw_key, value)
+        if response is None and self.body_error:
+            self.send_error(400, self.body_error)
+            return
         if response is None:
             self.send_error(500, "Error occured while setting value")
             return
         if response.status_code != 200:
-            self.send_error(response.status_code, response.text)
+            self.send_error(response.status_code, response.reason)
             return
 
-        self.send_response(200)
-        self.send_header("Content-Type", "text/plain")
-        self.end_headers()
-        self.wfile.write(value.encode("utf-8"))
+        headers = lookup_headers(result)
+        if value and encoding:
+            headers["Content-Encoding"] = encoding
+        self.trace_hops = result.trace + read_trace(response)
+        self.respond(value, content_type or DEFAULT_CONTENT_TYPE, headers)
+
+    def read_json(self, expected_type: type):
+        """
+        Reads a JSON body of the expected type.
+        Sends a 400 error and returns None if the body is invalid.
+        """
+        try:
+            body = json.loads(self.read_body())
+        except (UnicodeDecodeError, json.JSONDecodeError):
+            self.send_error(400, "Invalid JSON body")
+            return None
+
+        if not isinstance(body, expected_type):
+            self.send_error(400, f"Expected a JSON {expected_type.__name__}")
+            return None
+        return body
+
+    def put_batch_value(self):
+        """
+        Inserts many key value pairs into the nodes key value store.
+        Body:
+            JSON object of keys and values
+        Response:
+            200 and a JSON object with the status of each key
+            400 Invalid body
+        """
+        pairs = self.read_json(dict)
+        if pairs is None:
+            return
+
+        try:
+            pairs = {str(key): value_from_json(value) for key, value in pairs.items()}
+        except (ValueError, TypeError):
+            self.send_error(400, "Invalid base64 value")
+            return
+        check_owner = "check_owner" in self.query
+        results = {}
+        inserted = {}
+        for key, data in pairs.items():
+            if check_owner and not self.node.owns(self.node.hash(key)):
+                results[key] = {"status": NOT_OWNER}
+                continue
+            compressed = self.node.compressor.compress(data, DEFAULT_CONTENT_TYPE)
+            if compressed is None:
+                inserted[key] = encode_value(data)
+            else:
+                inserted[key] = encode_value(compressed, encoding=ENCODING_GZIP)
+            self.node.insert_value(key, inserted[key])
+            results[key] = {"status": 200}
+        self.node.replicate(inserted)
+
+        self.respond(json.dumps({"results": results}).encode(), "application/json")
+
+    def put_batch_replica(self):
+        """
+        Stores copies of a predecessor's key value pairs.
+        Body:
+            JSON object of keys and values
+        Response:
+            200 On successful insertion
+            400 Invalid body
+        """
+        pairs = self.read_json(dict)
+        if pairs is None:
+            return
+
+        try:
+            pairs = {str(key): value_from_json(value) for key, value in pairs.items()}
+        except (ValueError, TypeError):
+            self.send_error(400, "Invalid base64 value")
+            return
+        self.node.insert_replicas(pairs)
+        self.respond()
+
+    def put_range(self):
+        """
+        Stores the pairs of a range transfer, sent as a chunked body of JSON
+        [key, value] lines. The pairs are stored as they arrive.
+        Response:
+            200 On successful insertion
+            400 Invalid or incomplete body
+        """
+        peer = f"{self.client_address[0]}:{self.client_address[1]}"
+        if not self.node.receive_range(self.read_chunks(), peer):
+            # The rest of the body is left unread
+            self.close_connection = True
+            self.send_error(400, "Invalid range transfer")
+            return
+
+        self.respond()
+
+    def post_batch_value(self):
+        """
+        Gets many values from the nodes key value store.
+        Body:
+            JSON list of keys
+        Response:
+            200 and a JSON object with the status and value of each key, with
+                compressed values as stored and their encoding
+            400 Invalid body
+        """
+        keys = self.read_json(list)
+        if keys is None:
+            return
+
+        check_owner = "check_owner" in self.query
+        results = {}
+        for key in map(str, keys):
+            if check_owner and not self.node.owns(self.node.hash(key)):
+                results[key] = {"status": NOT_OWNER}
+                continue
+            value = self.node.get_value(key)
+            if value is None:
+                results[key] = {"status": 404}
+            else:
+                data, _, encoding = decode_value(value)
+                results[key] = {"status": 200, "value": value_to_json(bytes(data))}
+                if encoding:
+                    results[key]["encoding"] = encoding
+
+        self.respond(json.dumps({"results": results}).encode(), "application/json")
+
+    def put_batch_storage(self):
+        """
+        Inserts many key value pairs in the DHT, with one request per owner.
+        Body:
+            JSON object of keys and values, which are strings or
+            {"base64": <value>}
+        Response:
+            200 and a JSON object with the status of each key
+            400 Invalid body
+        """
+        self.node.logger.log_client_request("put_batch_storage")
+        pairs = self.read_json(dict)
+        if pairs is None:
+            return
+
+        try:
+            pairs = {str(key): value_from_json(value) for key, value in pairs.items()}
+        except (ValueError, TypeError):
+            self.send_error(400, "Invalid base64 value")
+            return
+        results = self.node.set_values(pairs, self.get_lookup_mode())
+        self.respond(json.dumps({"results": results}).encode(), "application/json")
+
+    def post_batch_storage(self):
+        """
+        Gets the values of many keys from the DHT, with one request per owner.
+        Body:
+            JSON list of keys
+        Response:
+            200 and a JSON object with the status and value of each key, with
+                values that aren't UTF-8 as {"base64": <value>}, and
+                compressed values as stored if the client accepts gzip
+            400 Invalid body
+        """
+        self.node.logger.log_client_request("get_batch_storage")
+        keys = self.read_json(list)
+        if keys is None:
+            return
+
+        results = self.node.get_values(list(map(str, keys)), self.get_lookup_mode())
+        accept = self.headers.get("Accept-Encoding")
+        for result in results.values():
+            encoding = result.get("encoding")
+            if encoding and not accepts_encoding(accept, encoding):
+                self.decompress_result(result)
+        self.respond(json.dumps({"results": results}).encode(), "application/json")
+
+    def decompress_result(self, result: dict):
+        """
+        Replaces the compressed value of a batch result with the value.
+        """
+        try:
+            data = self.node.compressor.decompress(value_from_json(result["value"]))
+        except (zlib.error, ValueError):
+            result.clear()
+            result["status"] = 500
+            return
+        result["value"] = value_to_json(data)
+        del result["encoding"]
 
     def put_fix_fingers(self):
         """
-        Tells the node to update its finger table
+        Tells the node to update its finger table, or with ?bulk=1 to
+        refresh the whole table at once.
         Response:
             200 when request has been received
         """
-        self.node.fix_fingers()
+        if "bulk" in self.query:
+            self.node.refresh_fingers()
+        else:
+            self.node.fix_fingers()
 
-        self.send_response(200)
-        self.send_header("Content-Type", "text/plain")
-        self.end_headers()
+        self.respond()
 
     def put_successor(self):
         """
@@ -421,7 +1218,7 @@ class HTTPHandler(BaseHTTPRequestHandler):
             return
 
         # Get the value from the body
-        body = self.rfile.read(content_length)
+        body = self.read_body()
         try:
             successor = body.decode("utf-8").strip()
         except UnicodeDecodeError:
@@ -431,12 +1228,10 @@ class HTTPHandler(BaseHTTPRequestHandler):
         # Update successor
         self.node.successor = successor
 
-        successor_id = self.node.hash(successor)
+        successor_id = self.node.peer_id(successor)
         self.node.logger.updated_successor(successor_id)
 
-        self.send_response(200)
-        self.send_header("Content-Type", "text/plain")
-        self.end_headers()
+        self.respond()
 
     def put_predecessor(self):
         """
@@ -451,7 +1246,7 @@ class HTTPHandler(BaseHTTPRequestHandler):
             return
 
         # Get the value from the body
-        body = self.rfile.read(content_length)
+        body = self.read_body()
         try:
             predecessor = body.decode("utf-8").strip()
         except UnicodeDecodeError:
@@ -461,86 +1256,135 @@ class HTTPHandler(BaseHTTPRequestHandler):
         # Update predecessor
         self.node.predecessor = predecessor
 
-        predecessor_id = self.node.hash(predecessor)
+        predecessor_id = self.node.peer_id(predecessor)
         self.node.logger.updated_predecessor(predecessor_id)
 
-        self.send_response(200)
-        self.send_header("Content-Type", "text/plain")
-        self.end_headers()
+        self.respond()
 
-    def post_join(self, node: str):
+    def post_join(self, address: str):
         """
-        Tells the node to join the chord network of the given node
+        Tells the node to join the chord network of the given node. Sent to
+        /vnodes/join, all vnodes of the process join.
         Response:
             200 when request has been received
         """
-        # Join the other nodes network
-        self.node.join(node)
+        # Unlink the vnodes from each other first, so the ring they are in
+        # doesn't get merged into the one being joined
+        if len(self.targets) > 1:
+            for node in self.targets:
+                node.create()
 
-        node_id = self.node.hash(node)
-        successor_id = self.node.hash(self.node.successor)
-        self.node.logger.join(node_id)
-        self.node.logger.updated_successor(successor_id)
+        for node in self.targets:
+            # Join the other nodes network
+            node.join(address)
 
-        self.send_response(200)
-        self.send_header("Content-Type", "text/plain")
-        self.end_headers()
+            node_id = node.peer_id(address)
+            successor_id = node.peer_id(node.successor)
+            node.logger.join(node_id)
+            node.logger.updated_successor(successor_id)
+
+        self.respond()
 
     def post_leave(self):
         """
-        Tells a node to leave the network and be in its own network.
+        Tells a node to leave the network and be in its own network. Sent to
+        /vnodes/leave, all vnodes of the process leave.
         Response:
             200 When request has been received
         """
-        self.send_response(200)
-        self.send_header("Content-Type", "text/plain")
-        self.end_headers()
+        self.respond()
+
+        for node in self.targets:
+            node.logger.leave()
 
-        self.node.logger.leave()
+            # Make successor node and predecessor node point to each other
+            if node.predecessor and node.successor:
+                chord_client.set_successor(node.predecessor, node.successor)
+                chord_client.set_predecessor(node.successor, node.predecessor)
 
-        # Make successor node and predecessor node point to each other
-        if self.node.predecessor and self.node.successor:
-            chord_client.set_successor(self.node.predecessor, self.node.successor)
-            chord_client.set_predecessor(self.node.successor, self.node.predecessor)
+            # Send keys to successor
+            if node.successor != node.address:
+                node.push_range(node.successor, node.storage.items())
 
-        # Send keys to successor
-        for key, value in self.node.storage.items():
-            chord_client.set_value(self.node.successor, key, value)
+            # Leave the network by creating a new network
+            node.create()
 
-        # Leave the network by creating a new network
-        self.node.create()
+        # The vnodes of the process are left in a ring of their own
+        if len(self.targets) > 1:
+            self.vnodes.link_ring()
 
     def post_sim_crash(self):
         """
-        Tells a node to simulate that it has crashed.
+        Tells a node to simulate that it has crashed. Sent to /vnodes/sim-crash,
+        all vnodes of the process crash.
         Response:
             200 When request has been received
         """
-        self.node.logger.log_client_request("sim-crash")
-        self.node.stop_periodic_functions()
-        self.node.sim_crash = True
+        for node in self.targets:
+            node.logger.log_client_request("sim-crash")
+            node.stop_periodic_functions()
+            node.sim_crash = True
 
-        self.send_response(200)
-        self.send_header("Content-Type", "text/plain")
-        self.end_headers()
+        self.respond()
 
     def post_sim_recover(self):
         """
-        Tells a node to end simulated crash.
+        Tells a node to end simulated crash. Sent to /vnodes/sim-recover, all
+        vnodes of the process recover.
         Response:
             200 When request has been received
         """
-        self.node.logger.log_client_request("sim_recover")
-        self.node.start_periodic_functions()
-        self.node.sim_crash = False
+        for node in self.targets:
+            node.logger.log_client_request("sim_recover")
+            node.start_periodic_functions()
+            node.sim_crash = False
 
-        self.send_response(200)
-        self.send_header("Content-Type", "text/plain")
-        self.end_headers()
+        self.respond()
 
 
-def create_handler(node: ChordNode):
+def lookup_headers(result: LookupResult) -> dict:
+    """
+    Headers describing how a lookup reached the owner.
+    """
+    headers = {"X-Chord-Hops": str(result.hops), "X-Chord-Path": ",".join(result.path)}
+    if result.cached:
+        headers["X-Chord-Owner-Cache"] = "hit"
+    if result.replica:
+        headers["X-Chord-Replica"] = result.successor
+    return headers
+
+
+def create_handler(vnodes: VirtualNodes):
     def handler(*args, **kwargs):
-        return HTTPHandler(node, *args, **kwargs)
+        return HTTPHandler(vnodes, *args, **kwargs)
 
     return handler
+
+
+def handle_in_process(
+    vnodes: VirtualNodes,
+    method: str,
+    path: str,
+    headers: dict,
+    body: bytes = b"",
+    client_address=("in-process", 0),
+    handler_class: type | None = None,
+) -> Tuple[bytes, bool]:
+    """
+    Runs a request through HTTPHandler without a socket.
+    Returns the raw HTTP response, and whether the connection should be closed.
+    """
+    handler_class = handler_class or HTTPHandler
+    lines = [f"{method} {path} HTTP/1.1"]
+    lines += [f"{name}: {value}" for name, value in headers.items()]
+    request = ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1") + body
+
+    handler = handler_class.__new__(handler_class)
+    handler.vnodes = vnodes
+    handler.client_address = client_address
+    handler.rfile = io.BytesIO(request)
+    handler.wfile = io.BytesIO()
+    handler.close_connection = True
+    handler.handle_one_request()
+
+    return handler.wfile.getvalue(), handler.close_connection
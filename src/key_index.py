@@ -0,0 +1,304 @@
+from bisect import bisect_left, bisect_right, insort
+from collections.abc import Mapping, MutableMapping
+from operator import attrgetter
+from threading import RLock
+from typing import Callable, Dict, Iterable, Iterator, List, Tuple
+
+# Records per chunk of the sorted records. A chunk twice this size is split
+# in two, so adding or removing a key moves at most that many records.
+CHUNK_SIZE = 512
+
+# Changes to more than 1/REBUILD_RATIO of the keys rebuild the chunks in one
+# pass, instead of adding or removing the keys one at a time
+REBUILD_RATIO = 8
+
+
+class KeyRecord:
+    """
+    A stored key, with its id on the ring and its value.
+    """
+
+    __slots__ = ("id", "key", "value")
+
+    def __init__(self, id: int, key: str, value):
+        self.id = id
+        self.key = key
+        self.value = value
+
+
+record_id = attrgetter("id")
+
+# A position in the sorted records, as the index of a chunk and of a record
+# within it
+Position = Tuple[int, int]
+
+
+class KeyIndex(MutableMapping):
+    """
+    Maps keys to values, keeping a record of each key with its ring id and
+    value in lists sorted by id. The keys in a ring interval are found with
+    a binary search and a slice, instead of hashing every stored key.
+
+    The sorted records are split into chunks of up to twice CHUNK_SIZE, with
+    the largest id of each, so a key is added or removed without moving all
+    the records after it. Whole intervals are split off by slicing chunks,
+    and merged back in by sorting, which merges sorted runs in linear time.
+    """
+
+    def __init__(self, hash: Callable[[str], int], pairs=()):
+        self.hash = hash
+        self.lock = RLock()
+        items = pairs.items() if isinstance(pairs, Mapping) else pairs
+        self.records: Dict[str, KeyRecord] = {
+            key: KeyRecord(hash(key), key, value) for key, value in items
+        }
+        self.chunks: List[List[KeyRecord]] = []
+        self.maxes: List[int] = []
+        self.build(sorted(self.records.values(), key=record_id))
+
+    def build(self, ordered: List[KeyRecord]):
+        """
+        Replaces the chunks with the sorted records. Expects the lock to be
+        held.
+        """
+        self.chunks = [
+            ordered[i : i + CHUNK_SIZE] for i in range(0, len(ordered), CHUNK_SIZE)
+        ]
+        self.maxes = [chunk[-1].id for chunk in self.chunks]
+
+    def ordered(self) -> List[KeyRecord]:
+        """
+        Get all records, sorted by id.
+        """
+        with self.lock:
+            return [record for chunk in self.chunks for record in chunk]
+
+    def __getitem__(self, key: str):
+        return self.records[key].value
+
+    def get(self, key: str, default=None):
+        record = self.records.get(key)
+        return default if record is None else record.value
+
+    def __setitem__(self, key: str, value):
+        with self.lock:
+            record = self.records.get(key)
+            if record is not None:
+                record.value = value
+                return
+            record = KeyRecord(self.hash(key), key, value)
+            self.records[key] = record
+            self.insert(record)
+
+    def __delitem__(self, key: str):
+        with self.lock:
+            self.remove(self.records.pop(key))
+
+    def pop(self, key: str, *default):
+        with self.lock:
+            if key not in self.records and default:
+                return default[0]
+            value = self.records[key].value
+            del self[key]
+            return value
+
+    def __contains__(self, key) -> bool:
+        return key in self.records
+
+    def __iter__(self) -> Iterator[str]:
+        with self.lock:
+            return iter(list(self.records))
+
+    def __len__(self) -> int:
+        return len(self.records)
+
+    def insert(self, record: KeyRecord):
+        """
+        Adds a record to the chunk its id falls in. Expects the lock to be
+        held.
+        """
+        if not self.chunks:
+            self.chunks.append([record])
+            self.maxes.append(record.id)
+            return
+
+        i = min(bisect_left(self.maxes, record.id), len(self.chunks) - 1)
+        chunk = self.chunks[i]
+        insort(chunk, record, key=record_id)
+        self.maxes[i] = chunk[-1].id
+        if len(chunk) >= 2 * CHUNK_SIZE:
+            self.chunks[i : i + 1] = [chunk[:CHUNK_SIZE], chunk[CHUNK_SIZE:]]
+            self.maxes[i : i + 1] = [chunk[CHUNK_SIZE - 1].id, chunk[-1].id]
+
+    def remove(self, record: KeyRecord):
+        """
+        Removes a record from its chunk. Expects the lock to be held.
+        """
+        i = bisect_left(self.maxes, record.id)
+        # Keys may share an id, so look past the other records with it
+        while True:
+            chunk = self.chunks[i]
+            j = bisect_left(chunk, record.id, key=record_id)
+            while j < len(chunk) and chunk[j] is not record:
+                j += 1
+            if j < len(chunk):
+                break
+            i += 1
+
+        del chunk[j]
+        if chunk:
+            self.maxes[i] = chunk[-1].id
+        else:
+            del self.chunks[i]
+            del self.maxes[i]
+
+    def locate(self, id: int) -> Position:
+        """
+        Get the position of the first record with an id above the given one.
+        Expects the lock to be held.
+        """
+        i = bisect_right(self.maxes, id)
+        if i == len(self.chunks):
+            return i, 0
+        return i, bisect_right(self.chunks[i], id, key=record_id)
+
+    def between(self, lo: Position, hi: Position) -> List[KeyRecord]:
+        """
+        Get the records from one position up to another. Expects the lock to
+        be held.
+        """
+        (i, j), (k, l) = lo, hi
+        if i == k:
+            return self.chunks[i][j:l] if i < len(self.chunks) else []
+        records = self.chunks[i][j:]
+        for chunk in self.chunks[i + 1 : k]:
+            records.extend(chunk)
+        if k < len(self.chunks):
+            records.extend(self.chunks[k][:l])
+        return records
+
+    def cut(self, lo: Position, hi: Position) -> List[KeyRecord]:
+        """
+        Removes and returns the records from one position up to another.
+        Expects the lock to be held.
+        """
+        records = self.between(lo, hi)
+        (i, j), (k, l) = lo, hi
+        head = self.chunks[i][:j] if i < len(self.chunks) else []
+        tail = self.chunks[k][l:] if k < len(self.chunks) else []
+        kept = [chunk for chunk in (head, tail) if chunk]
+        self.chunks[i : k + 1] = kept
+        self.maxes[i : k + 1] = [chunk[-1].id for chunk in kept]
+        return records
+
+    def interval(self, start: int, end: int) -> List[KeyRecord]:
+        """
+        Get the records with ids in the ring interval (start, end], in ring
+        order from start.
+        """
+        with self.lock:
+            lo, hi = self.locate(start), self.locate(end)
+            if start < end:
+                return self.between(lo, hi)
+            return self.between(lo, (len(self.chunks), 0)) + self.between((0, 0), hi)
+
+    def range_keys(self, start: int, end: int) -> List[str]:
+        return [record.key for record in self.interval(start, end)]
+
+    def split(self, start: int, end: int) -> "KeyIndex":
+        """
+        Removes the records with ids in (start, end], and returns them as an
+        index of their own.
+        """
+        split = KeyIndex(self.hash)
+        with self.lock:
+            lo, hi = self.locate(start), self.locate(end)
+            if start < end:
+                records = self.cut(lo, hi)
+            else:
+                # The end of the records is cut first, which leaves the
+                # position of end valid
+                records = self.cut(lo, (len(self.chunks), 0))
+                records = self.cut((0, 0), hi) + records
+            for record in records:
+                del self.records[record.key]
+        split.records = {record.key: record for record in records}
+        split.build(records)
+        return split
+
+    def merge(self, other: "KeyIndex"):
+        """
+        Takes over the records of another index, whose values replace ours
+        for the keys in both.
+        """
+        with self.lock:
+            added = []
+            for record in other.ordered():
+                existing = self.records.get(record.key)
+                if existing is not None:
+                    existing.value = record.value
+                    continue
+                self.records[record.key] = record
+                added.append(record)
+
+            if len(added) * REBUILD_RATIO <= len(self.records):
+                for record in added:
+                    self.insert(record)
+                return
+
+            # Sorting the two sorted runs merges them in linear time
+            ordered = [record for chunk in self.chunks for record in chunk]
+            ordered.extend(added)
+            ordered.sort(key=record_id)
+            self.build(ordered)
+
+    def with_values(self, values: Mapping) -> "KeyIndex":
+        """
+        Get an index of the given keys and values. The ids of the keys this
+        index has are copied instead of hashed again.
+        """
+        with self.lock:
+            records = [
+                KeyRecord(record.id, record.key, values[record.key])
+                for chunk in self.chunks
+                for record in chunk
+                if record.key in values
+            ]
+        index = KeyIndex(self.hash)
+        index.records = {record.key: record for record in records}
+        index.build(records)
+        if len(records) < len(values):
+            index.update(
+                (key, value) for key, value in values.items() if key not in index
+            )
+        return index
+
+    def update(self, pairs=(), **kwargs):
+        self.merge(KeyIndex(self.hash, pairs))
+        if kwargs:
+            self.merge(KeyIndex(self.hash, kwargs))
+
+    def pop_many(self, keys: Iterable[str]) -> Dict[str, object]:
+        """
+        Removes the keys, and returns the values of those that were stored.
+        """
+        with self.lock:
+            removed = []
+            for key in keys:
+                record = self.records.pop(key, None)
+                if record is not None:
+                    removed.append(record)
+
+            if len(removed) * REBUILD_RATIO <= len(self.records):
+                for record in removed:
+                    self.remove(record)
+            else:
+                self.build(
+                    [
+                        record
+                        for chunk in self.chunks
+                        for record in chunk
+                        if self.records.get(record.key) is record
+                    ]
+                )
+        return {record.key: record.value for record in removed}
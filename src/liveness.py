@@ -0,0 +1,68 @@
+import time
+from threading import Lock
+from typing import Callable, Dict, Tuple
+
+LIVENESS_TTL = 5
+
+# Weight of the newest sample in the smoothed round trip time
+RTT_SMOOTHING = 0.2
+
+
+class LivenessCache:
+    """
+    Remembers which peers recently answered or failed to answer a request,
+    so lookups don't have to ping a peer before forwarding to it.
+    """
+
+    def __init__(
+        self, ttl: float = LIVENESS_TTL, clock: Callable[[], float] = time.monotonic
+    ):
+        self.ttl = ttl
+        # Simulated rings pass their own clock
+        self.clock = clock
+        self.peers: Dict[str, Tuple[bool, float]] = {}
+        self.rtts: Dict[str, float] = {}
+        self.lock = Lock()
+        self.stats = {"hits": 0, "misses": 0, "suspected": 0}
+
+    def mark_alive(self, node: str, rtt: float | None = None):
+        self.peers[node] = (True, self.clock())
+        if rtt is not None:
+            previous = self.rtts.get(node, rtt)
+            self.rtts[node] = previous + RTT_SMOOTHING * (rtt - previous)
+
+    def get_rtt(self, node: str) -> float:
+        """
+        Get the smoothed round trip time to the node in seconds,
+        or infinity if it hasn't answered any request.
+        """
+        return self.rtts.get(node, float("inf"))
+
+    def mark_suspect(self, node: str):
+        self.peers[node] = (False, self.clock())
+        with self.lock:
+            self.stats["suspected"] += 1
+
+    def get(self, node: str) -> bool | None:
+        """
+        Get whether the node is alive, or None if it hasn't been seen
+        within the TTL.
+        """
+        entry = self.peers.get(node)
+        if entry is None or self.clock() - entry[1] > self.ttl:
+            with self.lock:
+                self.stats["misses"] += 1
+            return None
+
+        with self.lock:
+            self.stats["hits"] += 1
+        return entry[0]
+
+    def get_stats(self) -> dict:
+        now = self.clock()
+        with self.lock:
+            stats = dict(self.stats)
+        fresh = [alive for alive, seen in self.peers.values() if now - seen <= self.ttl]
+        stats["alive"] = sum(fresh)
+        stats["suspect"] = len(fresh) - stats["alive"]
+        return stats
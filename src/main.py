@@ -1,31 +1,236 @@
-import hashlib
+import argparse
+import asyncio
 import logging as log
-import sys
 from http.server import ThreadingHTTPServer
+from threading import Thread
 
-from chord_node import ChordNode
+import chord_client
+import async_client
+import async_server
+import periodic
+import rpc
+from chord_node import (
+    LOOKUP_MODES,
+    LOOKUP_RECURSIVE,
+    READ_OWNER,
+    READ_POLICIES,
+)
+from liveness import LIVENESS_TTL, LivenessCache
+from chord_logger import LOG_DROP, LOG_POLICIES, LOG_QUEUE_SIZE
+from compression import COMPRESS_MIN_SIZE
 from log import init_logger
+from maintenance import MAX_MAINTENANCE_INTERVAL
+from owner_cache import OWNER_CACHE_SIZE
+from storage import DATA_DIR, STORAGE_BACKENDS, STORAGE_MEMORY
 from http_handler import create_handler
+from vnodes import VirtualNodes
+
+ENGINE_THREADING = "threading"
+ENGINE_ASYNCIO = "asyncio"
+ENGINES = [ENGINE_THREADING, ENGINE_ASYNCIO]
+
+
+def sample_rate(value: str):
+    event, _, rate = value.partition("=")
+    try:
+        return event, float(rate)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected EVENT=RATE, got '{value}'")
+
+
+def arg_parser():
+    parser = argparse.ArgumentParser(description="Chord node")
+
+    parser.add_argument("endpoint", type=str, help="address (ip:port) of the node")
+    parser.add_argument("m", type=int, help="bit length of the identifier space")
+    parser.add_argument(
+        "--pool-size",
+        type=int,
+        default=chord_client.POOL_SIZE,
+        help="max idle connections kept open per peer",
+    )
+    parser.add_argument(
+        "--pool-idle-timeout",
+        type=float,
+        default=chord_client.POOL_IDLE_TIMEOUT,
+        help="seconds an idle connection is kept before it is closed",
+    )
+    parser.add_argument(
+        "--liveness-ttl",
+        type=float,
+        default=LIVENESS_TTL,
+        help="seconds a peer's observed liveness is trusted before pinging it",
+    )
+    parser.add_argument(
+        "--lookup-mode",
+        choices=LOOKUP_MODES,
+        default=LOOKUP_RECURSIVE,
+        help="default lookup mode, can be overridden per request with ?mode=",
+    )
+    parser.add_argument(
+        "--owner-cache-size",
+        type=int,
+        default=OWNER_CACHE_SIZE,
+        help="max key ranges whose owner is cached, 0 disables the cache",
+    )
+    parser.add_argument(
+        "--replicas",
+        type=int,
+        default=0,
+        help="number of successors each key is copied to",
+    )
+    parser.add_argument(
+        "--read-policy",
+        choices=READ_POLICIES,
+        default=READ_OWNER,
+        help="where reads of replicated keys go, can be overridden with ?read=",
+    )
+    parser.add_argument(
+        "--storage",
+        choices=STORAGE_BACKENDS,
+        default=STORAGE_MEMORY,
+        help="where stored values are kept, in memory or in an append-only log",
+    )
+    parser.add_argument(
+        "--data-dir",
+        default=DATA_DIR,
+        help="directory of the log files of the log storage",
+    )
+    parser.add_argument(
+        "--compress-min-size",
+        type=int,
+        default=COMPRESS_MIN_SIZE,
+        help="compress text and JSON values of at least this many bytes, "
+        "0 disables compression",
+    )
+    parser.add_argument(
+        "--log-queue-size",
+        type=int,
+        default=LOG_QUEUE_SIZE,
+        help="max events waiting to be written to the event log",
+    )
+    parser.add_argument(
+        "--log-policy",
+        choices=LOG_POLICIES,
+        default=LOG_DROP,
+        help="whether events are dropped or wait when the event log queue is full",
+    )
+    parser.add_argument(
+        "--log-sample",
+        type=sample_rate,
+        action="append",
+        default=[],
+        metavar="EVENT=RATE",
+        help="share of events of a type to log, such as found_successor=0.1",
+    )
+    parser.add_argument(
+        "--seed-fingers",
+        action=argparse.BooleanOptionalAction,
+        default=True,
+        help="guess the fingers from the successor's before refreshing them",
+    )
+    parser.add_argument(
+        "--proximity-routing",
+        action=argparse.BooleanOptionalAction,
+        default=True,
+        help="route through the lowest latency node of each finger interval",
+    )
+    parser.add_argument(
+        "--trace-sample",
+        type=float,
+        default=0,
+        help="share of storage requests traced and written to the event log",
+    )
+    parser.add_argument(
+        "--max-maintenance-interval",
+        type=float,
+        default=MAX_MAINTENANCE_INTERVAL,
+        help="max seconds the periodic maintenance backs off to while the ring "
+        "is unchanged, 0 keeps the fixed intervals",
+    )
+    parser.add_argument(
+        "--scheduler-workers",
+        type=int,
+        default=periodic.SCHEDULER_WORKERS,
+        help="threads running the periodic functions of all vnodes of the process",
+    )
+    parser.add_argument(
+        "--vnodes",
+        type=int,
+        default=1,
+        help="number of virtual nodes, each with its own id, hosted by the process",
+    )
+    parser.add_argument(
+        "--rpc-port",
+        type=int,
+        help="port to serve maintenance RPCs on with a binary protocol, and send "
+        "them with it to peers that do too",
+    )
+    parser.add_argument(
+        "--engine",
+        choices=ENGINES,
+        default=ENGINE_THREADING,
+        help="server runtime, a thread per connection or a single asyncio loop",
+    )
+
+    return parser
 
 
 def main():
     init_logger()
     log.info("Python script started.")
-    endpoint = sys.argv[1]
-    m = int(sys.argv[2])
+    parser = arg_parser()
+    args = parser.parse_args()
+    if args.rpc_port and args.engine == ENGINE_ASYNCIO:
+        parser.error("--rpc-port is only supported by the threading engine")
+    endpoint = args.endpoint
+    m = args.m
     ip, port = endpoint.split(":")
     port = int(port)
 
-    # Hash ip and port to avoid collisions if the same node is used twice
-    hash = hashlib.sha1(endpoint.encode()).hexdigest()
-    id = int(hash, 16) % (2**m)
+    # Setup the transport and liveness cache used for requests to other nodes
+    transport = chord_client.HTTPTransport(args.pool_size, args.pool_idle_timeout)
+    if args.rpc_port:
+        transport = rpc.RPCTransport(transport)
+    chord_client.set_transport(transport, LivenessCache(args.liveness_ttl))
+
+    node_options = {
+        "lookup_mode": args.lookup_mode,
+        "owner_cache_size": args.owner_cache_size,
+        "replicas": args.replicas,
+        "read_policy": args.read_policy,
+        "storage": args.storage,
+        "data_dir": args.data_dir,
+        "compress_min_size": args.compress_min_size,
+        "seed_fingers": args.seed_fingers,
+        "proximity": args.proximity_routing,
+        "trace_sample": args.trace_sample,
+        "max_maintenance_interval": args.max_maintenance_interval,
+        "log_options": {
+            "queue_size": args.log_queue_size,
+            "policy": args.log_policy,
+            "sample_rates": dict(args.log_sample),
+        },
+    }
+
+    if args.engine == ENGINE_ASYNCIO:
+        async_client.configure(args.pool_size, args.pool_idle_timeout)
+        asyncio.run(async_server.serve(ip, port, m, args.vnodes, **node_options))
+        return
+
+    # Setup the chord nodes, whose ids are hashes of their addresses, with
+    # their periodic functions run by the process' scheduler
+    periodic.configure(args.scheduler_workers)
+    vnodes = VirtualNodes(ip, port, m, args.vnodes, **node_options)
 
-    # Setup chord node
-    node = ChordNode(ip=ip, port=port, id=id, m=m)
-    log.info(f"Node initialized: \n\tID: {id} \n\tm: {m}")
+    if args.rpc_port:
+        rpc_server = rpc.create_server(vnodes, args.rpc_port)
+        Thread(target=rpc_server.serve_forever, daemon=True).start()
+        vnodes.rpc_port = args.rpc_port
+        log.info(f"RPC server started: {ip}:{args.rpc_port}")
 
     # Start HTTP server
-    handler = create_handler(node)
+    handler = create_handler(vnodes)
     http_server = ThreadingHTTPServer(("0.0.0.0", port), handler)
     log.info(f"HTTP server started: {ip}:{port}")
 
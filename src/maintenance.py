@@ -0,0 +1,161 @@
+import time
+from collections import deque
+from contextvars import ContextVar
+from threading import Lock
+from typing import Callable, Deque, Dict, Tuple
+
+import metrics
+
+# Max seconds between runs of a maintenance task while the ring is unchanged
+MAX_MAINTENANCE_INTERVAL = 16
+
+# Seconds of recent runs the messages per second are averaged over
+RATE_WINDOW = 60
+
+# The periodic maintenance tasks, and the min and max seconds between checks
+# of whether they are due, which is how often they run after a change
+MAINTENANCE_TASKS = {
+    "stabilize": (1, 2),
+    "fix_fingers": (3, 5),
+    "check_predecessor": (1, 2),
+}
+
+
+class MaintenanceTask:
+    """
+    Decides when a periodic maintenance task runs. Its loop wakes up every
+    min_delay to max_delay seconds, but each run that finds the ring
+    unchanged doubles the interval until the next one, up to the max
+    interval. A change brings the interval back down, so the task runs at
+    the next wake up.
+    """
+
+    def __init__(self, maintenance: "Maintenance", name: str, min_delay, max_delay):
+        self.maintenance = maintenance
+        self.name = name
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.interval = min_delay
+        self.last_run = maintenance.clock()
+        self.lock = Lock()
+        # Start time and requests sent of the recent runs
+        self.recent: Deque[Tuple[float, int]] = deque()
+        self.stats = {"runs": 0, "skipped": 0, "messages": 0}
+
+    def due(self) -> bool:
+        """
+        Whether the task should run now, counting a skipped run if not.
+        """
+        with self.lock:
+            if self.maintenance.clock() - self.last_run >= self.interval:
+                return True
+            self.stats["skipped"] += 1
+            return False
+
+    def reset(self):
+        with self.lock:
+            self.interval = self.min_delay
+
+    def running(self) -> "TaskRun":
+        return TaskRun(self)
+
+    def ran(self, started: float, changed: bool, messages: int):
+        with self.lock:
+            self.last_run = started
+            if changed:
+                self.interval = self.min_delay
+            else:
+                max_interval = max(self.maintenance.max_interval, self.min_delay)
+                self.interval = min(self.interval * 2, max_interval)
+
+            self.stats["runs"] += 1
+            self.stats["messages"] += messages
+            self.recent.append((started, messages))
+            while self.recent and self.recent[0][0] < started - RATE_WINDOW:
+                self.recent.popleft()
+        metrics.MAINTENANCE_MESSAGES.inc(self.name, amount=messages)
+
+    def messages_per_second(self) -> float:
+        now = self.maintenance.clock()
+        with self.lock:
+            messages = sum(count for started, count in self.recent)
+        window = min(RATE_WINDOW, now - self.maintenance.started)
+        return messages / window if window > 0 else 0.0
+
+    def get_stats(self) -> dict:
+        with self.lock:
+            stats = {"interval": self.interval, **self.stats}
+        stats["messages_per_second"] = round(self.messages_per_second(), 3)
+        return stats
+
+
+class TaskRun:
+    """
+    Counts the requests sent while running a task, and backs the task off
+    if the ring didn't change during the run.
+    """
+
+    def __init__(self, task: MaintenanceTask):
+        self.task = task
+        self.messages = 0
+
+    def __enter__(self):
+        self.started = self.task.maintenance.clock()
+        self.changes = self.task.maintenance.changes
+        self.token = current_run.set(self)
+        return self
+
+    def __exit__(self, *exc_info):
+        current_run.reset(self.token)
+        changed = self.task.maintenance.changes != self.changes
+        self.task.ran(self.started, changed, self.messages)
+
+
+# The maintenance task being run, whose requests to other nodes are counted
+current_run: ContextVar[TaskRun | None] = ContextVar("current_run", default=None)
+
+
+def count_message():
+    run = current_run.get()
+    if run is not None:
+        run.messages += 1
+
+
+class Maintenance:
+    """
+    The maintenance tasks of a process, which back off together while the
+    ring around its nodes is unchanged.
+    """
+
+    def __init__(
+        self,
+        max_interval: float = MAX_MAINTENANCE_INTERVAL,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.max_interval = max_interval
+        # Simulated rings pass their own clock
+        self.clock = clock
+        self.started = clock()
+        self.changes = 0
+        self.tasks: Dict[str, MaintenanceTask] = {
+            name: MaintenanceTask(self, name, min_delay, max_delay)
+            for name, (min_delay, max_delay) in MAINTENANCE_TASKS.items()
+        }
+
+    def changed(self):
+        """
+        A successor, predecessor or finger changed, a peer failed or another
+        node notified us, so all tasks run at their fast intervals again.
+        """
+        self.changes += 1
+        for task in self.tasks.values():
+            task.reset()
+
+    def get_stats(self) -> dict:
+        return {
+            "max_interval": self.max_interval,
+            "tasks": {name: task.get_stats() for name, task in self.tasks.items()},
+        }
+
+    def collect_intervals(self):
+        return [((name,), task.interval) for name, task in self.tasks.items()]
@@ -0,0 +1,275 @@
+import bisect
+import threading
+import time
+from threading import Lock
+from typing import Callable, Dict, Iterable, List, Tuple
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Upper bounds in seconds of the latency histogram buckets
+LATENCY_BUCKETS = (
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1,
+    2.5,
+    5,
+    10,
+)
+HOP_BUCKETS = (0, 1, 2, 3, 4, 5, 6, 8, 10, 12, 16, 24, 32)
+
+Labels = Tuple[str, ...]
+
+
+def escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_labels(names: Iterable[str], values: Iterable[str]) -> str:
+    pairs = [f'{name}="{escape(value)}"' for name, value in zip(names, values)]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    """
+    A count per combination of label values, which only goes up.
+    """
+
+    type = "counter"
+
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.lock = Lock()
+        self.values: Dict[Labels, float] = {}
+
+    def inc(self, *labels: str, amount: float = 1):
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def samples(self) -> List[str]:
+        with self.lock:
+            values = list(self.values.items())
+        return [
+            f"{self.name}{format_labels(self.labels, labels)} {value}"
+            for labels, value in values
+        ]
+
+
+class Histogram:
+    """
+    Counts observed values per bucket, with their sum and count, per
+    combination of label values.
+    """
+
+    type = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labels: Tuple[str, ...] = (),
+        buckets: Tuple[float, ...] = LATENCY_BUCKETS,
+    ):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        self.lock = Lock()
+        # Labels -> count per bucket, with the last bucket for values above all
+        # bounds, followed by the sum of the values
+        self.values: Dict[Labels, List[float]] = {}
+
+    def observe(self, value: float, *labels: str):
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            counts = self.values.get(labels)
+            if counts is None:
+                counts = self.values[labels] = [0] * (len(self.buckets) + 2)
+            counts[index] += 1
+            counts[-1] += value
+
+    def time(self, *labels: str) -> "Timer":
+        return Timer(self, labels)
+
+    def samples(self) -> List[str]:
+        with self.lock:
+            values = [(labels, list(counts)) for labels, counts in self.values.items()]
+
+        lines = []
+        for labels, counts in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += count
+                bucket_labels = format_labels(
+                    self.labels + ("le",), labels + (str(bound),)
+                )
+                lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+            label_text = format_labels(self.labels, labels)
+            lines.append(f"{self.name}_sum{label_text} {counts[-1]}")
+            lines.append(f"{self.name}_count{label_text} {cumulative}")
+        return lines
+
+
+class Timer:
+    """
+    Observes the seconds spent in a with block.
+    """
+
+    def __init__(self, histogram: Histogram, labels: Labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(time.perf_counter() - self.started, *self.labels)
+
+
+class Gauge:
+    """
+    Values read when the metrics are collected, from a function returning
+    (label values, value) pairs.
+    """
+
+    type = "gauge"
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labels: Tuple[str, ...] = (),
+        collect: Callable[[], Iterable[Tuple[Labels, float]]] = lambda: (),
+    ):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.collect = collect
+
+    def samples(self) -> List[str]:
+        return [
+            f"{self.name}{format_labels(self.labels, labels)} {value}"
+            for labels, value in self.collect()
+        ]
+
+
+class Registry:
+    """
+    The metrics of the process, rendered in the Prometheus text format.
+    """
+
+    def __init__(self):
+        self.metrics: List[Counter | Histogram | Gauge] = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> bytes:
+        lines = []
+        for metric in self.metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            lines += metric.samples()
+        return ("\n".join(lines) + "\n").encode("utf-8")
+
+
+registry = Registry()
+
+HTTP_REQUESTS = registry.register(
+    Counter(
+        "chord_http_requests_total",
+        "HTTP requests served, by route and status.",
+        ("method", "route", "status"),
+    )
+)
+HTTP_REQUEST_SECONDS = registry.register(
+    Histogram(
+        "chord_http_request_seconds",
+        "Time taken to serve HTTP requests, by route.",
+        ("method", "route"),
+    )
+)
+RPC_REQUESTS = registry.register(
+    Counter(
+        "chord_rpc_requests_total",
+        "Binary RPCs served, by the route they stand in for and status.",
+        ("route", "status"),
+    )
+)
+CLIENT_REQUESTS = registry.register(
+    Counter(
+        "chord_client_requests_total",
+        "Requests sent to other nodes, by peer and result.",
+        ("peer", "result"),
+    )
+)
+CLIENT_REQUEST_SECONDS = registry.register(
+    Histogram(
+        "chord_client_request_seconds",
+        "Round trip time of requests sent to other nodes, by peer.",
+        ("peer",),
+    )
+)
+LOOKUP_HOPS = registry.register(
+    Histogram(
+        "chord_lookup_hops",
+        "Hops taken by the lookups run by the node, by lookup mode.",
+        ("mode",),
+        HOP_BUCKETS,
+    )
+)
+PERIODIC_SECONDS = registry.register(
+    Histogram(
+        "chord_periodic_seconds",
+        "Time taken by each run of a periodic function over all vnodes.",
+        ("function",),
+    )
+)
+MAINTENANCE_MESSAGES = registry.register(
+    Counter(
+        "chord_maintenance_messages_total",
+        "Requests sent by the periodic maintenance tasks, by task.",
+        ("task",),
+    )
+)
+COMPRESSION_BYTES = registry.register(
+    Counter(
+        "chord_compression_bytes_total",
+        "Bytes of the values compressed by the node, before and after.",
+        ("size",),
+    )
+)
+COMPRESSION_CPU_SECONDS = registry.register(
+    Counter(
+        "chord_compression_cpu_seconds_total",
+        "CPU time spent compressing and decompressing values.",
+        ("operation",),
+    )
+)
+THREADS = registry.register(
+    Gauge(
+        "chord_threads",
+        "Threads running in the process.",
+        collect=lambda: [((), threading.active_count())],
+    )
+)
+
+
+def client_result(status_code: int | None) -> str:
+    """
+    The result label of a request to another node.
+    """
+    if status_code is None:
+        return "unreachable"
+    return f"{status_code // 100}xx"
@@ -0,0 +1,95 @@
+from bisect import bisect_left, insort
+from collections import OrderedDict
+from threading import Lock
+from typing import List, Tuple
+
+from ring import in_interval, intervals_overlap
+
+OWNER_CACHE_SIZE = 1024
+
+
+class OwnerCache:
+    """
+    LRU cache of which node owns a range of ids, so repeated lookups of
+    nearby keys can go straight to the owner.
+    """
+
+    def __init__(self, max_entries: int = OWNER_CACHE_SIZE):
+        self.max_entries = max_entries
+        # End of each range -> (start of range, owner), least recently used first
+        self.entries: OrderedDict[int, Tuple[int, str]] = OrderedDict()
+        # Sorted range ends, to find the range an id falls within
+        self.ends: List[int] = []
+        self.lock = Lock()
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0, "invalidations": 0}
+
+    def get(self, id: int) -> str | None:
+        """
+        Get the cached owner of the id.
+        """
+        with self.lock:
+            if self.ends:
+                # The range holding the id is the first one ending at or after it
+                i = bisect_left(self.ends, id) % len(self.ends)
+                end = self.ends[i]
+                start, owner = self.entries[end]
+                if in_interval(id, start, end):
+                    self.entries.move_to_end(end)
+                    self.stats["hits"] += 1
+                    return owner
+
+            self.stats["misses"] += 1
+            return None
+
+    def put(self, start: int, end: int, owner: str):
+        """
+        Remember that the owner is responsible for the range (start, end].
+        """
+        if self.max_entries <= 0:
+            return
+
+        with self.lock:
+            if end not in self.entries:
+                insort(self.ends, end)
+            self.entries[end] = (start, owner)
+            self.entries.move_to_end(end)
+
+            while len(self.entries) > self.max_entries:
+                end, _ = self.entries.popitem(last=False)
+                self.remove_end(end)
+                self.stats["evictions"] += 1
+
+    def invalidate_range(self, start: int, end: int):
+        """
+        Forget all ranges overlapping (start, end].
+        """
+        with self.lock:
+            for entry_end, (entry_start, _) in list(self.entries.items()):
+                if intervals_overlap((entry_start, entry_end), (start, end)):
+                    self.remove(entry_end)
+
+    def invalidate_owner(self, owner: str):
+        """
+        Forget all ranges owned by the node.
+        """
+        with self.lock:
+            for entry_end, (_, entry_owner) in list(self.entries.items()):
+                if entry_owner == owner:
+                    self.remove(entry_end)
+
+    def remove(self, end: int):
+        """
+        Remove a range. Expects the lock to be held.
+        """
+        del self.entries[end]
+        self.remove_end(end)
+        self.stats["invalidations"] += 1
+
+    def remove_end(self, end: int):
+        del self.ends[bisect_left(self.ends, end)]
+
+    def get_stats(self) -> dict:
+        with self.lock:
+            stats = dict(self.stats)
+            stats["entries"] = len(self.entries)
+        return stats
@@ -0,0 +1,70 @@
+import hashlib
+from typing import Dict, Tuple
+
+PEER_TABLE_SIZE = 4096
+
+# Vnodes other than the first are addressed as ip:port/vnode/<index>
+VNODE_PREFIX = "/vnode/"
+
+
+def ring_id(key: str, m: int) -> int:
+    """
+    Hash a key or address onto the ring of 2^m ids.
+    """
+    hash = hashlib.sha1(key.encode()).hexdigest()
+    return int(hash, 16) % (2**m)
+
+
+def vnode_address(ip: str, port: int, vnode: int) -> str:
+    """
+    The address of a vnode. The first vnode of a process is addressed by just
+    its ip and port, like a process without vnodes.
+    """
+    if vnode == 0:
+        return f"{ip}:{port}"
+    return f"{ip}:{port}{VNODE_PREFIX}{vnode}"
+
+
+def split_address(address: str) -> Tuple[str, str]:
+    """
+    Split an address into the ip:port of the process, and the path prefix of
+    the vnode, which is empty for the first vnode.
+    """
+    endpoint, slash, prefix = address.partition("/")
+    return endpoint, slash + prefix
+
+
+class Peer:
+    """
+    A peer's address and its id on the ring.
+    """
+
+    __slots__ = ("address", "id")
+
+    def __init__(self, address: str, id: int):
+        self.address = address
+        self.id = id
+
+
+class PeerTable:
+    """
+    Interns peers by address, so the id of each peer is only hashed once.
+    """
+
+    def __init__(self, m: int, max_size: int = PEER_TABLE_SIZE):
+        self.m = m
+        self.max_size = max_size
+        self.peers: Dict[str, Peer] = {}
+
+    def get(self, address: str) -> Peer:
+        peer = self.peers.get(address)
+        if peer is None:
+            # Peers that left aren't tracked, so start over if there are too many
+            if len(self.peers) >= self.max_size:
+                self.peers.clear()
+            peer = Peer(address, ring_id(address, self.m))
+            self.peers[address] = peer
+        return peer
+
+    def id(self, address: str) -> int:
+        return self.get(address).id
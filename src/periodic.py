@@ -0,0 +1,313 @@
+import logging as log
+import math
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from threading import Condition, Event, Lock, Thread
+from typing import Callable, Dict, List
+
+import metrics
+from maintenance import MaintenanceTask
+
+# Seconds per slot of the timer wheel, and the slots in one turn of it
+WHEEL_TICK = 0.05
+WHEEL_SLOTS = 512
+
+# Threads running the periodic functions of all nodes of the process
+SCHEDULER_WORKERS = 2
+
+
+class Timer:
+    def __init__(self, at: float, callback: Callable[[], None]):
+        self.at = at
+        self.callback = callback
+        self.tick = 0
+        self.cancelled = False
+
+
+class TimerWheel:
+    """
+    Timers hashed into slots by the tick they expire at. A timer more than
+    a turn of the wheel away waits in its slot for the remaining turns.
+    Adding and expiring a timer takes constant time, however many are
+    pending.
+    """
+
+    def __init__(self, now: float, tick: float = WHEEL_TICK, slots: int = WHEEL_SLOTS):
+        self.tick = tick
+        self.slots: List[List[Timer]] = [[] for _ in range(slots)]
+        # The last tick whose timers were expired
+        self.current = math.floor(now / tick)
+        self.pending = 0
+
+    def add(self, timer: Timer):
+        timer.tick = max(math.ceil(timer.at / self.tick), self.current + 1)
+        self.slots[timer.tick % len(self.slots)].append(timer)
+        self.pending += 1
+
+    def expire(self, now: float) -> List[Timer]:
+        """
+        Moves the wheel up to the current time, and returns the timers that
+        expired on the way.
+        """
+        expired = []
+        target = math.floor(now / self.tick)
+        # A whole turn visits every slot, so there is no need to go further
+        start = max(self.current, target - len(self.slots))
+        for tick in range(start + 1, target + 1):
+            slot = self.slots[tick % len(self.slots)]
+            if not slot:
+                continue
+            remaining = []
+            for timer in slot:
+                (expired if timer.tick <= target else remaining).append(timer)
+            slot[:] = remaining
+        self.current = max(self.current, target)
+        self.pending -= len(expired)
+        return [timer for timer in expired if not timer.cancelled]
+
+    def next_expiry(self) -> float | None:
+        """
+        Get the time the next timer expires at, within a turn of the wheel,
+        or None if no timers are pending.
+        """
+        if not self.pending:
+            return None
+        for tick in range(self.current + 1, self.current + len(self.slots) + 1):
+            slot = self.slots[tick % len(self.slots)]
+            if any(timer.tick <= tick for timer in slot):
+                return tick * self.tick
+        return (self.current + len(self.slots)) * self.tick
+
+
+class PeriodicJob:
+    """
+    A periodic function run by the scheduler whenever its maintenance task is
+    due, checking every min_delay to max_delay seconds after the last run
+    ended. A run taking longer than the deadline counts as an overrun.
+    """
+
+    def __init__(
+        self,
+        scheduler: "Scheduler",
+        func: Callable[[], None],
+        task: MaintenanceTask,
+        deadline: float,
+    ):
+        self.scheduler = scheduler
+        self.func = func
+        self.name = func.__name__
+        self.task = task
+        self.deadline = deadline
+        self.timer: Timer | None = None
+        self.cancelled = False
+        # Set while no run is queued or running
+        self.idle = Event()
+        self.idle.set()
+        self.stats = {
+            "runs": 0,
+            "overruns": 0,
+            "max_seconds": 0.0,
+            "max_lateness": 0.0,
+        }
+
+    def schedule_next(self):
+        delay = random.uniform(self.task.min_delay, self.task.max_delay)
+        self.timer = self.scheduler.call_later(delay, self.fire)
+
+    def fire(self):
+        """
+        Dispatches a run to the workers if the task is due.
+        Called by the scheduler thread, so it must not block.
+        """
+        if self.cancelled:
+            return
+        if not self.task.due():
+            self.schedule_next()
+            return
+        # Checked under the lock cancel sets it with, so cancel either stops
+        # this run or waits for it
+        with self.scheduler.lock:
+            if self.cancelled:
+                return
+            self.idle.clear()
+        if not self.scheduler.submit(self.run, time.monotonic()):
+            self.idle.set()
+
+    def run(self, fired_at: float):
+        # Cancelled while queued for a worker
+        if self.cancelled:
+            self.idle.set()
+            return
+
+        started = time.monotonic()
+        try:
+            with metrics.PERIODIC_SECONDS.time(self.name), self.task.running():
+                self.func()
+        except Exception:
+            log.exception(f"Periodic function {self.name} failed")
+        finally:
+            seconds = time.monotonic() - started
+            self.account(seconds, started - fired_at)
+            self.idle.set()
+            if not self.cancelled:
+                self.schedule_next()
+
+    def account(self, seconds: float, lateness: float):
+        with self.scheduler.lock:
+            self.stats["runs"] += 1
+            self.stats["max_seconds"] = max(self.stats["max_seconds"], seconds)
+            self.stats["max_lateness"] = max(self.stats["max_lateness"], lateness)
+            if seconds > self.deadline:
+                self.stats["overruns"] += 1
+        if seconds > self.deadline:
+            log.warning(
+                f"Periodic function {self.name} took {seconds:.2f}s, "
+                f"over its deadline of {self.deadline}s"
+            )
+
+    def cancel(self, wait: bool = True):
+        """
+        Stops scheduling runs, and waits for a running one to end.
+        """
+        with self.scheduler.lock:
+            self.cancelled = True
+            if self.timer is not None:
+                self.timer.cancelled = True
+        if wait:
+            self.idle.wait()
+
+
+class Scheduler:
+    """
+    Runs the periodic functions of all nodes of the process from one timer
+    thread, which hands the runs that are due to a bounded pool of workers.
+    """
+
+    def __init__(self, workers: int = SCHEDULER_WORKERS):
+        self.workers = workers
+        self.lock = Condition(Lock())
+        self.wheel = TimerWheel(time.monotonic())
+        self.jobs: List[PeriodicJob] = []
+        self.pool: ThreadPoolExecutor | None = None
+        self.thread: Thread | None = None
+        self.stopped = False
+
+    def add(
+        self,
+        func: Callable[[], None],
+        task: MaintenanceTask,
+        deadline: float | None = None,
+    ) -> PeriodicJob:
+        """
+        Starts running a function whenever its task is due. The deadline
+        defaults to the longest delay between the task's checks.
+        """
+        job = PeriodicJob(self, func, task, deadline or task.max_delay)
+        with self.lock:
+            self.jobs.append(job)
+        self.start()
+        job.schedule_next()
+        return job
+
+    def remove(self, job: PeriodicJob, wait: bool = True):
+        with self.lock:
+            if job in self.jobs:
+                self.jobs.remove(job)
+        job.cancel(wait)
+
+    def call_later(self, delay: float, callback: Callable[[], None]) -> Timer:
+        timer = Timer(time.monotonic() + delay, callback)
+        with self.lock:
+            self.wheel.add(timer)
+            self.lock.notify()
+        return timer
+
+    def submit(self, func: Callable, *args) -> bool:
+        """
+        Queue a call for the workers. Returns False if the scheduler stopped.
+        """
+        with self.lock:
+            if self.pool is None:
+                return False
+            self.pool.submit(func, *args)
+            return True
+
+    def start(self):
+        with self.lock:
+            if self.thread is not None:
+                return
+            self.stopped = False
+            self.pool = ThreadPoolExecutor(
+                max_workers=self.workers, thread_name_prefix="periodic"
+            )
+            self.thread = Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def run(self):
+        while True:
+            with self.lock:
+                if self.stopped:
+                    return
+                now = time.monotonic()
+                expired = self.wheel.expire(now)
+                if not expired:
+                    at = self.wheel.next_expiry()
+                    self.lock.wait(None if at is None else max(at - now, 0))
+                    continue
+            for timer in expired:
+                try:
+                    timer.callback()
+                except Exception:
+                    log.exception("Timer callback failed")
+
+    def stop(self):
+        """
+        Cancels all jobs, and stops the timer thread and the workers once the
+        running jobs end. Adding a job starts them again.
+        """
+        with self.lock:
+            jobs, self.jobs = self.jobs, []
+            thread, self.thread = self.thread, None
+            pool, self.pool = self.pool, None
+            self.stopped = True
+            self.lock.notify()
+        for job in jobs:
+            job.cancel(wait=False)
+        if thread is not None:
+            thread.join()
+        if pool is not None:
+            pool.shutdown(wait=True)
+
+    def get_stats(self) -> dict:
+        with self.lock:
+            jobs: Dict[str, dict] = {}
+            # Jobs of the same function, such as those of several nodes,
+            # are reported together
+            for job in self.jobs:
+                stats = jobs.setdefault(
+                    job.name,
+                    {"jobs": 0, "deadline": job.deadline, "runs": 0, "overruns": 0},
+                )
+                stats["jobs"] += 1
+                for stat in ("runs", "overruns"):
+                    stats[stat] += job.stats[stat]
+                for stat in ("max_seconds", "max_lateness"):
+                    stats[stat] = max(stats.get(stat, 0), round(job.stats[stat], 3))
+            return {
+                "workers": self.workers,
+                "pending_timers": self.wheel.pending,
+                "jobs": jobs,
+            }
+
+
+scheduler = Scheduler()
+
+
+def configure(workers: int = SCHEDULER_WORKERS):
+    """
+    Replace the scheduler with one with the given number of workers.
+    """
+    global scheduler
+    scheduler.stop()
+    scheduler = Scheduler(workers)
@@ -0,0 +1,15 @@
+def in_interval(id: int, start: int, end: int) -> bool:
+    """
+    Check if the id is within the ring interval (start, end].
+    An interval where start equals end covers the whole ring.
+    """
+    if start < end:
+        return start < id <= end
+    return id > start or id <= end
+
+
+def intervals_overlap(a: tuple, b: tuple) -> bool:
+    """
+    Check if two (start, end] ring intervals share any id.
+    """
+    return in_interval(a[1], *b) or in_interval(b[1], *a)
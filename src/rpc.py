@@ -0,0 +1,360 @@
+import json
+import logging as log
+import socket
+import socketserver
+import struct
+import time
+from concurrent.futures import Future
+from concurrent.futures import TimeoutError as FutureTimeout
+from http import HTTPStatus
+from threading import Lock, Thread
+from typing import BinaryIO, Dict, Tuple
+
+import metrics
+from chord_client import CON_TIMEOUT, READ_TIMEOUT, HTTPTransport, Response
+from peers import VNODE_PREFIX, split_address
+from vnodes import VirtualNodes
+
+# Header of HTTP responses giving the port the node serves binary RPCs on
+RPC_PORT_HEADER = "X-Chord-RPC-Port"
+
+# Seconds before trying the binary protocol again with a peer whose RPC port
+# refused a connection
+RPC_RETRY_INTERVAL = 30
+MAX_FRAME_SIZE = 1 << 20
+# Bytes read from a connection at a time
+RECV_SIZE = 1 << 16
+
+OP_STATUS = 1
+OP_PREDECESSOR = 2
+OP_SUCCESSOR_LIST = 3
+OP_NOTIFY = 4
+OP_FINGERS = 5
+OP_STABILIZE = 6
+
+# The HTTP request each op stands in for. Bodies are the same as over HTTP,
+# so callers can't tell which protocol answered.
+OPS = {
+    ("GET", "/status"): OP_STATUS,
+    ("GET", "/predecessor"): OP_PREDECESSOR,
+    ("GET", "/successor_list"): OP_SUCCESSOR_LIST,
+    ("PUT", "/notify"): OP_NOTIFY,
+    ("GET", "/fingers"): OP_FINGERS,
+    ("PUT", "/stabilize"): OP_STABILIZE,
+}
+OP_ROUTES = {op: route for (_, route), op in OPS.items()}
+
+# Every frame starts with the length of the rest of it. A request then has
+# its id, op and vnode index, and a response the request's id and a status.
+LENGTH = struct.Struct("!I")
+REQUEST_HEAD = struct.Struct("!IBH")
+RESPONSE_HEAD = struct.Struct("!IH")
+
+# Status of the response to a request for a vnode that is simulating a crash,
+# which the caller treats like a request that got no answer
+STATUS_CRASHED = 0
+
+
+def encode_frame(head: struct.Struct, *fields, body: bytes = b"") -> bytes:
+    return LENGTH.pack(head.size + len(body)) + head.pack(*fields) + body
+
+
+def read_frame(file: BinaryIO) -> bytes | None:
+    """
+    Read the next frame without its length, or None if the connection closed.
+    """
+    prefix = file.read(LENGTH.size)
+    if len(prefix) < LENGTH.size:
+        return None
+    (length,) = LENGTH.unpack(prefix)
+    if length > MAX_FRAME_SIZE:
+        raise ValueError(f"Frame of {length} bytes is too large")
+    frame = file.read(length)
+    return frame if len(frame) == length else None
+
+
+def handle_op(
+    vnodes: VirtualNodes, op: int, vnode: int, body: bytes
+) -> Tuple[int, bytes] | None:
+    """
+    Runs an RPC like its HTTP route would.
+    Returns the status and body, or None if the node is simulating a crash.
+    """
+    if vnode >= len(vnodes.nodes):
+        return 404, b"Unknown vnode"
+    node = vnodes.nodes[vnode]
+    if node.sim_crash:
+        return None
+
+    if op == OP_STATUS:
+        return 200, b""
+    if op == OP_PREDECESSOR:
+        if node.predecessor is None:
+            return 404, f"{node.id} does not have a predecessor".encode()
+        return 200, node.predecessor.encode("utf-8")
+    if op == OP_SUCCESSOR_LIST:
+        return 200, json.dumps(node.successor_list).encode()
+    if op == OP_FINGERS:
+        return 200, json.dumps(node.finger_table[1:]).encode()
+    if op in (OP_NOTIFY, OP_STABILIZE):
+        try:
+            predecessor = body.decode("utf-8").strip()
+        except UnicodeDecodeError:
+            return 400, b"Invalid UTF-8 encoding"
+        if not predecessor:
+            return 400, b"Empty request body"
+        if op == OP_STABILIZE:
+            return 200, json.dumps(node.stabilize_reply(predecessor)).encode()
+        node.notify(predecessor)
+        return 200, b""
+    return 400, b"Unknown op"
+
+
+class RPCHandler(socketserver.StreamRequestHandler):
+    """
+    Serves the binary RPCs of a connection in the order they arrive. They
+    only read or update the node's state, so none of them waits for another
+    node.
+    """
+
+    disable_nagle_algorithm = True
+
+    def __init__(self, vnodes: VirtualNodes, *args, **kwargs):
+        self.vnodes = vnodes
+        super().__init__(*args, **kwargs)
+
+    def handle(self):
+        try:
+            while frame := read_frame(self.rfile):
+                request_id, op, vnode = REQUEST_HEAD.unpack_from(frame)
+                result = handle_op(self.vnodes, op, vnode, frame[REQUEST_HEAD.size :])
+                # The connection is shared by all vnodes of the process, so a
+                # crashed one fails just this request instead of dropping it
+                if result is None:
+                    status, body = STATUS_CRASHED, b""
+                else:
+                    status, body = result
+                    metrics.RPC_REQUESTS.inc(OP_ROUTES.get(op, "other"), str(status))
+                self.wfile.write(
+                    encode_frame(RESPONSE_HEAD, request_id, status, body=body)
+                )
+        except (OSError, ValueError, struct.error) as e:
+            log.debug(f"RPC connection from {self.client_address} closed: {e}")
+
+
+class RPCServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+def create_server(vnodes: VirtualNodes, port: int) -> RPCServer:
+    def handler(*args, **kwargs):
+        return RPCHandler(vnodes, *args, **kwargs)
+
+    return RPCServer(("0.0.0.0", port), handler)
+
+
+class RPCConnection:
+    """
+    A persistent connection to a peer's RPC port. Calls from any thread are
+    multiplexed over it, and a reader thread hands each response to the call
+    with the same request id. A peer that stops reading requests or doesn't
+    answer one in time gets the connection closed, failing all its calls.
+    """
+
+    def __init__(self, host: str, port: int, timeout: float = READ_TIMEOUT):
+        self.sock = socket.create_connection((host, port), timeout=CON_TIMEOUT)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        # Bounds how long a send blocks while holding the lock
+        self.sock.settimeout(timeout)
+        self.timeout = timeout
+        self.lock = Lock()
+        self.next_id = 0
+        self.pending: Dict[int, Future] = {}
+        self.closed = False
+        Thread(target=self.read_responses, daemon=True).start()
+
+    def call(self, op: int, vnode: int, body: bytes) -> Tuple[int, bytes] | None:
+        """
+        Send an RPC and wait for its response.
+        Returns the status and body, or None if the peer didn't answer.
+        """
+        future: Future = Future()
+        with self.lock:
+            if self.closed:
+                return None
+            self.next_id = (self.next_id + 1) % 2**32
+            request_id = self.next_id
+            self.pending[request_id] = future
+            try:
+                self.sock.sendall(
+                    encode_frame(REQUEST_HEAD, request_id, op, vnode, body=body)
+                )
+                failed = False
+            except OSError:
+                # A partly sent frame leaves the connection unusable, so
+                # calls waiting for the lock don't try it
+                self.closed = failed = True
+        if failed:
+            self.close()
+            return None
+
+        try:
+            return future.result(self.timeout)
+        except FutureTimeout:
+            self.close()
+            return None
+
+    def read_responses(self):
+        buffer = bytearray()
+        try:
+            while True:
+                try:
+                    data = self.sock.recv(RECV_SIZE)
+                except TimeoutError:
+                    # An idle connection times out too, and calls that
+                    # wait too long close it themselves
+                    if self.closed:
+                        break
+                    continue
+                if not data:
+                    break
+                buffer += data
+                while len(buffer) >= LENGTH.size:
+                    (length,) = LENGTH.unpack_from(buffer)
+                    if length > MAX_FRAME_SIZE:
+                        raise ValueError(f"Frame of {length} bytes is too large")
+                    end = LENGTH.size + length
+                    if len(buffer) < end:
+                        break
+                    self.respond(bytes(buffer[LENGTH.size : end]))
+                    del buffer[:end]
+        except (OSError, ValueError, struct.error):
+            pass
+        self.close()
+
+    def respond(self, frame: bytes):
+        """
+        Hands a response frame to the call waiting for it.
+        """
+        request_id, status = RESPONSE_HEAD.unpack_from(frame)
+        with self.lock:
+            future = self.pending.pop(request_id, None)
+        if future is not None:
+            future.set_result((status, frame[RESPONSE_HEAD.size :]))
+
+    def close(self):
+        """
+        Close the connection, failing the calls waiting for a response.
+        """
+        with self.lock:
+            self.closed = True
+            pending = list(self.pending.values())
+            self.pending.clear()
+        # Shutting down wakes the reader thread, which close alone may not
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.sock.close()
+        for future in pending:
+            future.set_result(None)
+
+
+class RPCTransport:
+    """
+    Sends the maintenance RPCs over the binary protocol to peers that
+    advertise an RPC port in their HTTP responses, and everything else,
+    including requests to peers that don't, over HTTP.
+    """
+
+    def __init__(self, fallback: HTTPTransport):
+        self.fallback = fallback
+        self.lock = Lock()
+        self.ports: Dict[str, int] = {}
+        self.connections: Dict[str, RPCConnection] = {}
+        # When peers whose RPC port refused a connection may be tried again
+        self.retry_at: Dict[str, float] = {}
+        self.stats = {"calls": 0, "connections": 0, "refused": 0}
+
+    def request(
+        self, method: str, node: str, path: str, body: bytes | None, headers: dict
+    ) -> Response | None:
+        endpoint, prefix = split_address(node)
+        op = OPS.get((method, path))
+        conn = self.connection(endpoint) if op is not None else None
+        if conn is None:
+            response = self.fallback.request(method, node, path, body, headers)
+            if response is not None:
+                self.learn_port(endpoint, response)
+            return response
+
+        vnode = int(prefix[len(VNODE_PREFIX) :]) if prefix else 0
+        started = time.monotonic()
+        result = conn.call(op, vnode, body or b"")
+        if result is None or result[0] == STATUS_CRASHED:
+            return None
+        with self.lock:
+            self.stats["calls"] += 1
+        status, content = result
+        return Response(
+            status, HTTPStatus(status).phrase, {}, content, time.monotonic() - started
+        )
+
+    def learn_port(self, endpoint: str, response: Response):
+        try:
+            port = int(response.headers.get(RPC_PORT_HEADER, ""))
+        except ValueError:
+            return
+        if not 0 < port < 2**16:
+            return
+        with self.lock:
+            if time.monotonic() >= self.retry_at.get(endpoint, 0):
+                self.ports[endpoint] = port
+
+    def connection(self, endpoint: str) -> RPCConnection | None:
+        """
+        Get an open connection to the peer's RPC port, or None if it has none.
+        """
+        with self.lock:
+            conn = self.connections.get(endpoint)
+            if conn is not None and not conn.closed:
+                return conn
+            port = self.ports.get(endpoint)
+        if port is None:
+            return None
+
+        try:
+            conn = RPCConnection(endpoint.rsplit(":", 1)[0], port)
+        except OSError:
+            with self.lock:
+                self.ports.pop(endpoint, None)
+                self.retry_at[endpoint] = time.monotonic() + RPC_RETRY_INTERVAL
+                self.stats["refused"] += 1
+            return None
+
+        with self.lock:
+            existing = self.connections.get(endpoint)
+            if existing is not None and not existing.closed:
+                conn.close()
+                return existing
+            self.connections[endpoint] = conn
+            self.stats["connections"] += 1
+        return conn
+
+    def open_stream(self, *args):
+        return self.fallback.open_stream(*args)
+
+    def get_stats(self) -> dict:
+        with self.lock:
+            stats = dict(self.stats)
+            stats["open"] = sum(not conn.closed for conn in self.connections.values())
+        return {**self.fallback.get_stats(), "rpc": stats}
+
+    def close(self):
+        with self.lock:
+            connections = list(self.connections.values())
+            self.connections.clear()
+        for conn in connections:
+            conn.close()
+        self.fallback.close()
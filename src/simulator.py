@@ -0,0 +1,416 @@
+import contextvars
+import heapq
+import http.client
+import io
+import logging as log
+import math
+import random
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler
+from typing import Callable, Dict, Iterable, List, Tuple
+
+import chord_client
+from chord_client import Response
+from chord_node import FINGER_REFRESH_INTERVAL, ChordNode
+from http_handler import HTTPHandler, handle_in_process, route_label
+from liveness import LIVENESS_TTL, LivenessCache
+from maintenance import Maintenance, MaintenanceTask
+from peers import split_address
+from vnodes import VirtualNodes
+
+# Round trip time in seconds between simulated processes
+SIM_RTT = 0.05
+
+Latency = Callable[[str, str], float]
+
+
+def constant_latency(rtt: float = SIM_RTT) -> Latency:
+    """
+    The same round trip time between all processes.
+    """
+    return lambda source, target: rtt
+
+
+class CoordinateLatency:
+    """
+    Places each process at a random point of a unit square, with a round trip
+    time growing with the distance between two points, so nearby nodes are
+    worth preferring when routing.
+    """
+
+    def __init__(self, min_rtt: float = 0.002, max_rtt: float = 0.2, seed=None):
+        self.min_rtt = min_rtt
+        self.max_rtt = max_rtt
+        self.random = random.Random(seed)
+        self.points: Dict[str, Tuple[float, float]] = {}
+
+    def point(self, endpoint: str) -> Tuple[float, float]:
+        point = self.points.get(endpoint)
+        if point is None:
+            point = self.points[endpoint] = (self.random.random(), self.random.random())
+        return point
+
+    def __call__(self, source: str, target: str) -> float:
+        if source == target:
+            return 0.0
+        distance = math.dist(self.point(source), self.point(target)) / math.sqrt(2)
+        return self.min_rtt + distance * (self.max_rtt - self.min_rtt)
+
+
+class InlineExecutor:
+    """
+    Runs submitted calls right away, as a simulated ring runs in one thread.
+    """
+
+    def submit(self, func, *args, **kwargs) -> Future:
+        future: Future = Future()
+        try:
+            future.set_result(func(*args, **kwargs))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+    def shutdown(self, wait: bool = True):
+        pass
+
+
+class RawSocket:
+    """
+    Lets http.client parse a raw HTTP response held in memory.
+    """
+
+    def __init__(self, raw: bytes):
+        self.raw = raw
+
+    def makefile(self, mode: str):
+        return io.BytesIO(self.raw)
+
+
+def parse_headers(lines: Iterable[bytes]) -> http.client.HTTPMessage:
+    """
+    Parses header lines the simulator or HTTPHandler wrote, which are well
+    formed, much faster than the email parser http.client uses.
+    """
+    headers = http.client.HTTPMessage()
+    for line in lines:
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name] = value.strip()
+    return headers
+
+
+def parse_response(raw: bytes) -> Response:
+    head, _, content = raw.partition(b"\r\n\r\n")
+    status_line, *lines = head.split(b"\r\n")
+    _, status, reason = (status_line.decode("latin-1").split(" ", 2) + [""])[:3]
+    return Response(int(status), reason, parse_headers(lines), content)
+
+
+class SimRequestParser(BaseHTTPRequestHandler):
+    """
+    Parses the request line and headers of simulated requests, which are
+    well formed, without the email parser.
+    """
+
+    def parse_request(self) -> bool:
+        self.requestline = self.raw_requestline.decode("latin-1").rstrip("\r\n")
+        self.command, self.path, self.request_version = self.requestline.split()
+        lines = []
+        while (line := self.rfile.readline()) not in (b"\r\n", b""):
+            lines.append(line)
+        self.headers = parse_headers(lines)
+        self.close_connection = False
+        return True
+
+
+class SimHandler(HTTPHandler, SimRequestParser):
+    """
+    Handles simulated requests without logging each one.
+    """
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StreamConnection:
+    """
+    Stands in for the connection of a streamed response, which is already
+    fully in memory.
+    """
+
+    def close(self):
+        pass
+
+
+class InMemoryTransport:
+    """
+    Sends requests to the simulated processes by running them through their
+    HTTPHandler in the same thread, so all routing and maintenance code runs
+    as it would over sockets.
+
+    Requests take no simulated time. Instead the round trip time of a request
+    is the link's latency plus the time of the requests the target sent while
+    handling it, which is what the caller's liveness cache and the lookup
+    benchmarks see.
+    """
+
+    def __init__(self, hosts: Dict[str, "SimHost"], latency: Latency):
+        self.hosts = hosts
+        self.latency = latency
+        # Addresses of the nodes whose code is running, innermost last, and
+        # the round trip time of the requests each has sent so far
+        self.callers: List[str] = []
+        self.spent: List[float] = []
+        self.messages: Dict[str, int] = {}
+        self.failed = 0
+
+    def run_as(
+        self, node: str, func: Callable, *args, **kwargs
+    ) -> Tuple[object, float]:
+        """
+        Run a function as the node, so the requests it sends come from it.
+        Returns the function's result and the round trip time it spent.
+        """
+        self.callers.append(node)
+        self.spent.append(0.0)
+        try:
+            result = func(*args, **kwargs)
+        finally:
+            self.callers.pop()
+            spent = self.spent.pop()
+        if self.spent:
+            self.spent[-1] += spent
+        return result, spent
+
+    def send(
+        self, method: str, node: str, path: str, body: bytes, headers: dict
+    ) -> bytes | None:
+        """
+        Run a request through the target's handler.
+        Returns the raw response, or None if the node can't be reached.
+        """
+        endpoint, prefix = split_address(node)
+        route = route_label(path.partition("?")[0])
+        self.messages[route] = self.messages.get(route, 0) + 1
+
+        host = self.hosts.get(endpoint)
+        if host is None:
+            self.failed += 1
+            return None
+
+        headers = dict(headers)
+        if body:
+            headers["Content-Length"] = str(len(body))
+        # The target handles the request in a context of its own, like a
+        # handler thread of another process would
+        raw, _ = contextvars.Context().run(
+            self.run_as,
+            node,
+            handle_in_process,
+            host,
+            method,
+            prefix + path,
+            headers,
+            body,
+            handler_class=SimHandler,
+        )[0]
+        source = split_address(self.callers[-1])[0] if self.callers else endpoint
+        if self.spent:
+            self.spent[-1] += self.latency(source, endpoint)
+
+        # A crashed node closes the connection without answering
+        if not raw:
+            self.failed += 1
+            return None
+        return raw
+
+    def request(
+        self, method: str, node: str, path: str, body: bytes | None, headers: dict
+    ) -> Response | None:
+        spent = self.spent[-1] if self.spent else 0.0
+        raw = self.send(method, node, path, body or b"", headers)
+        if raw is None:
+            return None
+        response = parse_response(raw)
+        response.elapsed = (self.spent[-1] if self.spent else 0.0) - spent
+        return response
+
+    def open_stream(
+        self,
+        method: str,
+        node: str,
+        path: str,
+        chunks: Iterable[bytes] | None,
+        headers: dict,
+    ) -> Tuple[StreamConnection, http.client.HTTPResponse] | None:
+        body = b"".join(chunks) if chunks is not None else b""
+        raw = self.send(method, node, path, body, headers)
+        if raw is None:
+            return None
+        # Streamed responses may be chunked, so they are parsed by http.client
+        response = http.client.HTTPResponse(RawSocket(raw), method=method)
+        response.begin()
+        return StreamConnection(), response
+
+    def get_stats(self) -> dict:
+        return {
+            "messages": sum(self.messages.values()),
+            "failed": self.failed,
+            "routes": dict(self.messages),
+        }
+
+    def close(self):
+        pass
+
+
+class SimNode(ChordNode):
+    """
+    A node whose finger refreshes and parallel RPCs are run by the simulator
+    instead of background threads.
+    """
+
+    def __init__(self, sim: "Simulator", **kwargs):
+        self.sim = sim
+        super().__init__(**kwargs)
+        self.executor = InlineExecutor()
+
+    def schedule_finger_refresh(self):
+        if self.finger_refresh_pending:
+            return
+        self.finger_refresh_pending = True
+        at = max(self.sim.now, self.last_finger_refresh + FINGER_REFRESH_INTERVAL)
+        self.sim.schedule(at, self.run_finger_refreshes)
+
+    def run_finger_refreshes(self):
+        self.finger_refresh_pending = False
+        self.last_finger_refresh = self.sim.now
+        if self.sim.is_running(self):
+            self.sim.transport.run_as(self.address, self.refresh_fingers)
+
+
+class SimHost(VirtualNodes):
+    """
+    A simulated process, whose periodic functions are events of the
+    simulator.
+    """
+
+    def __init__(self, sim: "Simulator", *args, **node_options):
+        self.sim = sim
+        super().__init__(*args, **node_options)
+
+    def create_node(self, **kwargs) -> ChordNode:
+        return SimNode(self.sim, **kwargs)
+
+    def create_maintenance(self, max_interval: float) -> Maintenance:
+        return Maintenance(max_interval, clock=self.sim.clock)
+
+    def register_metrics(self):
+        pass
+
+    def start_periodic_functions(self):
+        for func in [self.stabilize, self.fix_fingers, self.check_predecessor]:
+            self.sim.schedule_periodic(
+                self, func, self.maintenance.tasks[func.__name__]
+            )
+
+    def run_all(self, func: Callable[[ChordNode], None]):
+        super().run_all(
+            lambda node: self.sim.transport.run_as(node.address, func, node)
+        )
+
+
+class Simulator:
+    """
+    Runs a ring of simulated processes in one thread, on a simulated clock.
+    Periodic functions and finger refreshes are events ordered by time, and
+    requests between nodes go through an InMemoryTransport. Creating a
+    simulator replaces the transport of chord_client.
+    """
+
+    def __init__(
+        self,
+        m: int,
+        latency: Latency | None = None,
+        liveness_ttl: float = LIVENESS_TTL,
+        seed=None,
+    ):
+        self.m = m
+        self.now = 0.0
+        self.random = random.Random(seed)
+        self.events: List[Tuple[float, int, Callable[[], None]]] = []
+        self.sequence = 0
+        self.hosts: Dict[str, SimHost] = {}
+        self.transport = InMemoryTransport(self.hosts, latency or constant_latency())
+        chord_client.set_transport(
+            self.transport, LivenessCache(liveness_ttl, clock=self.clock)
+        )
+
+    def clock(self) -> float:
+        return self.now
+
+    def schedule(self, at: float, func: Callable[[], None]):
+        heapq.heappush(self.events, (at, self.sequence, func))
+        self.sequence += 1
+
+    def schedule_periodic(
+        self, host: SimHost, func: Callable[[], None], task: MaintenanceTask
+    ):
+        """
+        Run a function of the host when its task is due, checking every
+        min_delay to max_delay seconds like run_periodic_function, until the
+        host is removed.
+        """
+
+        def run():
+            if self.hosts.get(f"{host.ip}:{host.port}") is not host:
+                return
+            if task.due():
+                with task.running():
+                    func()
+            self.schedule_periodic(host, func, task)
+
+        delay = self.random.uniform(task.min_delay, task.max_delay)
+        self.schedule(self.now + delay, run)
+
+    def add_host(self, ip: str, port: int, vnodes: int = 1, **node_options) -> SimHost:
+        node_options.setdefault("log_options", {"enabled": False})
+        host = SimHost(self, ip, port, self.m, vnodes, **node_options)
+        self.hosts[f"{ip}:{port}"] = host
+        return host
+
+    def remove_host(self, host: SimHost):
+        """
+        Stop a process without it leaving the ring, as if it crashed.
+        """
+        del self.hosts[f"{host.ip}:{host.port}"]
+
+    def is_running(self, node: ChordNode) -> bool:
+        host = self.hosts.get(f"{node.ip}:{node.port}")
+        return host is not None and node in host.nodes and not node.sim_crash
+
+    def nodes(self) -> List[ChordNode]:
+        return [node for host in self.hosts.values() for node in host.nodes]
+
+    def join(self, host: SimHost, other: str):
+        """
+        Join each vnode of the host to the ring through another node.
+        """
+        for node in host.nodes:
+            node.create()
+        for node in host.nodes:
+            self.transport.run_as(node.address, node.join, other)
+
+    def run_until(self, until: float):
+        """
+        Run the events due up to the given time, and move the clock to it.
+        """
+        while self.events and self.events[0][0] <= until:
+            at, _, func = heapq.heappop(self.events)
+            self.now = at
+            try:
+                func()
+            except Exception:
+                log.exception("Simulated event failed")
+        self.now = until
+
+    def run_for(self, seconds: float):
+        self.run_until(self.now + seconds)
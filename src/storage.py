@@ -0,0 +1,417 @@
+import base64
+import logging as log
+import mmap
+import os
+import struct
+import zlib
+from collections.abc import Mapping, MutableMapping
+from threading import Event, RLock, Thread
+from typing import Callable, Dict, Iterable, Iterator, List, Tuple
+
+from compression import ENCODINGS
+from key_index import KeyIndex
+
+STORAGE_MEMORY = "memory"
+STORAGE_LOG = "log"
+STORAGE_BACKENDS = [STORAGE_MEMORY, STORAGE_LOG]
+DATA_DIR = "~/imo059-chord-data/"
+
+# Seconds between syncing written records to disk
+SYNC_INTERVAL = 0.05
+# Compact when at least this share of the log is overwritten or deleted records
+COMPACT_RATIO = 0.5
+COMPACT_MIN_BYTES = 1 << 20
+
+# Each record is a header of checksum, operation, key length and value length,
+# followed by the key and value. The checksum covers everything after itself.
+HEADER = struct.Struct("<IBII")
+OP_PUT = 1
+OP_DELETE = 2
+
+# Values are stored as their raw bytes. Values of another content type, or
+# starting with a zero or one byte, are stored after a zero byte, their
+# content type and another zero byte. Compressed values are stored after a
+# one byte, their content type, a zero byte, their content encoding and
+# another zero byte. Values stored as text before content types were kept
+# read back as text, as are those starting with a one byte from before
+# compression, whose header doesn't parse or names an unknown encoding.
+DEFAULT_CONTENT_TYPE = "text/plain"
+
+
+def encode_value(
+    data: bytes, content_type: str | None = None, encoding: str | None = None
+) -> bytes:
+    """
+    Encodes a value with its content type, and its content encoding if it
+    is compressed, for storage.
+    """
+    content_type = content_type or DEFAULT_CONTENT_TYPE
+    if encoding:
+        header = f"{content_type}\0{encoding}".encode("latin-1")
+        return b"\1" + header + b"\0" + data
+    if content_type == DEFAULT_CONTENT_TYPE and not data.startswith((b"\0", b"\1")):
+        return data
+    return b"\0" + content_type.encode("latin-1") + b"\0" + data
+
+
+def decode_value(value: bytes) -> Tuple[memoryview, str, str | None]:
+    """
+    Gets the data of a stored value, without copying it, its content type,
+    and its content encoding if it is compressed.
+    """
+    if not value.startswith((b"\0", b"\1")):
+        return memoryview(value), DEFAULT_CONTENT_TYPE, None
+    end = value.find(b"\0", 1)
+    content_type = value[1:end].decode("latin-1")
+    if value[0] == 0 and end != -1:
+        return memoryview(value)[end + 1 :], content_type, None
+
+    encoding_end = value.find(b"\0", end + 1) if end != -1 else -1
+    encoding = value[end + 1 : encoding_end].decode("latin-1")
+    if value[0] == 1 and encoding_end != -1 and encoding in ENCODINGS:
+        return memoryview(value)[encoding_end + 1 :], content_type, encoding
+    return memoryview(value), DEFAULT_CONTENT_TYPE, None
+
+
+def value_to_json(value: bytes) -> str | dict:
+    """
+    Encodes a stored value for a JSON body, as a string if it is UTF-8 and
+    as base64 otherwise.
+    """
+    try:
+        return value.decode("utf-8")
+    except UnicodeDecodeError:
+        return {"base64": base64.b64encode(value).decode("ascii")}
+
+
+def value_from_json(value) -> bytes:
+    if isinstance(value, dict) and "base64" in value:
+        return base64.b64decode(value["base64"])
+    return str(value).encode("utf-8")
+
+
+class MemoryStorage(KeyIndex):
+    """
+    Keeps the key value pairs in memory only, ordered by the ids of the keys.
+    """
+
+    def pop_range(self, start: int, end: int) -> Dict[str, bytes]:
+        """
+        Removes the pairs whose keys hash into (start, end].
+        """
+        return {
+            key: record.value for key, record in self.split(start, end).records.items()
+        }
+
+    def get_stats(self) -> dict:
+        records = self.ordered()
+        size = sum(
+            len(record.key.encode("utf-8")) + len(record.value) for record in records
+        )
+        return {"backend": STORAGE_MEMORY, "keys": len(records), "bytes": size}
+
+    def close(self):
+        pass
+
+
+def encode_record(op: int, key: bytes, value: bytes) -> bytes:
+    body = HEADER.pack(0, op, len(key), len(value))[4:] + key + value
+    return struct.pack("<I", zlib.crc32(body)) + body
+
+
+class LogStorage(MutableMapping):
+    """
+    Stores key value pairs in an append-only log file, with an index in
+    memory of where each key's latest value is. Values are read through a
+    memory map of the log, so only the keys have to fit in memory. The index
+    is ordered by the ids of the keys, like MemoryStorage.
+
+    Writes are synced to disk in batches by a background thread, which also
+    rewrites the log without overwritten and deleted records once they take
+    up most of it. The index is rebuilt by scanning the log when opened.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        hash: Callable[[str], int],
+        sync_interval: float = SYNC_INTERVAL,
+    ):
+        self.path = path
+        self.hash = hash
+        self.lock = RLock()
+        # Key -> (offset of value, length of value)
+        self.index = KeyIndex(hash)
+        self.garbage = 0
+        self.dirty = False
+        self.stats = {"compactions": 0, "syncs": 0, "recovered": 0, "truncated": 0}
+
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.file = open(path, "a+b")
+        self.size = self.recover()
+        self.map: mmap.mmap | None = None
+        self.mapped_size = 0
+
+        self.stop_event = Event()
+        self.thread = Thread(
+            target=self.run_maintenance, args=(sync_interval,), daemon=True
+        )
+        self.thread.start()
+
+    def recover(self) -> int:
+        """
+        Rebuilds the index from the log, and cuts off a partly written
+        record at its end. Returns the size of the log.
+        """
+        size = os.fstat(self.file.fileno()).st_size
+        if size == 0:
+            return 0
+        # The index is sorted once all records are replayed
+        index: Dict[str, Tuple[int, int]] = {}
+        with mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            offset = self.replay(data, 0, index)
+        self.index = KeyIndex(self.hash, index)
+        self.stats["recovered"] = len(self.index)
+
+        if offset < size:
+            log.warning(f"Truncating {size - offset} bytes of {self.path}")
+            self.stats["truncated"] = size - offset
+            self.file.truncate(offset)
+        self.garbage = offset - sum(
+            HEADER.size + len(key.encode("utf-8")) + length
+            for key, (_, length) in self.index.items()
+        )
+        return offset
+
+    def replay(self, data, base: int, index: Dict[str, Tuple[int, int]]) -> int:
+        """
+        Applies the records in data, which starts at offset base of the log,
+        to the index. Returns the offset after the last whole record.
+        """
+        offset = 0
+        while offset + HEADER.size <= len(data):
+            checksum, op, key_length, value_length = HEADER.unpack_from(data, offset)
+            end = offset + HEADER.size + key_length + value_length
+            if end > len(data) or zlib.crc32(data[offset + 4 : end]) != checksum:
+                break
+
+            key_start = offset + HEADER.size
+            key = data[key_start : key_start + key_length].decode("utf-8")
+            if op == OP_PUT:
+                index[key] = (base + key_start + key_length, value_length)
+            else:
+                index.pop(key, None)
+            offset = end
+        return base + offset
+
+    def append(self, op: int, key: str, value: bytes = b"") -> int:
+        """
+        Appends a record to the log. Returns the offset of its value.
+        Expects the lock to be held.
+        """
+        raw_key = key.encode("utf-8")
+        record = encode_record(op, raw_key, value)
+        self.file.write(record)
+        self.dirty = True
+
+        value_offset = self.size + HEADER.size + len(raw_key)
+        self.size += len(record)
+        return value_offset
+
+    def read(self, offset: int, length: int) -> bytes:
+        """
+        Reads from the log through the memory map. Expects the lock to be held.
+        """
+        if offset + length > self.mapped_size:
+            self.file.flush()
+            if self.map is not None:
+                self.map.close()
+            self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+            self.mapped_size = len(self.map)
+        return self.map[offset : offset + length]
+
+    def __getitem__(self, key: str) -> bytes:
+        with self.lock:
+            offset, length = self.index[key]
+            return self.read(offset, length)
+
+    def __setitem__(self, key: str, value: bytes):
+        with self.lock:
+            old = self.index.get(key)
+            if old is not None:
+                self.garbage += HEADER.size + len(key.encode("utf-8")) + old[1]
+            self.index[key] = (self.append(OP_PUT, key, value), len(value))
+
+    def __delitem__(self, key: str):
+        with self.lock:
+            _, length = self.index.pop(key)
+            self.delete(key, length)
+
+    def delete(self, key: str, length: int):
+        """
+        Appends the delete record of a key removed from the index. Expects
+        the lock to be held.
+        """
+        self.append(OP_DELETE, key)
+        # Both the value and the delete record are now garbage
+        raw_length = len(key.encode("utf-8"))
+        self.garbage += 2 * (HEADER.size + raw_length) + length
+
+    def update(self, pairs=(), **kwargs):
+        """
+        Appends the pairs, and adds them to the index at once.
+        """
+        items = pairs.items() if isinstance(pairs, Mapping) else pairs
+        with self.lock:
+            locations = {}
+            for key, value in items:
+                old = self.index.get(key)
+                if old is not None:
+                    self.garbage += HEADER.size + len(key.encode("utf-8")) + old[1]
+                locations[key] = (self.append(OP_PUT, key, value), len(value))
+            self.index.update(locations)
+        if kwargs:
+            self.update(kwargs)
+
+    def range_keys(self, start: int, end: int) -> List[str]:
+        return self.index.range_keys(start, end)
+
+    def pop_many(self, keys: Iterable[str]) -> Dict[str, bytes]:
+        """
+        Removes the keys, and returns the values of those that were stored.
+        """
+        with self.lock:
+            removed = {}
+            for key, (offset, length) in self.index.pop_many(keys).items():
+                removed[key] = self.read(offset, length)
+                self.delete(key, length)
+        return removed
+
+    def pop_range(self, start: int, end: int) -> Dict[str, bytes]:
+        """
+        Removes the pairs whose keys hash into (start, end].
+        """
+        with self.lock:
+            return self.pop_many(self.range_keys(start, end))
+
+    def __contains__(self, key) -> bool:
+        return key in self.index
+
+    def __iter__(self) -> Iterator[str]:
+        with self.lock:
+            return iter(list(self.index))
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    def sync(self):
+        """
+        Writes the records appended since the last sync to disk.
+        """
+        with self.lock:
+            if not self.dirty:
+                return
+            self.file.flush()
+            self.dirty = False
+            fileno = self.file.fileno()
+
+        # Don't block writers while waiting for the disk
+        os.fsync(fileno)
+        with self.lock:
+            self.stats["syncs"] += 1
+
+    def run_maintenance(self, sync_interval: float):
+        while not self.stop_event.wait(sync_interval):
+            try:
+                self.sync()
+                if self.garbage >= max(COMPACT_MIN_BYTES, self.size * COMPACT_RATIO):
+                    self.compact()
+            except (OSError, ValueError):
+                log.exception(f"Maintenance of {self.path} failed")
+
+    def compact(self):
+        """
+        Rewrites the log with only the latest value of each key.
+        Values are copied without holding the lock, and records written
+        meanwhile are copied over before the new log replaces the old one.
+        """
+        with self.lock:
+            self.file.flush()
+            snapshot = dict(self.index)
+            snapshot_size = self.size
+
+        compact_path = self.path + ".compact"
+        new_index: Dict[str, Tuple[int, int]] = {}
+        with open(compact_path, "wb") as compact_file:
+            size = 0
+            for key, (offset, length) in snapshot.items():
+                with self.lock:
+                    value = self.read(offset, length)
+                raw_key = key.encode("utf-8")
+                compact_file.write(encode_record(OP_PUT, raw_key, value))
+                new_index[key] = (size + HEADER.size + len(raw_key), length)
+                size += HEADER.size + len(raw_key) + length
+
+            with self.lock:
+                # Keep the keys that haven't changed since the snapshot, and
+                # replay the records written after it
+                new_index = {
+                    key: entry
+                    for key, entry in new_index.items()
+                    if self.index.get(key) == snapshot[key]
+                }
+                self.file.flush()
+                self.file.seek(snapshot_size)
+                tail = self.file.read()
+                compact_file.write(tail)
+                self.replay(tail, size, new_index)
+                compact_file.flush()
+                os.fsync(compact_file.fileno())
+
+                os.replace(compact_path, self.path)
+                if self.map is not None:
+                    self.map.close()
+                    self.map = None
+                self.mapped_size = 0
+                self.file.close()
+                self.file = open(self.path, "a+b")
+
+                self.index = self.index.with_values(new_index)
+                self.size = size + len(tail)
+                self.garbage = 0
+                self.dirty = False
+                self.stats["compactions"] += 1
+
+        log.info(f"Compacted {self.path} to {self.size} bytes")
+
+    def get_stats(self) -> dict:
+        with self.lock:
+            stats = dict(self.stats)
+            stats["log_bytes"] = self.size
+            stats["garbage_bytes"] = self.garbage
+            stats["bytes"] = self.size - self.garbage
+        stats["backend"] = STORAGE_LOG
+        stats["keys"] = len(self.index)
+        return stats
+
+    def close(self):
+        self.stop_event.set()
+        self.thread.join()
+        self.sync()
+        with self.lock:
+            if self.map is not None:
+                self.map.close()
+            self.file.close()
+
+
+def open_storage(
+    backend: str, data_dir: str, name: str, hash: Callable[[str], int]
+) -> MemoryStorage | LogStorage:
+    """
+    Opens the storage backend with the given name, whose keys are ordered by
+    the ids the hash function gives them.
+    """
+    if backend == STORAGE_LOG:
+        path = os.path.join(os.path.expanduser(data_dir), f"{name}.log")
+        return LogStorage(path, hash)
+    return MemoryStorage(hash)
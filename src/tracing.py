@@ -0,0 +1,38 @@
+import os
+from contextvars import ContextVar
+from typing import List
+
+# Requests that are part of a trace carry its id, and lookup and value
+# responses list the node id and milliseconds spent of each hop
+TRACE_ID_HEADER = "X-Chord-Trace-Id"
+TRACE_HEADER = "X-Chord-Trace"
+
+# The trace of the request being handled, which is sent along with the
+# requests made to other nodes while handling it
+current_trace: ContextVar[str | None] = ContextVar("current_trace", default=None)
+
+
+def new_trace_id() -> str:
+    return os.urandom(8).hex()
+
+
+def format_hop(node_id: int, seconds: float) -> str:
+    return f"{node_id}:{seconds * 1000:.3f}"
+
+
+def read_trace(response) -> List[str]:
+    """
+    Get the hops a node returned in its trace header, if any.
+    """
+    if response is None:
+        return []
+    trace = response.headers.get(TRACE_HEADER)
+    return trace.split(",") if trace else []
+
+
+def parse_hops(hops: List[str]) -> List[dict]:
+    parsed = []
+    for hop in hops:
+        node_id, _, ms = hop.partition(":")
+        parsed.append({"node_id": int(node_id), "ms": float(ms)})
+    return parsed
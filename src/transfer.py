@@ -0,0 +1,142 @@
+import json
+import logging as log
+import time
+from threading import Lock
+from typing import Dict, Iterable, Iterator, List, Tuple
+
+from storage import value_from_json, value_to_json
+
+# Key value pairs sent in each chunk of a range transfer
+TRANSFER_CHUNK_KEYS = 256
+TRANSFER_READ_SIZE = 64 * 1024
+# Finished transfers kept for the stats
+TRANSFER_HISTORY = 10
+
+RANGE_CONTENT_TYPE = "application/x-ndjson"
+
+
+class TransferProgress:
+    """
+    How many keys and bytes a range transfer has moved so far.
+    """
+
+    def __init__(self, direction: str, peer: str):
+        self.direction = direction
+        self.peer = peer
+        self.started = time.monotonic()
+        self.finished: float | None = None
+        self.ok = False
+        self.keys = 0
+        self.bytes = 0
+
+    def add(self, keys: int, size: int):
+        self.keys += keys
+        self.bytes += size
+
+    def get_stats(self) -> dict:
+        seconds = (self.finished or time.monotonic()) - self.started
+        return {
+            "direction": self.direction,
+            "peer": self.peer,
+            "ok": self.ok,
+            "keys": self.keys,
+            "bytes": self.bytes,
+            "seconds": round(seconds, 3),
+            "keys_per_second": round(self.keys / seconds) if seconds else 0,
+            "bytes_per_second": round(self.bytes / seconds) if seconds else 0,
+        }
+
+
+class TransferStats:
+    """
+    Totals of the range transfers of a node, and the progress of running ones.
+    """
+
+    def __init__(self):
+        self.lock = Lock()
+        self.active: List[TransferProgress] = []
+        self.history: List[TransferProgress] = []
+        self.totals = {"sent_keys": 0, "received_keys": 0, "failed": 0}
+
+    def start(self, direction: str, peer: str) -> TransferProgress:
+        progress = TransferProgress(direction, peer)
+        with self.lock:
+            self.active.append(progress)
+        return progress
+
+    def finish(self, progress: TransferProgress, ok: bool = True):
+        progress.finished = time.monotonic()
+        progress.ok = ok
+        with self.lock:
+            self.active.remove(progress)
+            self.history = (self.history + [progress])[-TRANSFER_HISTORY:]
+            if ok:
+                self.totals[f"{progress.direction}_keys"] += progress.keys
+            else:
+                self.totals["failed"] += 1
+
+        stats = progress.get_stats()
+        log.info(
+            f"Range transfer {progress.direction} {stats['keys']} keys "
+            f"({stats['bytes']} bytes) with {progress.peer} in {stats['seconds']}s, "
+            f"ok: {ok}"
+        )
+
+    def get_stats(self) -> dict:
+        with self.lock:
+            stats = dict(self.totals)
+            stats["active"] = [progress.get_stats() for progress in self.active]
+            stats["recent"] = [progress.get_stats() for progress in self.history]
+        return stats
+
+
+def encode_pairs(
+    pairs: Iterable[Tuple[str, bytes]], progress: TransferProgress
+) -> Iterator[bytes]:
+    """
+    Encodes key value pairs as chunks of JSON lines. Values that aren't
+    UTF-8 are sent as {"base64": <value>}.
+    """
+    lines = []
+    for key, value in pairs:
+        lines.append(json.dumps([key, value_to_json(value)]))
+        if len(lines) == TRANSFER_CHUNK_KEYS:
+            chunk = ("\n".join(lines) + "\n").encode("utf-8")
+            progress.add(len(lines), len(chunk))
+            yield chunk
+            lines = []
+
+    if lines:
+        chunk = ("\n".join(lines) + "\n").encode("utf-8")
+        progress.add(len(lines), len(chunk))
+        yield chunk
+
+
+def decode_pairs(chunks: Iterable[bytes]) -> Iterator[Tuple[Dict[str, bytes], int]]:
+    """
+    Decodes chunks of JSON lines, which may be split anywhere, into batches
+    of key value pairs. Yields each batch and its size in bytes.
+    """
+    buffer = b""
+    for chunk in chunks:
+        buffer += chunk
+        complete, _, buffer = buffer.rpartition(b"\n")
+        if not complete:
+            continue
+
+        pairs = {}
+        for line in complete.split(b"\n"):
+            if not line:
+                continue
+            pair = json.loads(line)
+            if not isinstance(pair, list) or len(pair) != 2:
+                raise ValueError("Range transfer line isn't a [key, value] pair")
+            key, value = pair
+            try:
+                pairs[str(key)] = value_from_json(value)
+            except TypeError:
+                raise ValueError("Range transfer value isn't a string or base64")
+        yield pairs, len(complete) + 1
+
+    if buffer.strip():
+        raise ValueError("Range transfer ended with a partial line")
@@ -0,0 +1,197 @@
+import logging as log
+import random
+from threading import Lock
+from typing import Callable, List, Set, Tuple
+
+import metrics
+import periodic
+from chord_node import ChordNode
+from maintenance import MAX_MAINTENANCE_INTERVAL, Maintenance
+from peers import VNODE_PREFIX, ring_id, vnode_address
+
+# Routes that apply to every vnode of the process when sent under this prefix,
+# such as POST /vnodes/join
+ALL_VNODES_PREFIX = "/vnodes"
+ALL_VNODES_ROUTES = ("/join", "/leave", "/sim-crash", "/sim-recover")
+
+
+class VirtualNodes:
+    """
+    The vnodes hosted by one process behind a single HTTP server. Each vnode
+    is a ChordNode with its own id, finger table and storage, while the
+    connection pools and the periodic function threads are shared.
+    """
+
+    def __init__(self, ip: str, port: int, m: int, count: int = 1, **node_options):
+        self.ip = ip
+        self.port = port
+        self.m = m
+        # Vnodes whose periodic functions are stopped, such as during sim-crash
+        self.paused: Set[ChordNode] = set()
+        self.lock = Lock()
+        # Port of the binary RPC server, advertised in HTTP responses
+        self.rpc_port: int | None = None
+        self.maintenance = self.create_maintenance(
+            node_options.get("max_maintenance_interval", MAX_MAINTENANCE_INTERVAL)
+        )
+
+        self.nodes: List[ChordNode] = []
+        for vnode in range(count):
+            address = vnode_address(ip, port, vnode)
+            self.nodes.append(
+                self.create_node(
+                    ip=ip,
+                    port=port,
+                    id=ring_id(address, m),
+                    m=m,
+                    vnode=vnode,
+                    group=self,
+                    **node_options,
+                )
+            )
+            log.info(
+                f"Vnode {vnode} initialized: {address} with ID {self.nodes[-1].id}"
+            )
+
+        self.link_ring()
+        self.register_metrics()
+        self.start_periodic_functions()
+
+    def create_node(self, **kwargs) -> ChordNode:
+        return ChordNode(**kwargs)
+
+    def create_maintenance(self, max_interval: float) -> Maintenance:
+        return Maintenance(max_interval)
+
+    def link_ring(self):
+        """
+        Link the vnodes into a ring of their own, so the whole process is in
+        the ring when another process joins it. Joining another ring moves
+        each vnode to that ring.
+        """
+        ring = sorted(self.nodes, key=lambda node: node.id)
+        if len(ring) < 2:
+            return
+        for i, node in enumerate(ring):
+            node.successor = ring[(i + 1) % len(ring)].address
+            node.predecessor = ring[i - 1].address
+
+    def register_metrics(self):
+        for stat in ("keys", "bytes"):
+            metrics.registry.register(
+                metrics.Gauge(
+                    f"chord_storage_{stat}",
+                    f"Stored {stat} of each vnode, as owner or replica.",
+                    ("vnode", "store"),
+                    lambda stat=stat: self.collect_storage(stat),
+                )
+            )
+        metrics.registry.register(
+            metrics.Gauge(
+                "chord_maintenance_interval_seconds",
+                "Current seconds between runs of each maintenance task.",
+                ("task",),
+                self.maintenance.collect_intervals,
+            )
+        )
+
+    def collect_storage(self, stat: str) -> List[Tuple[Tuple[str, str], float]]:
+        samples = []
+        for node in self.nodes:
+            for store, storage in (("owner", node.storage), ("replica", node.replicas)):
+                samples.append(((str(node.vnode), store), storage.get_stats()[stat]))
+        return samples
+
+    def resolve(self, path: str) -> Tuple[ChordNode | None, str]:
+        """
+        Get the vnode a request path is for, and the path without its vnode
+        prefix. Paths without a prefix are for the first vnode, and so are
+        those for all vnodes, which HTTPHandler applies to each.
+        """
+        if path.startswith(ALL_VNODES_PREFIX + "/"):
+            route = path[len(ALL_VNODES_PREFIX) :]
+            if route.partition("?")[0] not in ALL_VNODES_ROUTES:
+                return None, path
+            return self.nodes[0], route
+
+        if not path.startswith(VNODE_PREFIX):
+            return self.nodes[0], path
+
+        index, slash, rest = path[len(VNODE_PREFIX) :].partition("/")
+        if not index.isdigit() or int(index) >= len(self.nodes):
+            return None, path
+        return self.nodes[int(index)], slash + rest
+
+    def pause(self, node: ChordNode):
+        with self.lock:
+            self.paused.add(node)
+
+    def resume(self, node: ChordNode):
+        with self.lock:
+            self.paused.discard(node)
+
+    def active_nodes(self) -> List[ChordNode]:
+        with self.lock:
+            return [node for node in self.nodes if node not in self.paused]
+
+    def run_all(self, func: Callable[[ChordNode], None]):
+        """
+        Run a periodic function of each active vnode, in random order so no
+        vnode is always last.
+        """
+        nodes = self.active_nodes()
+        random.shuffle(nodes)
+        for node in nodes:
+            try:
+                func(node)
+            except Exception:
+                log.exception(f"Periodic function of {node.address} failed")
+
+    def stabilize(self):
+        self.run_all(lambda node: node.stabilize())
+
+    def fix_fingers(self):
+        self.run_all(lambda node: node.fix_fingers())
+
+    def check_predecessor(self):
+        self.run_all(lambda node: node.check_predecessor())
+
+    def start_periodic_functions(self):
+        self.jobs = [
+            periodic.scheduler.add(func, self.maintenance.tasks[func.__name__])
+            for func in [self.stabilize, self.fix_fingers, self.check_predecessor]
+        ]
+
+    def get_balance(self) -> dict:
+        """
+        Reports the share of the ring each vnode owns, from its predecessor's
+        id to its own, and how many keys it stores.
+        """
+        ring_size = 2**self.m
+        vnodes = []
+        for node in self.nodes:
+            if node.successor == node.address:
+                share = 1.0
+            elif node.predecessor is None:
+                share = None
+            else:
+                share = ((node.id - node.peer_id(node.predecessor)) % ring_size) / (
+                    ring_size
+                )
+            vnodes.append(
+                {
+                    "address": node.address,
+                    "id": node.id,
+                    "predecessor": node.predecessor,
+                    "share": share,
+                    "keys": len(node.storage),
+                }
+            )
+
+        shares = [vnode["share"] for vnode in vnodes if vnode["share"] is not None]
+        return {
+            "endpoint": f"{self.ip}:{self.port}",
+            "vnodes": vnodes,
+            "share": sum(shares) if len(shares) == len(vnodes) else None,
+            "keys": sum(vnode["keys"] for vnode in vnodes),
+        }
@@ -1,4 +1,5 @@
 import requests
+import socket
 import sys
 
 BASE = ""
@@ -13,6 +14,19 @@ def test_put_storage():
     print("PUT /storage/testkey:", r.status_code, r.text)
     assert r.status_code == 200, "put returned not 200"
 
+def test_malformed_chunked_body():
+    host, port = BASE.rsplit(":", 1)
+    with socket.create_connection((host, int(port)), timeout=10) as sock:
+        sock.sendall(
+            b"PUT /storage/testkey HTTP/1.1\r\n"
+            b"Host: " + BASE.encode() + b"\r\n"
+            b"Transfer-Encoding: chunked\r\n\r\n"
+            b"zz\r\ntestvalue\r\n0\r\n\r\n"
+        )
+        status_line = sock.makefile("rb").readline().decode()
+    print("PUT /storage/testkey with a malformed chunked body:", status_line.strip())
+    assert status_line.split()[1] == "400", "malformed chunked body returned not 400"
+
 def test_node_info():
     r = requests.get(f"http://{BASE}/node-info")
     try:
@@ -52,7 +66,7 @@ def test_join():
     assert r.status_code == 200, "join returned not 200"
 
 def run_tests():
-    tests = [test_put_storage, test_get_storage, test_node_info,
+    tests = [test_put_storage, test_get_storage, test_malformed_chunked_body, test_node_info,
              test_leave, test_sim_crash, test_sim_recover, test_join]
     
     for test in tests:
@@ -0,0 +1,62 @@
+import random
+import statistics
+import sys
+import time
+
+import requests
+
+MODES = ["recursive", "iterative"]
+
+
+def percentile(values: list, p: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(p / 100 * len(values)))]
+
+
+def run(nodes: list, num_lookups: int, mode: str, m: int):
+    """
+    Looks up random ids through random nodes, and prints the latency and
+    number of hops of the lookups.
+    """
+    session = requests.Session()
+    latencies = []
+    hops = []
+    failed = 0
+    for _ in range(num_lookups):
+        node = random.choice(nodes)
+        id = random.randrange(2**m)
+
+        start = time.perf_counter()
+        response = session.get(f"http://{node}/find_successor/{id}?mode={mode}")
+        elapsed = time.perf_counter() - start
+
+        if response.status_code != 200:
+            failed += 1
+            continue
+        latencies.append(elapsed * 1000)
+        hops.append(int(response.headers.get("X-Chord-Hops", 0)))
+
+    if not latencies:
+        print(f"{mode}: all {failed} lookups failed")
+        return
+
+    print(
+        f"{mode}: {len(latencies)} lookups, {failed} failed\n"
+        f"    latency ms: mean {statistics.mean(latencies):.2f}"
+        f"  p50 {percentile(latencies, 50):.2f}"
+        f"  p95 {percentile(latencies, 95):.2f}"
+        f"  p99 {percentile(latencies, 99):.2f}\n"
+        f"    hops: mean {statistics.mean(hops):.2f}  max {max(hops)}"
+    )
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 4:
+        print("Usage: <num_lookups> <m> <host:port> [host:port ...]")
+        sys.exit(1)
+    num_lookups = int(sys.argv[1])
+    m = int(sys.argv[2])
+    nodes = sys.argv[3:]
+
+    for mode in MODES:
+        run(nodes, num_lookups, mode, m)
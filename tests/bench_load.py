@@ -0,0 +1,309 @@
+import argparse
+import bisect
+import http.client
+import json
+import os
+import random
+import subprocess
+import time
+from threading import Event, Lock, Thread
+from typing import Dict, List, Tuple
+
+DISTRIBUTION_UNIFORM = "uniform"
+DISTRIBUTION_ZIPF = "zipf"
+DISTRIBUTIONS = [DISTRIBUTION_UNIFORM, DISTRIBUTION_ZIPF]
+PERCENTILES = [50, 95, 99, 99.9]
+TIMEOUT = 10
+
+# A finished request: seconds since the start, operation, latency in seconds,
+# and status, which is None if the node couldn't be reached
+Sample = Tuple[float, str, float, int | None]
+
+
+def arg_parser():
+    parser = argparse.ArgumentParser(description="Chord load generator")
+    parser.add_argument("endpoints", nargs="+", help="nodes (ip:port) to send to")
+    parser.add_argument(
+        "--concurrency", type=int, default=16, help="requests in flight at once"
+    )
+    parser.add_argument(
+        "--duration", type=float, default=30, help="seconds to send requests for"
+    )
+    parser.add_argument(
+        "--read-ratio", type=float, default=0.9, help="share of requests that read"
+    )
+    parser.add_argument(
+        "--keys", type=int, default=10000, help="number of distinct keys"
+    )
+    parser.add_argument(
+        "--distribution",
+        choices=DISTRIBUTIONS,
+        default=DISTRIBUTION_UNIFORM,
+        help="how often each key is picked",
+    )
+    parser.add_argument(
+        "--zipf-exponent",
+        type=float,
+        default=0.99,
+        help="skew of the zipf distribution, higher picks the hot keys more",
+    )
+    parser.add_argument(
+        "--value-size",
+        type=int,
+        nargs=2,
+        default=[100, 100],
+        metavar=("MIN", "MAX"),
+        help="range of value sizes in bytes",
+    )
+    parser.add_argument(
+        "--preload",
+        action=argparse.BooleanOptionalAction,
+        default=True,
+        help="write every key once before the run, so reads find a value",
+    )
+    parser.add_argument(
+        "--interval", type=float, default=1, help="seconds per reported interval"
+    )
+    parser.add_argument("--output", help="file to write the results to as JSON")
+    parser.add_argument("--seed", type=int, help="seed of the random choices")
+    return parser
+
+
+class KeyChooser:
+    """
+    Picks keys uniformly or by a zipf distribution. The popular ranks are
+    given random keys, so the hot keys are spread over the ring.
+    """
+
+    def __init__(self, num_keys: int, distribution: str, exponent: float, rng):
+        self.keys = [f"key-{i}" for i in range(num_keys)]
+        rng.shuffle(self.keys)
+        self.cumulative = None
+        if distribution == DISTRIBUTION_ZIPF:
+            total = 0.0
+            self.cumulative = []
+            for rank in range(1, num_keys + 1):
+                total += 1 / rank**exponent
+                self.cumulative.append(total)
+
+    def choose(self, rng) -> str:
+        if self.cumulative is None:
+            return rng.choice(self.keys)
+        index = bisect.bisect_left(self.cumulative, rng.random() * self.cumulative[-1])
+        return self.keys[min(index, len(self.keys) - 1)]
+
+
+class Recorder:
+    """
+    Collects the samples of all workers.
+    """
+
+    def __init__(self):
+        self.lock = Lock()
+        self.samples: List[Sample] = []
+
+    def add(self, sample: Sample):
+        with self.lock:
+            self.samples.append(sample)
+
+    def since(self, start: int) -> List[Sample]:
+        with self.lock:
+            return self.samples[start:]
+
+
+def send(
+    conns: Dict[str, http.client.HTTPConnection],
+    endpoint: str,
+    method: str,
+    path: str,
+    body: bytes | None = None,
+) -> int | None:
+    """
+    Send a request over the worker's keep-alive connection to the node,
+    reconnecting once if the connection was closed.
+    Returns the status, or None if the node couldn't be reached.
+    """
+    for attempt in range(2):
+        conn = conns.get(endpoint)
+        if conn is None:
+            host, port = endpoint.rsplit(":", 1)
+            conn = conns[endpoint] = http.client.HTTPConnection(
+                host, int(port), timeout=TIMEOUT
+            )
+        try:
+            conn.request(method, path, body=body)
+            response = conn.getresponse()
+            response.read()
+            if response.will_close:
+                conn.close()
+                del conns[endpoint]
+            return response.status
+        except (http.client.HTTPException, OSError):
+            conn.close()
+            del conns[endpoint]
+    return None
+
+
+def worker(args, chooser: KeyChooser, recorder: Recorder, started, stop: Event, rng):
+    conns: Dict[str, http.client.HTTPConnection] = {}
+    min_size, max_size = args.value_size
+    while not stop.is_set():
+        endpoint = rng.choice(args.endpoints)
+        key = chooser.choose(rng)
+        if rng.random() < args.read_ratio:
+            op, method, body = "read", "GET", None
+        else:
+            op, method = "write", "PUT"
+            body = rng.randbytes(rng.randint(min_size, max_size) // 2).hex().encode()
+
+        sent = time.perf_counter()
+        status = send(conns, endpoint, method, f"/storage/{key}", body)
+        finished = time.perf_counter()
+        recorder.add((finished - started, op, finished - sent, status))
+
+    for conn in conns.values():
+        conn.close()
+
+
+def preload(args, chooser: KeyChooser, rng):
+    """
+    Writes every key once, so reads during the run find values.
+    """
+    conns: Dict[str, http.client.HTTPConnection] = {}
+    failed = 0
+    for i, key in enumerate(chooser.keys):
+        size = rng.randint(*args.value_size)
+        body = rng.randbytes(size // 2).hex().encode()
+        endpoint = args.endpoints[i % len(args.endpoints)]
+        if send(conns, endpoint, "PUT", f"/storage/{key}", body) != 200:
+            failed += 1
+    if failed:
+        print(f"Preload: {failed} of {len(chooser.keys)} writes failed")
+
+
+def percentile(values: List[float], p: float) -> float:
+    return values[min(len(values) - 1, int(p / 100 * len(values)))]
+
+
+def summarize(samples: List[Sample], seconds: float) -> dict:
+    """
+    Throughput, errors and latency percentiles in ms of the samples, for all
+    requests and per operation.
+    """
+    summary = {}
+    for op in ("all", "read", "write"):
+        ops = [sample for sample in samples if op == "all" or sample[1] == op]
+        latencies = sorted(sample[2] * 1000 for sample in ops)
+        statuses: Dict[str, int] = {}
+        for sample in ops:
+            status = str(sample[3]) if sample[3] is not None else "unreachable"
+            statuses[status] = statuses.get(status, 0) + 1
+        summary[op] = {
+            "requests": len(ops),
+            "throughput": round(len(ops) / seconds, 1) if seconds else 0,
+            "errors": sum(1 for sample in ops if sample[3] is None or sample[3] >= 500),
+            "statuses": statuses,
+            "latency_ms": {
+                f"p{p:g}": round(percentile(latencies, p), 3) if latencies else None
+                for p in PERCENTILES
+            }
+            | {
+                "mean": round(sum(latencies) / len(latencies), 3) if latencies else None
+            },
+        }
+    return summary
+
+
+def format_row(label: str, summary: dict) -> str:
+    all = summary["all"]
+    latencies = [all["latency_ms"][f"p{p:g}"] for p in PERCENTILES]
+    columns = [f"{'-' if value is None else f'{value:.2f}':>8}" for value in latencies]
+    return f"{label:>8} {all['throughput']:>9} {all['errors']:>6} " + " ".join(columns)
+
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(args) -> dict:
+    """
+    Sends requests from the workers for the duration, printing the
+    throughput and latency of each interval as it ends.
+    """
+    rng = random.Random(args.seed)
+    chooser = KeyChooser(args.keys, args.distribution, args.zipf_exponent, rng)
+    if args.preload:
+        preload(args, chooser, rng)
+
+    recorder = Recorder()
+    stop = Event()
+    started = time.perf_counter()
+    workers = [
+        Thread(
+            target=worker,
+            args=(args, chooser, recorder, started, stop, random.Random(rng.random())),
+            daemon=True,
+        )
+        for _ in range(args.concurrency)
+    ]
+    for thread in workers:
+        thread.start()
+
+    header = " ".join(f"{f'p{p:g} ms':>8}" for p in PERCENTILES)
+    print(f"{'seconds':>8} {'req/s':>9} {'errors':>6} {header}")
+    intervals = []
+    seen = 0
+    end = started + args.duration
+    while (now := time.perf_counter()) < end:
+        time.sleep(min(args.interval, end - now))
+        samples = recorder.since(seen)
+        seen += len(samples)
+        elapsed = time.perf_counter() - started
+        seconds = elapsed - (intervals[-1]["end"] if intervals else 0)
+        summary = summarize(samples, seconds)
+        intervals.append({"end": round(elapsed, 3), **summary})
+        print(format_row(f"{elapsed:.0f}", summary))
+
+    stop.set()
+    for thread in workers:
+        thread.join()
+
+    # Requests finished after the last interval are left out, so the
+    # totals cover the same time as the intervals
+    samples = [sample for sample in recorder.since(0) if sample[0] <= args.duration]
+    total = summarize(samples, args.duration)
+    print(format_row("total", total))
+    for op in ("read", "write"):
+        latency = total[op]["latency_ms"]
+        print(
+            f"{op}: {total[op]['requests']} requests, statuses {total[op]['statuses']}, "
+            f"mean {latency['mean']} ms, p999 {latency['p99.9']} ms"
+        )
+
+    return {
+        "commit": git_commit(),
+        "timestamp": time.time(),
+        "config": {
+            name: value for name, value in vars(args).items() if name != "output"
+        },
+        "total": total,
+        "intervals": intervals,
+    }
+
+
+if __name__ == "__main__":
+    args = arg_parser().parse_args()
+    results = run(args)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"Results written to {args.output}")
@@ -0,0 +1,89 @@
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+import chord_client  # noqa: E402
+from chord_node import ChordNode  # noqa: E402
+from peers import ring_id  # noqa: E402
+
+QUIET_EVENTS = ["found_successor", "passing_successor_check", "fix_fingers"]
+
+
+class BenchNode(ChordNode):
+    """
+    A node without periodic functions, so only the benchmarked code runs.
+    """
+
+    def start_periodic_functions(self):
+        pass
+
+
+def build_node(num_peers: int, m: int) -> ChordNode:
+    """
+    Builds a node whose successor and fingers point at made up peers, which
+    are all marked as alive so no requests are sent.
+    """
+    peers = [f"10.0.{i // 256}.{i % 256}:8000" for i in range(num_peers)]
+    ids = sorted((ring_id(peer, m), peer) for peer in peers)
+    address = peers[0]
+
+    node = BenchNode(
+        ip=address.split(":")[0],
+        port=8000,
+        id=ring_id(address, m),
+        m=m,
+        log_options={"sample_rates": {event: 0 for event in QUIET_EVENTS}},
+    )
+
+    def successor_of(id: int) -> str:
+        for peer_id, peer in ids:
+            if peer_id >= id:
+                return peer
+        return ids[0][1]
+
+    node.successor = successor_of((node.id + 1) % 2**m)
+    node.predecessor = ids[ids.index((node.id, address)) - 1][1]
+    for i in range(1, m + 1):
+        node.finger_table[i] = successor_of(node.finger_starts[i])
+
+    chord_client.configure(liveness_ttl=float("inf"))
+    for peer in peers:
+        chord_client.liveness.mark_alive(peer)
+    return node
+
+
+def run(node: ChordNode, ids, rounds: int) -> float:
+    """
+    Runs the local part of a lookup hop for each id.
+    Returns the CPU time per hop in microseconds.
+    """
+    start = time.process_time()
+    for _ in range(rounds):
+        for id in ids:
+            node.next_hop(id)
+            node.owns(id)
+    return (time.process_time() - start) / (rounds * len(ids)) * 1e6
+
+
+if __name__ == "__main__":
+    num_peers = int(sys.argv[1]) if len(sys.argv) > 1 else 64
+    m = int(sys.argv[2]) if len(sys.argv) > 2 else 32
+    rounds = 20
+
+    node = build_node(num_peers, m)
+    ids = [random.randrange(2**m) for _ in range(1000)]
+    run(node, ids, 1)
+
+    cached = run(node, ids, rounds)
+
+    # Hash peer addresses on every use, like before peer ids were cached
+    node.peer_id = node.hash
+    hashed = run(node, ids, rounds)
+
+    print(f"{num_peers} peers, m = {m}")
+    print(f"Hashing peer addresses: {hashed:.2f} us per hop")
+    print(f"Cached peer ids:        {cached:.2f} us per hop")
+    print(f"Speedup:                {hashed / cached:.2f}x")
@@ -0,0 +1,142 @@
+import bisect
+import logging
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from chord_node import LOOKUP_MODES  # noqa: E402
+from maintenance import MAX_MAINTENANCE_INTERVAL  # noqa: E402
+from simulator import CoordinateLatency, Simulator  # noqa: E402
+
+# Simulated seconds between joins, and between checks of the ring
+JOIN_INTERVAL = 1
+CHECK_INTERVAL = 1
+MAX_CONVERGENCE = 600
+STEADY_SECONDS = 30
+
+
+def percentile(values: list, p: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(p / 100 * len(values)))]
+
+
+def true_successor(ring: list, id: int):
+    """
+    Get the node owning an id, from the (id, node) pairs sorted by id.
+    """
+    i = bisect.bisect_left(ring, (id,))
+    return ring[i % len(ring)][1]
+
+
+def ring_state(sim: Simulator):
+    """
+    Get the share of nodes whose successor and predecessor are right, and
+    the share of fingers that are right.
+    """
+    nodes = sim.nodes()
+    ring = sorted((node.id, node) for node in nodes)
+    right = fingers = 0
+    for i, (id, node) in enumerate(ring):
+        successor = ring[(i + 1) % len(ring)][1]
+        predecessor = ring[i - 1][1]
+        right += (
+            node.successor == successor.address
+            and node.predecessor == predecessor.address
+        )
+        fingers += sum(
+            node.finger_table[j] == true_successor(ring, node.finger_starts[j]).address
+            for j in range(1, sim.m + 1)
+        )
+    return right / len(nodes), fingers / (len(nodes) * sim.m)
+
+
+def build(sim: Simulator, num_nodes: int, max_interval: float):
+    """
+    Adds the nodes one at a time, each joining through a random node, and
+    runs the ring until the successors and fingers of all nodes are right.
+    Returns the simulated seconds the ring took to converge after the last join.
+    """
+    first = sim.add_host("10.0.0.0", 8000, max_maintenance_interval=max_interval)
+    first.nodes[0].create()
+    for i in range(1, num_nodes):
+        sim.run_for(JOIN_INTERVAL)
+        other = random.choice(sim.nodes()).address
+        host = sim.add_host(
+            f"10.0.{i // 256}.{i % 256}", 8000, max_maintenance_interval=max_interval
+        )
+        sim.join(host, other)
+
+    joined = sim.now
+    while sim.now - joined < MAX_CONVERGENCE:
+        successors, fingers = ring_state(sim)
+        if successors == 1 and fingers == 1:
+            return sim.now - joined
+        sim.run_for(CHECK_INTERVAL)
+    print(f"Not converged: {successors:.1%} successors, {fingers:.1%} fingers right")
+    return None
+
+
+def maintenance(sim: Simulator, num_nodes: int):
+    """
+    Prints the messages each node sends per second in a stable ring.
+    """
+    sim.transport.messages.clear()
+    sim.run_for(STEADY_SECONDS)
+    messages = sim.transport.messages
+    total = sum(messages.values()) / num_nodes / STEADY_SECONDS
+    print(f"Maintenance: {total:.2f} messages per node per second")
+    for route, count in sorted(messages.items(), key=lambda item: -item[1]):
+        print(f"    {route:<24} {count / num_nodes / STEADY_SECONDS:.2f}")
+
+
+def lookups(sim: Simulator, num_lookups: int, mode: str):
+    """
+    Looks up random ids through random nodes, and prints how many hops and
+    how much simulated round trip time they took.
+    """
+    nodes = sim.nodes()
+    ring = sorted((node.id, node) for node in nodes)
+    hops = []
+    latencies = []
+    wrong = 0
+    for _ in range(num_lookups):
+        node = random.choice(nodes)
+        id = random.randrange(2**sim.m)
+        result, spent = sim.transport.run_as(node.address, node.lookup, id, mode)
+        if result is None or result.successor != true_successor(ring, id).address:
+            wrong += 1
+            continue
+        hops.append(result.hops)
+        latencies.append(spent * 1000)
+
+    print(
+        f"{mode}: {len(hops)} lookups, {wrong} failed or wrong\n"
+        f"    hops: mean {statistics.mean(hops):.2f}  p99 {percentile(hops, 99)}"
+        f"  max {max(hops)}\n"
+        f"    simulated latency ms: mean {statistics.mean(latencies):.1f}"
+        f"  p50 {percentile(latencies, 50):.1f}  p95 {percentile(latencies, 95):.1f}"
+    )
+
+
+if __name__ == "__main__":
+    num_nodes = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    m = int(sys.argv[2]) if len(sys.argv) > 2 else 32
+    num_lookups = int(sys.argv[3]) if len(sys.argv) > 3 else 1000
+    max_interval = float(sys.argv[4]) if len(sys.argv) > 4 else MAX_MAINTENANCE_INTERVAL
+    random.seed(0)
+    logging.disable(logging.WARNING)
+
+    started = time.perf_counter()
+    sim = Simulator(m, CoordinateLatency(seed=0), seed=0)
+    converged = build(sim, num_nodes, max_interval)
+    print(f"{num_nodes} nodes, m = {m}")
+    if converged is not None:
+        print(f"Converged {converged:.0f} simulated seconds after the last join")
+    maintenance(sim, num_nodes)
+    for mode in LOOKUP_MODES:
+        lookups(sim, num_lookups, mode)
+    print(f"Ran in {time.perf_counter() - started:.1f}s")
@@ -0,0 +1,39 @@
+import statistics
+import sys
+
+import requests
+
+
+def report(endpoints: list):
+    """
+    Prints the share of the ring and the number of keys each process owns,
+    summed over its vnodes, and how far the largest is from the mean.
+    """
+    processes = []
+    for endpoint in endpoints:
+        response = requests.get(f"http://{endpoint}/vnodes")
+        response.raise_for_status()
+        processes.append(response.json())
+
+    print(f"{'process':<24} {'vnodes':>6} {'share':>8} {'keys':>8}")
+    for process in processes:
+        # The share is unknown until all vnodes have a predecessor
+        share = "?" if process["share"] is None else f"{process['share']:.2%}"
+        print(
+            f"{process['endpoint']:<24} {len(process['vnodes']):>6}"
+            f" {share:>8} {process['keys']:>8}"
+        )
+
+    shares = [process["share"] or 0 for process in processes]
+    keys = [process["keys"] for process in processes]
+    if sum(shares):
+        print(f"Max / mean share: {max(shares) / statistics.mean(shares):.2f}")
+    if sum(keys):
+        print(f"Max / mean keys:  {max(keys) / statistics.mean(keys):.2f}")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("Usage: <host:port> [host:port ...]")
+        sys.exit(1)
+    report(sys.argv[1:])
@@ -3,12 +3,14 @@ import time
 
 
 def leave_ring(node: str):
-    response = requests.post(f"http://{node}/leave")
+    response = requests.post(f"http://{node}/vnodes/leave")
     print(f"    {node} LEAVE response: {response.status_code}")
 
 
 def join_ring(new_node, existing_ring_node):
-    response = requests.post(f"http://{new_node}/join?nprime={existing_ring_node}")
+    response = requests.post(
+        f"http://{new_node}/vnodes/join?nprime={existing_ring_node}"
+    )
     if response.status_code != 200:
         print(f"    {new_node} JOIN response: {response.status_code}.")
 
@@ -41,12 +43,12 @@ def get_successor(node):
 
 
 def sim_crash(node: str):
-    response = requests.post(f"http://{node}/sim-crash")
+    response = requests.post(f"http://{node}/vnodes/sim-crash")
     print(f"    {node} SIM-CRASH response: {response.status_code}")
 
 
 def sim_recover(node: str):
-    response = requests.post(f"http://{node}/sim-recover")
+    response = requests.post(f"http://{node}/vnodes/sim-recover")
     print(f"    {node} SIM-RECOVER response: {response.status_code}")
 
 